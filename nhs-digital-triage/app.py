@@ -1,9 +1,14 @@
 import os
+import atexit
 import uuid
 import json
 import logging
 import time
+import queue
+import threading
 import importlib.util
+from collections import namedtuple
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
@@ -11,13 +16,33 @@ from functools import wraps
 import httpx
 from flask import (
     Flask, Response, jsonify, render_template, request, session, 
-    stream_with_context, redirect, url_for, flash, abort, current_app
+    stream_with_context, redirect, url_for, flash, abort, current_app,
+    has_app_context, has_request_context
 )
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import text
+from sqlalchemy import text, select, func, case, exists, and_, or_
+
+from ollama_client import NDJSONDecoder, OllamaHTTPClients, OllamaHostPool
+from response_cache import ResponseCache
+from rate_limiter import RateLimit, RateLimiter, RateLimitResult
+from log_writer import BatchLogWriter
+from circuit_breaker import ModelFailover
+from model_router import LoadAdaptiveRouter
+from hedging import END, STATUS, TEXT, HedgePolicy, HedgeRace, ThreadedAttempt
+from model_warmup import WARMING, ModelWarmer
+from retention import RetentionJob, purge_in_batches
+from sqlite_tuning import DEFAULT_PRAGMAS, create_read_engine, install_pragmas, is_file_sqlite, set_journal_mode
+from stats_snapshot import TTLSnapshot
+from event_bus import EventBus, RESYNC
+from keyword_matcher import get_matcher as get_keyword_matcher
+from urgency_classifier import EMERGENCY, LEVELS, UNASSESSED, UrgencyClassifier, UrgencyResult, classify_urgency
+from generation_scheduler import (
+    GenerationQueueFull, GenerationScheduler,
+    PRIORITY_EMERGENCY, PRIORITY_TRIAGE, PRIORITY_CHAT
+)
 
 # Import configuration
 try:
@@ -80,7 +105,23 @@ def create_app(config_name=None):
     
     # Initialize extensions
     db.init_app(app)
+    init_database_engines(app)
     CORS(app)
+    init_ollama_clients(app)
+    init_ollama_pool(app)
+    app.extensions['generation_scheduler'] = GenerationScheduler.from_config(app.config)
+    app.extensions['response_cache'] = ResponseCache.from_config(app.config)
+    app.extensions['model_failover'] = ModelFailover.from_config(app.config)
+    app.extensions['model_router'] = LoadAdaptiveRouter.from_config(app.config)
+    app.extensions['hedge_policy'] = HedgePolicy.from_config(app.config)
+    app.extensions['rate_limiter'] = RateLimiter.from_config(app.config)
+    init_system_log_writer(app)
+    app.extensions['status_snapshot'] = TTLSnapshot(count_system_totals, app.config.get('STATUS_SNAPSHOT_TTL', 10))
+    app.extensions['event_bus'] = EventBus(history=app.config.get('DASHBOARD_EVENT_HISTORY', 500))
+    # Each WSGI dashboard stream occupies a worker thread for as long as it is open
+    app.extensions['dashboard_streams'] = threading.BoundedSemaphore(app.config.get('DASHBOARD_MAX_STREAMS', 20))
+    init_retention_job(app)
+    init_model_warmer(app)
     
     # Setup logging
     setup_logging(app)
@@ -92,12 +133,6 @@ def create_app(config_name=None):
     # Create database tables
     with app.app_context():
         db.create_all()
-        # Only run cleanup if not in testing mode
-        if not app.config.get('TESTING', False):
-            try:
-                cleanup_old_data()
-            except Exception as e:
-                app.logger.error(f"Initial cleanup failed: {e}")
     
     return app
 
@@ -137,7 +172,8 @@ class Patient(db.Model):
     allergies = db.Column(db.JSON, default=list)
     emergency_contact = db.Column(db.String(20))
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc),
+                           index=True)  # incremental exports filter on it
     
     # Relationships
     chat_messages = db.relationship('ChatMessage', backref='patient', lazy='dynamic', cascade='all, delete-orphan')
@@ -161,7 +197,7 @@ class ChatMessage(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(36), nullable=False, index=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=True, index=True)
     message = db.Column(db.Text, nullable=False)
     role = db.Column(db.String(20), nullable=False)  # 'user' or 'assistant'
     tokens_used = db.Column(db.Integer, default=0)
@@ -176,7 +212,7 @@ class TriageAssessment(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(36), nullable=False, index=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False, index=True)
     
     # Symptom data
     symptom_category = db.Column(db.String(50), index=True)
@@ -187,7 +223,7 @@ class TriageAssessment(db.Model):
     
     # Assessment results
     ai_response = db.Column(db.Text)
-    urgency_level = db.Column(db.String(20), index=True)  # Emergency/Urgent/Standard/Self-care
+    urgency_level = db.Column(db.String(20), index=True)  # Emergency/Urgent/Standard/Self-care, or Unassessed
     recommendations = db.Column(db.Text)
     confidence_score = db.Column(db.Float, default=0.0)  # AI confidence 0-1
     
@@ -198,7 +234,13 @@ class TriageAssessment(db.Model):
     staff_notes = db.Column(db.Text)
     
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc),
+                           index=True)  # incremental exports filter on it
+    
+    __table_args__ = (
+        # Covers collect_triage_stats' GROUP BY, so it reads only this index
+        db.Index('ix_triage_assessments_stats', 'urgency_level', 'symptom_category', 'created_at'),
+    )
     
     def __repr__(self):
         return f'<TriageAssessment {self.id}: {self.urgency_level}>'
@@ -227,19 +269,26 @@ class SystemLog(db.Model):
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
 
 # Utility functions
+IMPORTANT_LOG_LEVELS = ('WARNING', 'ERROR', 'CRITICAL')
+
 def log_system_event(level, message, module=None, session_id=None):
-    """Log system events to database."""
+    """Log system events to database.
+    
+    The row is queued for the background writer, so this never commits (or
+    flushes) the caller's session and adds no database latency.
+    """
     try:
-        log = SystemLog(
-            level=level,
-            message=message,
-            module=module or 'system',
-            session_id=session_id or session.get('session_id'),
-            user_agent=request.headers.get('User-Agent', '') if request else '',
-            ip_address=request.remote_addr if request else ''
-        )
-        db.session.add(log)
-        db.session.commit()
+        in_request = has_request_context()
+        row = {
+            'level': level,
+            'message': message,
+            'module': module or 'system',
+            'session_id': session_id or (session.get('session_id') if in_request else None),
+            'user_agent': request.headers.get('User-Agent', '')[:200] if in_request else '',
+            'ip_address': request.remote_addr if in_request else '',
+            'created_at': datetime.now(timezone.utc)
+        }
+        current_app.extensions['system_log_writer'].log(row, important=level in IMPORTANT_LOG_LEVELS)
     except Exception as e:
         # Use app logger if available, otherwise print
         if current_app:
@@ -247,93 +296,538 @@ def log_system_event(level, message, module=None, session_id=None):
         else:
             print(f"Failed to log system event: {e}")
 
-def check_ollama():
-    """Check if Ollama service is available."""
+def init_database_engines(app):
+    """Apply the SQLite connection profile and attach the read-only pool."""
+    app.extensions['read_engine'] = None
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+    
+    pragmas = app.config.get('SQLITE_PRAGMAS', DEFAULT_PRAGMAS)
+    install_pragmas(engine, pragmas)
+    # An in-memory database cannot be shared with a second pool
+    if is_file_sqlite(engine) and app.config.get('SQLITE_READ_POOL_ENABLED', True):
+        read_engine = create_read_engine(
+            engine, pragmas,
+            pool_size=app.config.get('SQLITE_READ_POOL_SIZE', 5),
+            max_overflow=app.config.get('SQLITE_READ_POOL_OVERFLOW', 10)
+        )
+        app.extensions['read_engine'] = read_engine
+        atexit.register(read_engine.dispose)
+
+def migrate_database(app):
+    """Switch SQLite to its configured journal mode and add indexes defined since the tables were created.
+    
+    Both rewrite the database file, so only the serving entry points and
+    ``manage.py migrate`` call this - never importing the app.
+    """
+    with app.app_context():
+        engine = db.engine
+        journal_mode = app.config.get('SQLITE_PRAGMAS', DEFAULT_PRAGMAS).get('journal_mode')
+        if is_file_sqlite(engine) and journal_mode:
+            set_journal_mode(engine, journal_mode)
+        # create_all skips existing tables, so add any indexes defined since
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+        # Canned fallback answers used to be stored with the answer's own "Urgent" header
+        with engine.begin() as connection:
+            connection.execute(
+                TriageAssessment.__table__.update()
+                .where(TriageAssessment.ai_model_used == FALLBACK_MODEL,
+                       or_(TriageAssessment.urgency_level != UNASSESSED,
+                           TriageAssessment.urgency_level.is_(None)))
+                .values(urgency_level=UNASSESSED)
+            )
+
+@contextmanager
+def read_connection():
+    """Something to ``execute`` read-only queries on (dashboards, statistics).
+    
+    A pooled query-only connection when the read pool is enabled, otherwise
+    the request's own session.
+    """
+    read_engine = current_app.extensions.get('read_engine')
+    if read_engine is None:
+        yield db.session
+        return
+    with read_engine.connect() as connection:
+        yield connection
+
+def init_system_log_writer(app):
+    """Attach the SystemLog writer to the app.
+    
+    It writes each row as it is logged until ``start_background_services``
+    switches it to write-behind, so CLI scripts log synchronously.
+    """
+    def write_batch(rows):
+        # Own connection and transaction: never touches a request's session
+        with app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(SystemLog.__table__.insert(), rows)
+    
+    writer = BatchLogWriter(
+        write_batch,
+        max_queue=app.config.get('SYSTEM_LOG_QUEUE_SIZE', 10000),
+        batch_size=app.config.get('SYSTEM_LOG_BATCH_SIZE', 200),
+        flush_interval=app.config.get('SYSTEM_LOG_FLUSH_INTERVAL', 2.0),
+        block_timeout=app.config.get('SYSTEM_LOG_BLOCK_TIMEOUT', 0.05),
+        synchronous=True
+    )
+    app.extensions['system_log_writer'] = writer
+    return writer
+
+def init_retention_job(app):
+    """Attach the background retention purge; its first run is delayed so boot stays fast."""
+    def purge():
+        with app.app_context():
+            deadline = time.monotonic() + app.config.get('RETENTION_RUN_BUDGET', 30.0)
+            purged, complete = purge_expired_data(deadline=deadline)
+            if any(purged.values()):
+                app.logger.info(f"Retention purge removed {purged}" + ('' if complete else ' (continuing next run)'))
+            return purged, complete
+    
+    job = RetentionJob(
+        purge,
+        interval=app.config.get('RETENTION_INTERVAL', 3600.0),
+        initial_delay=app.config.get('RETENTION_INITIAL_DELAY', 300.0)
+    )
+    app.extensions['retention_job'] = job
+    return job
+
+def init_ollama_clients(app):
+    """Create the app-scoped, pooled HTTP clients used for all Ollama traffic."""
+    clients = OllamaHTTPClients.from_config(app.config)
+    app.extensions['ollama_http'] = clients
+    # Flask has no app-level shutdown hook; release pooled sockets at process exit
+    atexit.register(clients.close)
+    return clients
+
+def get_ollama_client():
+    """Return the pooled sync ``httpx.Client`` for the current app."""
+    return current_app.extensions['ollama_http'].sync
+
+def init_ollama_pool(app):
+    """Attach the Ollama hosts, each with its own availability monitor."""
+    pool = OllamaHostPool.from_config(app.config, client=app.extensions['ollama_http'].sync)
+    app.extensions['ollama_pool'] = pool
+    return pool
+
+def init_model_warmer(app):
+    """Attach the warmer for PRIMARY_MODEL (and BACKUP_MODEL, if pulled) on every host."""
+    scheduler = app.extensions['generation_scheduler']
+    warmer = ModelWarmer.from_config(app.config, app.extensions['ollama_pool'], activity=lambda: scheduler.admitted)
+    app.extensions['model_warmer'] = warmer
+    return warmer
+
+_background_services_lock = threading.Lock()
+
+def start_background_services(app):
+    """Start the Ollama monitors, the retention purge, the model warm-up and
+    the write-behind SystemLog writer.
+    
+    ``python app.py`` and the ASGI lifespan call this at startup; under any
+    other server (gunicorn, ``flask run``) the first request does.  Importing
+    the app from manage.py or data_export.py starts no threads, keeps no
+    models loaded and writes log rows synchronously.  Safe to call more than
+    once.
+    """
+    with _background_services_lock:
+        if app.extensions.get('background_services_started'):
+            return
+        app.extensions['background_services_started'] = True
+    if app.config.get('OLLAMA_MONITOR_ENABLED', not app.testing):
+        app.extensions['ollama_pool'].start()
+    if app.config.get('RETENTION_ENABLED', not app.testing):
+        app.extensions['retention_job'].start()
+        atexit.register(app.extensions['retention_job'].stop)
+    if app.config.get('WARMUP_ENABLED', not app.testing):
+        app.extensions['model_warmer'].start()
+        atexit.register(app.extensions['model_warmer'].stop)
+    if app.config.get('SYSTEM_LOG_ASYNC', not app.testing):
+        writer = app.extensions['system_log_writer']
+        writer.synchronous = False
+        writer.start()
+        atexit.register(writer.stop)
+
+def stop_background_services(app):
+    """Stop everything ``start_background_services`` started."""
+    app.extensions['ollama_pool'].stop(timeout=5.0)
+    app.extensions['retention_job'].stop()
+    app.extensions['model_warmer'].stop()
+    writer = app.extensions['system_log_writer']
+    writer.synchronous = True
+    writer.stop()
+    app.extensions['background_services_started'] = False
+
+def get_ollama_pool():
+    """Return the balancer that picks an Ollama host for each generation."""
+    return current_app.extensions['ollama_pool']
+
+def check_ollama(force=False):
+    """Return whether any Ollama host is up, from cache (``force`` probes synchronously)."""
     try:
-        # Get base URL from current app config or use default
-        base_url = getattr(current_app.config, 'OLLAMA_BASE_URL', 'http://localhost:11434') if current_app else 'http://localhost:11434'
-        response = httpx.get(f"{base_url}/api/version", timeout=3)
-        return response.status_code == 200
+        pool = current_app.extensions['ollama_pool']
+        if force:
+            return pool.probe()
+        if not current_app.config.get('OLLAMA_MONITOR_ENABLED', not current_app.testing):
+            # Nothing probes in the background: probe now whenever the last result has expired
+            return pool.refresh()
+        if not pool.probed:
+            # The monitor has only just started: answer from a real probe, not "never seen up"
+            return pool.probe()
+        return pool.available
     except Exception as e:
-        if current_app:
-            current_app.logger.error(f"Ollama health check failed: {e}")
+        current_app.logger.error(f"Ollama health check failed: {e}")
         return False
 
-def rate_limit_check(session_id, limit=10, window=3600):
-    """Simple rate limiting based on session."""
-    try:
-        current_time = datetime.now(timezone.utc)
-        cutoff_time = current_time - timedelta(seconds=window)
-        
-        recent_messages = ChatMessage.query.filter(
-            ChatMessage.session_id == session_id,
-            ChatMessage.created_at > cutoff_time,
-            ChatMessage.role == 'user'
-        ).count()
-        
-        return recent_messages < limit
-    except Exception:
-        return True  # Allow on error
+def get_generation_scheduler():
+    """Return the process-wide scheduler that gates calls to Ollama."""
+    return current_app.extensions['generation_scheduler']
 
-def cleanup_old_data():
-    """Clean up old data based on retention policies."""
+def get_model_failover():
+    """Return the per-model circuit breakers that pick which model generates."""
+    return current_app.extensions['model_failover']
+
+def get_model_router():
+    """Return the load-adaptive policy that picks each request's preferred model."""
+    return current_app.extensions['model_router']
+
+def get_response_cache():
+    """Return the process-wide cache of completed deterministic generations."""
+    return current_app.extensions['response_cache']
+
+CACHEABLE_ENDPOINTS = ('triage',)  # chat prompts carry free text and rarely repeat
+
+def response_cache_key(endpoint_type, payload):
+    """Cache key for a generation request, or ``None`` if it should not be cached."""
+    if endpoint_type not in CACHEABLE_ENDPOINTS or not current_app.config.get('RESPONSE_CACHE_ENABLED', True):
+        return None
+    return ResponseCache.make_key(payload['prompt'], payload['model'], payload.get('options'))
+
+def triage_priority(primary_symptom, severity, additional_symptoms=None):
+    """Scheduler lane for a triage request: emergencies jump the queue."""
+    threshold = current_app.config.get('EMERGENCY_SEVERITY_THRESHOLD', 8)
+    # Clients may send one symptom as a bare string; anything else but a list is ignored
+    if isinstance(additional_symptoms, str):
+        additional_symptoms = [additional_symptoms]
+    elif not isinstance(additional_symptoms, (list, tuple)):
+        additional_symptoms = []
+    text = ' '.join([primary_symptom or ''] + [symptom for symptom in additional_symptoms if isinstance(symptom, str)])
+    if (severity or 0) >= threshold or detect_emergency_keywords(text):
+        return PRIORITY_EMERGENCY
+    return PRIORITY_TRIAGE
+
+def chat_priority(message):
+    """Scheduler lane for a chat turn; red-flag messages are treated as emergencies."""
+    return PRIORITY_EMERGENCY if detect_emergency_keywords(message) else PRIORITY_CHAT
+
+def generation_priority(endpoint_type, record):
+    """Scheduler lane for a stored chat message or triage assessment."""
+    if endpoint_type == 'triage':
+        return triage_priority(record.primary_symptom, record.severity, record.additional_symptoms)
+    return chat_priority(record.message)
+
+def queue_full_response(retry_after):
+    """503 telling the client when the generation queue is likely to have room."""
+    response = jsonify({'error': 'AI service busy, please retry shortly', 'retry_after': retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def rate_limit_check(session_id, limit=None, window=None, route='chat', remote_addr=None):
+    """Count a request against the route's per-session and per-IP limits.
+    
+    ``limit`` (requests) and ``window`` (seconds) override the route's
+    configured per-session limit; whichever is not given keeps its
+    configured value (10 per hour for a route without one).
+    Returns the ``RateLimitResult``, which is truthy when the request may proceed.
+    """
+    if remote_addr is None and has_request_context():
+        remote_addr = request.remote_addr
     try:
-        current_time = datetime.now(timezone.utc)
-        
-        # Get retention periods with fallbacks
-        chat_retention_days = getattr(current_app.config, 'CHAT_DATA_RETENTION_DAYS', 7) if current_app else 7
-        patient_retention_days = getattr(current_app.config, 'PATIENT_DATA_RETENTION_DAYS', 30) if current_app else 30
-        
-        # Clean up old chat messages
-        chat_cutoff = current_time - timedelta(days=chat_retention_days)
-        old_chats = ChatMessage.query.filter(ChatMessage.created_at < chat_cutoff)
-        chat_count = old_chats.count()
-        old_chats.delete()
-        
-        # Clean up old patient data (if no recent assessments)
-        patient_cutoff = current_time - timedelta(days=patient_retention_days)
-        old_patients = Patient.query.filter(Patient.created_at < patient_cutoff)
-        patient_count = old_patients.count()
-        old_patients.delete()
-        
-        db.session.commit()
-        
-        if chat_count > 0 or patient_count > 0:
-            if current_app:
-                current_app.logger.info(f"Cleaned up {chat_count} old chat messages and {patient_count} old patients")
-            else:
-                print(f"Cleaned up {chat_count} old chat messages and {patient_count} old patients")
-            
+        limiter = current_app.extensions['rate_limiter']
+        session_limit = None
+        if limit is not None or window is not None:
+            configured = limiter.route_limits.get(route, RateLimit(10, 3600))
+            session_limit = RateLimit(configured.amount if limit is None else limit,
+                                      configured.window if window is None else window)
+        return limiter.check(route, session_id, remote_addr, session_limit=session_limit)
     except Exception as e:
-        db.session.rollback()
-        if current_app:
-            current_app.logger.error(f"Data cleanup failed: {e}")
+        current_app.logger.error(f"Rate limit check failed: {e}")
+        return RateLimitResult(True, None, None, 0, None)  # Allow on error
+
+def rate_limited_response(result):
+    """429 with the standard hints about when to retry."""
+    response = jsonify({'error': 'Rate limit exceeded', 'retry_after': result.reset_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(result.reset_after)
+    response.headers['X-RateLimit-Limit'] = str(result.limit.amount)
+    response.headers['X-RateLimit-Remaining'] = str(result.remaining)
+    return response
+
+def count_system_totals():
+    """Row counts for the main tables in one round trip."""
+    with read_connection() as connection:
+        row = connection.execute(select(
+            select(func.count()).select_from(Patient).scalar_subquery().label('total_patients'),
+            select(func.count()).select_from(TriageAssessment).scalar_subquery().label('total_assessments'),
+            select(func.count()).select_from(ChatMessage).scalar_subquery().label('total_chat_messages')
+        )).one()
+    return dict(row._mapping)
+
+def collect_triage_stats(now=None):
+    """Totals, urgency and category breakdowns and 24h/7d activity in two queries."""
+    now = now or datetime.now(timezone.utc)
+    day_ago, week_ago = now - timedelta(days=1), now - timedelta(days=7)
+    
+    stats = count_system_totals()
+    with read_connection() as connection:
+        rows = connection.execute(
+            select(
+                TriageAssessment.urgency_level,
+                TriageAssessment.symptom_category,
+                func.count(),
+                func.sum(case((TriageAssessment.created_at > day_ago, 1), else_=0)),
+                func.sum(case((TriageAssessment.created_at > week_ago, 1), else_=0))
+            ).group_by(TriageAssessment.urgency_level, TriageAssessment.symptom_category)
+        ).all()
+    
+    urgency = dict.fromkeys(LEVELS, 0)
+    urgency['Unclassified'] = 0
+    categories = {}
+    stats['recent_assessments_24h'] = stats['recent_assessments_7d'] = 0
+    stats['unassessed_assessments'] = 0
+    for level, category, count, last_day, last_week in rows:
+        category = category or 'unspecified'
+        if level == UNASSESSED:
+            # Canned fallback answers: no model judged their urgency
+            stats['unassessed_assessments'] += count
         else:
-            print(f"Data cleanup failed: {e}")
+            urgency[level if level in urgency else 'Unclassified'] += count
+        categories[category] = categories.get(category, 0) + count
+        stats['recent_assessments_24h'] += last_day or 0
+        stats['recent_assessments_7d'] += last_week or 0
+    
+    stats['urgency_levels'] = urgency
+    stats['symptom_categories'] = dict(sorted(categories.items(), key=lambda item: -item[1]))
+    stats['generated_at'] = now.isoformat()
+    return stats
 
-def detect_emergency_keywords(text):
-    """Detect emergency keywords in user input."""
-    text_lower = text.lower()
+# Only the columns dashboard.html renders; plain tuples, so nothing can lazy-load
+DashboardPatient = namedtuple('DashboardPatient', ['first_name', 'last_name', 'phone', 'age', 'gender'])
+DashboardAssessment = namedtuple('DashboardAssessment', [
+    'id', 'urgency_level', 'symptom_category', 'primary_symptom', 'severity',
+    'duration', 'created_at', 'patient'
+])
+
+DASHBOARD_PERIODS = {'today': None, 'week': timedelta(days=7), 'month': timedelta(days=30)}
+
+def encode_dashboard_cursor(assessment):
+    return f"{assessment.created_at.isoformat()}_{assessment.id}"
+
+def decode_dashboard_cursor(cursor):
+    """Parse a ``before`` cursor; anything malformed means the first page."""
+    if not cursor:
+        return None
+    created_at, _, assessment_id = cursor.rpartition('_')
+    try:
+        return datetime.fromisoformat(created_at), int(assessment_id)
+    except ValueError:
+        return None
+
+def staff_dashboard_page(urgency=None, category=None, period=None, before=None, limit=50):
+    """One page of assessments for the staff dashboard, newest first.
+    
+    A single joined query on the indexed filter columns, paginated by keyset
+    on ``(created_at, id)`` so older pages cost the same as the first one.
+    Returns ``(rows, next_cursor)``; ``next_cursor`` is ``None`` on the last page.
+    """
+    query = select(
+        TriageAssessment.id, TriageAssessment.urgency_level, TriageAssessment.symptom_category,
+        TriageAssessment.primary_symptom, TriageAssessment.severity, TriageAssessment.duration,
+        TriageAssessment.created_at, Patient.id.label('patient_pk'), Patient.first_name,
+        Patient.last_name, Patient.phone, Patient.age, Patient.gender
+    ).outerjoin(Patient, Patient.id == TriageAssessment.patient_id)
     
-    # Default emergency keywords
-    default_keywords = [
-        'chest pain', 'difficulty breathing', 'unconscious', 'severe bleeding',
-        'allergic reaction', 'stroke symptoms', 'heart attack', 'suicide'
+    if urgency == 'Standard':
+        # Unclassified assessments are shown as Standard
+        query = query.where(or_(TriageAssessment.urgency_level == urgency, TriageAssessment.urgency_level.is_(None)))
+    elif urgency:
+        query = query.where(TriageAssessment.urgency_level == urgency)
+    if category:
+        query = query.where(TriageAssessment.symptom_category == category)
+    if period in DASHBOARD_PERIODS:
+        now = datetime.now(timezone.utc)
+        since = DASHBOARD_PERIODS[period]
+        cutoff = now.replace(hour=0, minute=0, second=0, microsecond=0) if since is None else now - since
+        query = query.where(TriageAssessment.created_at >= cutoff)
+    if before:
+        created_at, assessment_id = before
+        query = query.where(or_(
+            TriageAssessment.created_at < created_at,
+            and_(TriageAssessment.created_at == created_at, TriageAssessment.id < assessment_id)
+        ))
+    
+    query = query.order_by(TriageAssessment.created_at.desc(), TriageAssessment.id.desc()).limit(limit + 1)
+    with read_connection() as connection:
+        rows = connection.execute(query).all()
+    
+    page = [
+        DashboardAssessment(
+            row.id, row.urgency_level, row.symptom_category, row.primary_symptom, row.severity,
+            row.duration, row.created_at,
+            DashboardPatient(row.first_name, row.last_name, row.phone, row.age, row.gender)
+            if row.patient_pk is not None else None
+        )
+        for row in rows[:limit]
     ]
+    next_cursor = encode_dashboard_cursor(page[-1]) if len(rows) > limit else None
+    return page, next_cursor
+
+DASHBOARD_KEEPALIVE = 15.0  # seconds between SSE comments on an idle dashboard stream
+
+def dashboard_sse(event):
+    """Format a bus event as a named SSE event the browser can resume from."""
+    return f"id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data)}\n\n"
+
+def publish_dashboard_event(event_type, data):
+    """Push a delta to every connected staff dashboard; never fails the caller."""
+    try:
+        current_app.extensions['event_bus'].publish(event_type, data)
+    except Exception as e:
+        current_app.logger.error(f"Failed to publish dashboard event: {e}")
+
+def publish_assessment_created(assessment, patient):
+    row = DashboardAssessment(
+        assessment.id, assessment.urgency_level, assessment.symptom_category,
+        assessment.primary_symptom, assessment.severity, assessment.duration, assessment.created_at,
+        DashboardPatient(patient.first_name, patient.last_name, patient.phone, patient.age, patient.gender)
+        if patient else None
+    )
+    publish_dashboard_event('assessment_created', {
+        'id': assessment.id,
+        'urgency_level': assessment.urgency_level,
+        'symptom_category': assessment.symptom_category,
+        'created_at': assessment.created_at.isoformat(),
+        'html': render_template('_assessment_row.html', assessment=row)
+    })
+
+def publish_urgency_change(assessment, previous_level):
+    if assessment.urgency_level != previous_level:
+        publish_dashboard_event('assessment_updated', {
+            'id': assessment.id,
+            'urgency_level': assessment.urgency_level,
+            'confidence_score': assessment.confidence_score
+        })
+
+def retention_cutoffs(now=None, days=None):
+    now = now or datetime.now(timezone.utc)
+    chat_days = days if days is not None else current_app.config.get('CHAT_DATA_RETENTION_DAYS', 7)
+    patient_days = days if days is not None else current_app.config.get('PATIENT_DATA_RETENTION_DAYS', 30)
+    return now - timedelta(days=chat_days), now - timedelta(days=patient_days)
+
+def expired_ids(model, *conditions):
+    """Oldest-first expired primary keys, walked through the ``created_at`` index."""
+    def select_ids(limit):
+        return db.session.scalars(
+            select(model.id).where(*conditions).order_by(model.created_at, model.id).limit(limit)
+        ).all()
+    return select_ids
+
+def delete_rows(*deletes):
+    """Run ``(table, statement)`` deletes in one transaction; returns rows per table."""
+    def delete_ids(ids):
+        try:
+            counts = {table: db.session.execute(statement(ids)).rowcount for table, statement in deletes}
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return counts
+    return delete_ids
+
+def purge_expired_data(deadline=None, now=None, days=None, system_logs=False):
+    """Delete chat messages and patients past their retention period, in batches.
+    
+    Patients go together with their chat messages and assessments, unless
+    they still have an assessment inside the retention period.  ``days``
+    overrides both retention periods; with ``system_logs`` audit rows older
+    than the patient cutoff go too.  Returns ``({table: rows_deleted}, complete)``.
+    """
+    chat_cutoff, patient_cutoff = retention_cutoffs(now, days)
+    chats, assessments, patients = ChatMessage.__table__, TriageAssessment.__table__, Patient.__table__
+    recent_assessment = exists().where(
+        TriageAssessment.patient_id == Patient.id, TriageAssessment.created_at >= patient_cutoff
+    )
     
-    # Try to get keywords from app config, fall back to defaults
-    emergency_keywords = default_keywords
+    policies = [
+        (expired_ids(ChatMessage, ChatMessage.created_at < chat_cutoff),
+         delete_rows(('chat_messages', lambda ids: chats.delete().where(chats.c.id.in_(ids))))),
+        (expired_ids(Patient, Patient.created_at < patient_cutoff, ~recent_assessment),
+         delete_rows(
+             ('chat_messages', lambda ids: chats.delete().where(chats.c.patient_id.in_(ids))),
+             ('triage_assessments', lambda ids: assessments.delete().where(assessments.c.patient_id.in_(ids))),
+             ('patients', lambda ids: patients.delete().where(patients.c.id.in_(ids)))
+         )),
+    ]
+    if system_logs:
+        logs = SystemLog.__table__
+        policies.append((expired_ids(SystemLog, SystemLog.created_at < patient_cutoff),
+                         delete_rows(('system_logs', lambda ids: logs.delete().where(logs.c.id.in_(ids))))))
+    
+    purged, complete = {}, True
+    for select_ids, delete_ids in policies:
+        counts, finished = purge_in_batches(
+            select_ids, delete_ids,
+            batch_size=current_app.config.get('RETENTION_BATCH_SIZE', 500),
+            batch_budget=current_app.config.get('RETENTION_BATCH_BUDGET', 0.25),
+            deadline=deadline
+        )
+        for table, count in counts.items():
+            purged[table] = purged.get(table, 0) + count
+        complete = complete and finished
+    return purged, complete
+
+def cleanup_old_data():
+    """Clean up old data based on retention policies (all of it, synchronously)."""
     try:
-        if current_app and hasattr(current_app, 'config'):
-            emergency_keywords = current_app.config.get('EMERGENCY_KEYWORDS', default_keywords)
-    except RuntimeError:
-        # Outside application context, use defaults
-        emergency_keywords = default_keywords
+        purged, _ = purge_expired_data()
+        if any(purged.values()):
+            current_app.logger.info(
+                f"Cleaned up {purged.get('chat_messages', 0)} old chat messages "
+                f"and {purged.get('patients', 0)} old patients"
+            )
+        return purged
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Data cleanup failed: {e}")
+        return {}
+
+DEFAULT_EMERGENCY_KEYWORDS = [
+    'chest pain', 'difficulty breathing', 'unconscious', 'severe bleeding',
+    'allergic reaction', 'stroke symptoms', 'heart attack', 'suicide'
+]
+
+def emergency_keyword_matcher():
+    """Return the compiled matcher for the configured emergency keywords.
     
-    for keyword in emergency_keywords:
-        if keyword in text_lower:
-            return True
-    return False
+    Compiled once per distinct keyword list, so editing EMERGENCY_KEYWORDS
+    triggers a rebuild while ordinary calls only pay for the scan.
+    """
+    keywords = DEFAULT_EMERGENCY_KEYWORDS
+    if has_app_context():
+        keywords = current_app.config.get('EMERGENCY_KEYWORDS', DEFAULT_EMERGENCY_KEYWORDS)
+    return get_keyword_matcher(keywords)
+
+def find_emergency_keywords(text):
+    """Return every emergency keyword in ``text`` with its character span."""
+    return emergency_keyword_matcher().find_all(text)
+
+def detect_emergency_keywords(text):
+    """Detect emergency keywords in user input."""
+    return emergency_keyword_matcher().search(text) is not None
 
 def create_enhanced_triage_prompt(patient_data, symptom_data):
     """Create enhanced AI prompt for triage assessment."""
@@ -379,113 +873,6 @@ Be concise but thorough. Always err on the side of caution for serious symptoms.
     
     return prompt
 
-def stream_ollama_response(prompt, record_id, endpoint_type):
-    """Stream response from Ollama with error handling and logging."""
-    def generate():
-        start_time = datetime.now()
-        full_response = ""
-        
-        try:
-            # Get configuration values with fallbacks
-            base_url = getattr(current_app.config, 'OLLAMA_BASE_URL', 'http://localhost:11434') if current_app else 'http://localhost:11434'
-            model = getattr(current_app.config, 'PRIMARY_MODEL', 'gemma3:4b') if current_app else 'gemma3:4b'
-            temperature = getattr(current_app.config, 'AI_TEMPERATURE', 0.3) if current_app else 0.3
-            top_p = getattr(current_app.config, 'AI_TOP_P', 0.9) if current_app else 0.9
-            timeout = getattr(current_app.config, 'AI_TIMEOUT', 60) if current_app else 60
-            
-            with httpx.stream(
-                'POST',
-                f"{base_url}/api/generate",
-                json={
-                    "model": model,
-                    "prompt": prompt,
-                    "stream": True,
-                    "options": {
-                        "temperature": temperature,
-                        "top_p": top_p
-                    }
-                },
-                timeout=timeout
-            ) as resp:
-                if resp.status_code != 200:
-                    yield f"data: {json.dumps({'error': 'AI service error'})}\n\n"
-                    return
-                
-                for chunk in resp.iter_text():
-                    if chunk.strip():
-                        try:
-                            data = json.loads(chunk)
-                            if data.get('response'):
-                                full_response += data['response']
-                                yield f"data: {json.dumps({'chunk': data['response']})}\n\n"
-                            if data.get('done'):
-                                # Save assistant response
-                                response_time = (datetime.now() - start_time).total_seconds()
-                                save_ai_response(record_id, full_response, response_time, endpoint_type)
-                                yield f"data: {json.dumps({'done': True})}\n\n"
-                                return
-                        except json.JSONDecodeError:
-                            continue
-                            
-        except httpx.TimeoutException:
-            log_system_event('ERROR', 'AI request timeout', endpoint_type)
-            yield f"data: {json.dumps({'error': 'Request timeout'})}\n\n"
-        except Exception as e:
-            log_system_event('ERROR', f'AI streaming error: {str(e)}', endpoint_type)
-            yield f"data: {json.dumps({'error': 'Unexpected error'})}\n\n"
-        finally:
-            yield "data: [DONE]\n\n"
-
-    return Response(
-        stream_with_context(generate()),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'X-Accel-Buffering': 'no'  # Disable nginx buffering
-        }
-    )
-
-def save_ai_response(record_id, response, response_time, endpoint_type):
-    """Save AI response to database."""
-    try:
-        if endpoint_type == 'chat':
-            # Save chat assistant response
-            assistant_msg = ChatMessage(
-                session_id=session['session_id'],
-                patient_id=ChatMessage.query.get(record_id).patient_id,
-                message=response,
-                role='assistant',
-                response_time=response_time
-            )
-            db.session.add(assistant_msg)
-        elif endpoint_type == 'triage':
-            # Update triage assessment
-            assessment = TriageAssessment.query.get(record_id)
-            if assessment:
-                assessment.ai_response = response
-                assessment.urgency_level = parse_urgency_level(response)
-                assessment.ai_model_used = getattr(current_app.config, 'PRIMARY_MODEL', 'gemma3:4b') if current_app else 'gemma3:4b'
-        
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        if current_app:
-            current_app.logger.error(f"Failed to save AI response: {e}")
-
-def parse_urgency_level(response):
-    """Parse urgency level from AI response."""
-    response_lower = response.lower()
-    
-    if any(keyword in response_lower for keyword in ['emergency', '999', 'life-threatening']):
-        return 'Emergency'
-    elif any(keyword in response_lower for keyword in ['urgent', '111', 'immediate']):
-        return 'Urgent'
-    elif any(keyword in response_lower for keyword in ['gp', 'doctor', 'appointment']):
-        return 'Standard'
-    else:
-        return 'Self-care'
-
 # Route registration and error handlers
 def register_routes(app):
     """Register all application routes."""
@@ -496,6 +883,9 @@ def register_routes(app):
         if 'session_id' not in session:
             session['session_id'] = str(uuid.uuid4())
         session.permanent = True
+        # Servers that never ran python app.py's or the ASGI lifespan's startup
+        if not app.extensions.get('background_services_started'):
+            start_background_services(app)
     
     @app.route('/')
     def index():
@@ -518,25 +908,34 @@ def register_routes(app):
     @app.route('/staff-dashboard')
     def staff_dashboard():
         # In a real implementation, add authentication here
-        assessments = TriageAssessment.query.order_by(
-            TriageAssessment.created_at.desc()
-        ).limit(50).all()
-        return render_template('dashboard.html', assessments=assessments)
+        filters = {
+            'urgency': request.args.get('urgency') or None,
+            'category': request.args.get('category') or None,
+            'period': request.args.get('period') if request.args.get('period') in DASHBOARD_PERIODS else None
+        }
+        # Taken before the query: the live feed then replays anything committed
+        # while the page renders, and rows already shown are skipped client-side
+        live_cursor = app.extensions['event_bus'].latest_id()
+        assessments, next_cursor = staff_dashboard_page(
+            before=decode_dashboard_cursor(request.args.get('before')), **filters
+        )
+        return render_template('dashboard.html', assessments=assessments, filters=filters,
+                               next_cursor=next_cursor, paged=bool(request.args.get('before')),
+                               live_cursor=live_cursor)
     
     # API Routes
     @app.route('/api/system-status')
     def system_status():
         """Get system status and statistics."""
         try:
-            total_patients = Patient.query.count()
-            total_assessments = TriageAssessment.query.count()
-            total_chat_messages = ChatMessage.query.count()
+            # Counts are a shared snapshot refreshed at most every STATUS_SNAPSHOT_TTL seconds
+            totals, age = app.extensions['status_snapshot'].get()
             
             return jsonify({
                 'ollama_available': check_ollama(),
-                'total_patients': total_patients,
-                'total_assessments': total_assessments,
-                'total_chat_messages': total_chat_messages,
+                'ollama': current_app.extensions['ollama_pool'].snapshot(),
+                **totals,
+                'stats_age_seconds': round(age, 3),
                 'system_uptime': 'Available',
                 'ai_model': app.config.get('PRIMARY_MODEL', 'gemma3:4b'),
                 'timestamp': datetime.now(timezone.utc).isoformat()
@@ -545,6 +944,53 @@ def register_routes(app):
             app.logger.error(f"System status error: {e}")
             return jsonify({'error': 'System status unavailable'}), 500
 
+    @app.route('/api/dashboard/stream')
+    def dashboard_stream():
+        """Push new assessments and urgency changes to a staff dashboard."""
+        # EventSource resends the last id it saw when it reconnects
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        streams = app.extensions['dashboard_streams']
+        if not streams.acquire(blocking=False):
+            retry_after = app.config.get('DASHBOARD_STREAM_RETRY_AFTER', 30)
+            response = jsonify({'error': 'Too many live dashboards open, please retry shortly',
+                                'retry_after': retry_after})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        subscription = app.extensions['event_bus'].subscribe(last_event_id)
+        # The stream ends after DASHBOARD_STREAM_MAX_AGE so this worker thread is
+        # handed back; the browser reconnects with Last-Event-ID and misses nothing
+        steps = dashboard_steps(subscription, app.config.get('DASHBOARD_STREAM_MAX_AGE', 300))
+        response = Response(run_steps(steps), mimetype='text/event-stream', headers=SSE_HEADERS)
+        released = threading.Event()
+
+        def release_stream():
+            if not released.is_set():
+                released.set()
+                streams.release()
+
+        response.call_on_close(subscription.close)
+        response.call_on_close(release_stream)
+        return response
+
+    @app.route('/api/metrics')
+    def metrics():
+        """Operational metrics for the AI pipeline."""
+        return jsonify({
+            'ollama': app.extensions['ollama_pool'].snapshot(),
+            'generation_queue': app.extensions['generation_scheduler'].stats(),
+            'response_cache': app.extensions['response_cache'].stats(),
+            'model_failover': app.extensions['model_failover'].stats(),
+            'model_routing': app.extensions['model_router'].stats(),
+            'hedging': app.extensions['hedge_policy'].stats(),
+            'warmup': app.extensions['model_warmer'].snapshot(),
+            'rate_limiter': app.extensions['rate_limiter'].stats(),
+            'system_log': app.extensions['system_log_writer'].stats(),
+            'dashboard_events': app.extensions['event_bus'].stats(),
+            'retention': app.extensions['retention_job'].stats(),
+            'timestamp': datetime.now(timezone.utc).isoformat()
+        })
+
     @app.route('/api/health')
     def health_check():
         """Simple health check endpoint."""
@@ -554,6 +1000,16 @@ def register_routes(app):
             'timestamp': datetime.now(timezone.utc).isoformat()
         })
 
+    @app.route('/api/ready')
+    def readiness_check():
+        """Readiness probe: 503 until the AI models have been warmed up."""
+        warmup = app.extensions['model_warmer'].snapshot()
+        return jsonify({
+            'status': warmup['state'],
+            'warmup': warmup,
+            'timestamp': datetime.now(timezone.utc).isoformat()
+        }), 503 if warmup['state'] == WARMING else 200
+
     @app.route('/api/patient/register', methods=['POST'])
     def register_patient():
         """Register or update patient information."""
@@ -634,15 +1090,22 @@ def register_routes(app):
             log_system_event('ERROR', 'AI service unavailable', 'chat')
             return jsonify({'error': 'AI service unavailable'}), 503
         
+        scheduler = get_generation_scheduler()
+        if not scheduler.has_capacity(chat_priority(data['message'])):
+            return queue_full_response(scheduler.retry_after())
+        
         session_id = session['session_id']
         
         # Rate limiting
-        if not rate_limit_check(session_id):
-            return jsonify({'error': 'Rate limit exceeded'}), 429
+        limit = rate_limit_check(session_id, route='chat')
+        if not limit.allowed:
+            return rate_limited_response(limit)
         
         # Check for emergency keywords
-        if detect_emergency_keywords(data['message']):
-            log_system_event('WARNING', f'Emergency keywords detected: {data["message"][:100]}', 'chat', session_id)
+        red_flags = find_emergency_keywords(data['message'])
+        if red_flags:
+            keywords = ', '.join(sorted({match.keyword for match in red_flags}))
+            log_system_event('WARNING', f'Emergency keywords detected ({keywords}): {data["message"][:100]}', 'chat', session_id)
         
         try:
             # Get or create patient
@@ -678,20 +1141,8 @@ def register_routes(app):
     @app.route('/api/chat/stream/<int:message_id>')
     def stream_chat(message_id):
         msg = ChatMessage.query.get_or_404(message_id)
-        
-        emergency_warning = ""
-        if detect_emergency_keywords(msg.message):
-            emergency_warning = "⚠️ **EMERGENCY ALERT**: Your symptoms may require immediate medical attention. If this is a life-threatening emergency, please call 999 immediately.\n\n"
-        
-        prompt = f"""{emergency_warning}You are an NHS medical assistant. Provide helpful, concise medical guidance (2-3 sentences).
-
-Previous context: This is a chat conversation about health concerns.
-
-User message: {msg.message}
-
-Respond professionally and ask ONE specific follow-up question if appropriate. Always include appropriate medical disclaimers."""
-        
-        return stream_ollama_response(prompt, msg.id, 'chat')
+        return stream_ollama_response(create_chat_prompt(msg.message), msg.id, 'chat',
+                                      priority=generation_priority('chat', msg), session_id=msg.session_id)
 
     @app.route('/api/triage/submit', methods=['POST'])
     def submit_triage():
@@ -702,6 +1153,10 @@ Respond professionally and ask ONE specific follow-up question if appropriate. A
         if not session_id:
             return jsonify({'error': 'No session'}), 400
         
+        limit = rate_limit_check(session_id, route='triage')
+        if not limit.allowed:
+            return rate_limited_response(limit)
+        
         if not check_ollama():
             return jsonify({'error': 'AI service unavailable'}), 503
         
@@ -724,6 +1179,11 @@ Respond professionally and ask ONE specific follow-up question if appropriate. A
         if data.get('category') not in valid_categories:
             return jsonify({'error': 'Invalid symptom category'}), 400
         
+        scheduler = get_generation_scheduler()
+        priority = triage_priority(data.get('primarySymptom'), severity, data.get('additionalSymptoms'))
+        if not scheduler.has_capacity(priority):
+            return queue_full_response(scheduler.retry_after())
+        
         try:
             patient = Patient.query.filter_by(session_id=session_id).first()
             if not patient:
@@ -742,6 +1202,7 @@ Respond professionally and ask ONE specific follow-up question if appropriate. A
             
             db.session.add(assessment)
             db.session.commit()
+            publish_assessment_created(assessment, patient)
             
             return jsonify({'success': True, 'assessment_id': assessment.id})
             
@@ -754,26 +1215,9 @@ Respond professionally and ask ONE specific follow-up question if appropriate. A
     def stream_triage(assessment_id):
         """Stream triage assessment from AI."""
         assessment = TriageAssessment.query.get_or_404(assessment_id)
-        patient = assessment.patient_id and Patient.query.get(assessment.patient_id)
-        
-        # Prepare data for AI prompt
-        patient_data = {
-            'age': patient.age if patient else None,
-            'gender': patient.gender if patient else None,
-            'existing_conditions': patient.existing_conditions if patient else [],
-            'current_medications': patient.current_medications if patient else [],
-            'allergies': patient.allergies if patient else []
-        }
-        
-        symptom_data = {
-            'primary_symptom': assessment.primary_symptom,
-            'severity': assessment.severity,
-            'duration': assessment.duration,
-            'additional_symptoms': assessment.additional_symptoms or []
-        }
-        
-        prompt = create_enhanced_triage_prompt(patient_data, symptom_data)
-        return stream_ollama_response(prompt, assessment.id, 'triage')
+        return stream_ollama_response(create_assessment_prompt(assessment), assessment.id, 'triage',
+                                      priority=generation_priority('triage', assessment),
+                                      session_id=assessment.session_id)
 
     @app.route('/api/triage/save/<int:assessment_id>', methods=['POST'])
     def save_triage_result(assessment_id):
@@ -782,15 +1226,28 @@ Respond professionally and ask ONE specific follow-up question if appropriate. A
         
         try:
             assessment = TriageAssessment.query.get_or_404(assessment_id)
+            if assessment.ai_model_used:
+                # The stream already saved the response with the model that actually answered
+                # (backup or canned fallback included); the browser's copy must not overwrite it
+                return jsonify({
+                    'success': True,
+                    'urgency_level': assessment.urgency_level,
+                    'assessment_id': assessment.id
+                })
+            
             ai_response = data.get('response', '')
             
+            urgency = classify_urgency(ai_response)
+            previous_level = assessment.urgency_level
+            
             assessment.ai_response = ai_response
-            assessment.urgency_level = parse_urgency_level(ai_response)
+            assessment.urgency_level = urgency.level
             assessment.recommendations = ai_response[:500]  # First 500 chars
-            assessment.confidence_score = data.get('confidence_score', 0.0)
+            assessment.confidence_score = data.get('confidence_score', urgency.confidence)
             assessment.ai_model_used = app.config.get('PRIMARY_MODEL', 'gemma3:4b')
             
             db.session.commit()
+            publish_urgency_change(assessment, previous_level)
             
             return jsonify({
                 'success': True,
@@ -819,74 +1276,572 @@ def register_error_handlers(app):
     def service_unavailable_error(error):
         return render_template('errors/503.html'), 503
 
-def stream_ollama_response(prompt, record_id, endpoint_type):
-    """Stream response from Ollama with error handling and logging."""
-    def generate():
-        start_time = datetime.now()
-        full_response = ""
+def create_chat_prompt(message):
+    """Create the AI prompt for a single chat turn."""
+    emergency_warning = ""
+    if detect_emergency_keywords(message):
+        emergency_warning = "⚠️ **EMERGENCY ALERT**: Your symptoms may require immediate medical attention. If this is a life-threatening emergency, please call 999 immediately.\n\n"
+    
+    return f"""{emergency_warning}You are an NHS medical assistant. Provide helpful, concise medical guidance (2-3 sentences).
+
+Previous context: This is a chat conversation about health concerns.
+
+User message: {message}
+
+Respond professionally and ask ONE specific follow-up question if appropriate. Always include appropriate medical disclaimers."""
+
+def create_assessment_prompt(assessment):
+    """Create the triage prompt for a stored assessment and its patient."""
+    patient = assessment.patient_id and db.session.get(Patient, assessment.patient_id)
+    
+    patient_data = {
+        'age': patient.age if patient else None,
+        'gender': patient.gender if patient else None,
+        'existing_conditions': patient.existing_conditions if patient else [],
+        'current_medications': patient.current_medications if patient else [],
+        'allergies': patient.allergies if patient else []
+    }
+    
+    symptom_data = {
+        'primary_symptom': assessment.primary_symptom,
+        'severity': assessment.severity,
+        'duration': assessment.duration,
+        'additional_symptoms': assessment.additional_symptoms or []
+    }
+    
+    return create_enhanced_triage_prompt(patient_data, symptom_data)
+
+# Server-sent events framing shared by the WSGI and ASGI streaming paths
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no'  # Disable nginx buffering
+}
+SSE_DONE = "data: [DONE]\n\n"
+
+def sse_event(payload):
+    """Frame one JSON payload as an SSE ``data:`` event."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+OLLAMA_GENERATE_PATH = '/api/generate'
+
+def ollama_generate_request(prompt):
+    """Return the path and JSON body for a streaming ``/api/generate`` call."""
+    config = current_app.config
+    return OLLAMA_GENERATE_PATH, {
+        "model": config['PRIMARY_MODEL'],
+        "prompt": prompt,
+        "stream": True,
+        "keep_alive": config.get('OLLAMA_KEEP_ALIVE', '30m'),
+        "options": {
+            "temperature": config['AI_TEMPERATURE'],
+            "top_p": config['AI_TOP_P']
+        }
+    }
+
+class GenerationStream:
+    """Turn raw Ollama stream text into SSE events and track the response.
+    
+    Transport-agnostic so the sync (WSGI) and async (ASGI) stream endpoints
+    emit exactly the same wire format.
+    """
+    
+    def __init__(self, record_id, endpoint_type, max_line_length=1024 * 1024):
+        self.record_id = record_id
+        self.endpoint_type = endpoint_type
+        self.decoder = NDJSONDecoder(max_line_length)
+        self.parts = []
+        self.done = False
+        self.started = time.monotonic()
+        self.cache_key = None  # set when the completed text should be cached
+        # Triage answers open with an URGENCY LEVEL header; surface it before the rest arrives
+        self.urgency = UrgencyClassifier() if endpoint_type == 'triage' else None
+        self.early_urgency = None
+        self.urgency_pending = False  # resolved mid-stream but not yet persisted
+        self.model = None  # recorded as ai_model_used
+        self.attempt_started = self.started
+        self.first_token_at = None
+        self.eval_count = self.eval_duration = None  # Ollama's own counters from the done line
+    
+    @classmethod
+    def for_app(cls, app, record_id, endpoint_type):
+        return cls(record_id, endpoint_type, app.config.get('OLLAMA_STREAM_MAX_LINE', 1024 * 1024))
+    
+    def feed(self, text):
+        """Return the SSE chunk events decoded from ``text``."""
+        return self._events(self.decoder.feed(text))
+    
+    def flush(self):
+        return self._events(self.decoder.flush())
+    
+    def use_model(self, model, primary=None):
+        """Start a (new) generation attempt on ``model``."""
+        self.model = model
+        self.restart()
+        if model != primary:
+            # Only the primary model's answers are cached
+            self.cache_key = None
+    
+    def restart(self):
+        """Reset per-attempt state before retrying elsewhere."""
+        self.attempt_started = time.monotonic()
+        self.first_token_at = None
+        self.eval_count = self.eval_duration = None
+        # Nothing reached the client from a failed attempt, but its decoder may hold a partial line
+        self.decoder = NDJSONDecoder(self.decoder.max_line_length)
+    
+    @property
+    def first_token_latency(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.attempt_started
+    
+    @property
+    def token_stats(self):
+        """``(tokens, seconds)`` spent generating the answer, or ``None``."""
+        if self.eval_count and self.eval_duration:
+            return self.eval_count, self.eval_duration / 1e9
+        if self.first_token_at is None:
+            return None
+        # Older Ollama builds omit the counters; each chunk is one token
+        return len(self.parts), time.monotonic() - self.first_token_at
+    
+    def replay(self, text):
+        """Return SSE events for a cached response, as if it had just streamed."""
+        self.parts = [text]
+        self.done = True
+        self.cache_key = None
+        events = [sse_event({'chunk': text})] if text else []
+        if self.urgency:
+            self.urgency.feed(text)
+            result = self.urgency.finish()
+            if result.source == 'header':
+                self.early_urgency = result
+                events.insert(0, sse_event({'urgency': result.level}))
+        return events
+    
+    def _events(self, objects):
+        events = []
+        for data in objects:
+            if self.done:
+                break
+            if data.get('response'):
+                if self.first_token_at is None:
+                    self.first_token_at = time.monotonic()
+                self.parts.append(data['response'])
+                events.append(sse_event({'chunk': data['response']}))
+                if self.urgency and self.early_urgency is None:
+                    resolved = self.urgency.feed(data['response'])
+                    if resolved:
+                        self.early_urgency = resolved
+                        self.urgency_pending = True
+                        events.append(sse_event({'urgency': resolved.level}))
+            if data.get('done'):
+                self.done = True
+                self.eval_count = data.get('eval_count')
+                self.eval_duration = data.get('eval_duration')
+        return events
+    
+    @property
+    def response_text(self):
+        return ''.join(self.parts)
+    
+    def save(self):
+        """Persist the completed response (needs an app context)."""
+        urgency = self.early_urgency or (self.urgency and self.urgency.finish())
+        if urgency and self.model == FALLBACK_MODEL:
+            # A canned answer's level is a safe default for the patient, not an
+            # assessment: keep it out of the urgency breakdowns and dashboard counts
+            urgency = UrgencyResult(UNASSESSED, 0.0, 'fallback')
+        save_ai_response(self.record_id, self.response_text,
+                         time.monotonic() - self.started, self.endpoint_type,
+                         urgency=urgency, model=self.model)
+        if self.cache_key and self.response_text:
+            get_response_cache().put(self.cache_key, self.response_text)
+    
+    def persist_urgency(self):
+        """Store an urgency level resolved mid-stream (needs an app context)."""
+        if self.urgency_pending:
+            self.urgency_pending = False
+            save_urgency_level(self.record_id, self.early_urgency)
+    
+    def log_framing_issues(self, logger):
+        if self.decoder.malformed or self.decoder.oversized:
+            logger.warning(f"Ollama stream framing issues ({self.endpoint_type}): {self.decoder.stats()}")
+
+QUEUE_POLL_INTERVAL = 1.0  # seconds between queue-position updates
+
+# Recorded as ai_model_used when every model's breaker is open
+FALLBACK_MODEL = 'fallback'
+FALLBACK_RESPONSES = {
+    'triage': (
+        "**URGENCY LEVEL:** Urgent\n\n"
+        "Our AI assessment service is temporarily unavailable, so your symptoms could not be "
+        "assessed automatically. Please contact NHS 111 (call 111 or visit 111.nhs.uk) for advice now.\n\n"
+        "If you have chest pain, difficulty breathing, severe bleeding, signs of a stroke or you feel "
+        "your life is at risk, call 999 immediately."
+    ),
+    'chat': (
+        "Sorry, the AI assistant is temporarily unavailable. If you need medical help now, "
+        "contact NHS 111, or call 999 in an emergency."
+    ),
+}
+
+# ``host_down``: the host could not be reached, so the same model may be retried on another host
+GenerationError = namedtuple('GenerationError', ['message', 'level', 'detail', 'host_down'], defaults=(False,))
+
+def fallback_response(endpoint_type):
+    """The canned answer to send when no model is available, or ``None`` if disabled."""
+    if not current_app.config.get('AI_FALLBACK_ENABLED', True):
+        return None
+    return FALLBACK_RESPONSES.get(endpoint_type)
+
+def status_error(status_code):
+    return GenerationError('AI service error', 'ERROR', f'AI service returned HTTP {status_code}')
+
+def request_error(e):
+    """Map an httpx transport failure to a ``GenerationError``."""
+    if isinstance(e, httpx.TimeoutException):
+        return GenerationError('Request timeout', 'ERROR', 'AI request timeout')
+    return GenerationError('AI service error', 'ERROR', f'AI connection error: {e}', host_down=True)
+
+INCOMPLETE_RESPONSE = GenerationError('Incomplete AI response', 'WARNING', 'AI stream ended before completion')
+NO_HOST_ERROR = GenerationError('AI service unavailable', 'ERROR', 'No Ollama host configured')
+
+def feed_stream(texts, stream):
+    """Feed raw Ollama stream text through ``stream``, yielding SSE events."""
+    for text in texts:
+        yield from stream.feed(text)
+        stream.persist_urgency()
+        if stream.done:
+            break
+    else:
+        yield from stream.flush()
+    # Stream closed without a done marker: do not save a truncated answer
+    return None if stream.done else INCOMPLETE_RESPONSE
+
+def generate_with_model(url, payload, stream):
+    """Stream one model's answer through ``stream``, yielding SSE events.
+    
+    Returns ``None`` on success or a ``GenerationError`` describing the failure.
+    """
+    try:
+        with get_ollama_client().stream('POST', url, json=payload) as resp:
+            if resp.status_code != 200:
+                return status_error(resp.status_code)
+            return (yield from feed_stream(resp.iter_text(), stream))
+    except httpx.TransportError as e:
+        return request_error(e)
+
+def should_hedge(app, endpoint_type):
+    """Hedging is opt-in, triage-only, and needs a second host to hedge to."""
+    return (endpoint_type == 'triage' and app.config.get('HEDGE_ENABLED', False)
+            and len(app.extensions['ollama_pool'].hosts) > 1)
+
+def race_failure(kind, value):
+    """The ``GenerationError`` for an attempt that failed before its first token."""
+    if kind == STATUS:
+        return status_error(value)
+    if kind == END:
+        return INCOMPLETE_RESPONSE
+    if isinstance(value, httpx.TransportError):
+        return request_error(value)
+    raise value
+
+def generate_hedged(path, payload, stream, session_id=None):
+    """Like ``generate_on_hosts``, but hedge to a second host if the first token is late."""
+    outbox = queue.Queue()
+    portal, client = current_app.extensions['ollama_http'].portal()
+    race = HedgeRace(get_ollama_pool(), current_app.extensions['hedge_policy'],
+                     lambda host: ThreadedAttempt(portal, client, host.url(path), payload, outbox).start(),
+                     session_id)
+    down_error = None
+    try:
+        if not race.start():
+            return NO_HOST_ERROR
+        while not race.settled:
+            try:
+                race.report(*outbox.get(timeout=race.timeout()))
+            except queue.Empty:
+                race.on_timeout()
+        if race.winner is None:
+            return race_failure(*race.failure)
+        
+        def winner_texts():
+            yield race.first_text
+            while True:
+                attempt, kind, value = outbox.get()
+                if attempt is not race.winner:
+                    continue
+                if kind != TEXT:
+                    if isinstance(value, Exception):
+                        raise value
+                    return
+                yield value
         
         try:
-            with httpx.stream(
-                'POST',
-                f"{current_app.config['OLLAMA_BASE_URL']}/api/generate",
-                json={
-                    "model": current_app.config['PRIMARY_MODEL'],
-                    "prompt": prompt,
-                    "stream": True,
-                    "options": {
-                        "temperature": current_app.config['AI_TEMPERATURE'],
-                        "top_p": current_app.config['AI_TOP_P']
-                    }
-                },
-                timeout=current_app.config['AI_TIMEOUT']
-            ) as resp:
-                if resp.status_code != 200:
-                    yield f"data: {json.dumps({'error': 'AI service error'})}\n\n"
+            error = yield from feed_stream(winner_texts(), stream)
+        except httpx.TransportError as e:
+            error = request_error(e)
+        down_error = error and error.host_down and error.detail
+        return error
+    finally:
+        race.close(down_error)
+
+# Instructions the transport-neutral generation steps hand to their driver.
+# ``Call`` runs blocking or database work in an app context; the rest are
+# the transport's own I/O.  Each instruction's result is sent back in.
+Emit = namedtuple('Emit', ['event'])
+Call = namedtuple('Call', ['func', 'args'])
+AwaitSlot = namedtuple('AwaitSlot', ['ticket', 'timeout'])
+StreamFrom = namedtuple('StreamFrom', ['url', 'payload'])
+RaceHosts = namedtuple('RaceHosts', ['path', 'payload', 'session_id'])
+AwaitEvents = namedtuple('AwaitEvents', ['subscription', 'timeout'])
+
+def host_steps(app, path, payload, stream, session_id=None):
+    """Run one model on a pooled host.
+    
+    A host that cannot be reached before anything streamed is marked down
+    and the attempt moves to the next host; returns the last error or ``None``.
+    """
+    pool = app.extensions['ollama_pool']
+    failed, error = [], NO_HOST_ERROR
+    while True:
+        host = pool.acquire(session_id, exclude=failed)
+        if host is None:
+            return error
+        down_error = None
+        try:
+            error = yield StreamFrom(host.url(path), payload)
+            down_error = error and error.host_down and error.detail
+        finally:
+            pool.release(host, down_error)
+        if not down_error or stream.parts:
+            return error
+        failed.append(host)
+        yield Call(log_system_event, ('WARNING', f'{error.detail} ({host.base_url}), trying another host',
+                                      stream.endpoint_type))
+        stream.restart()
+
+def generation_steps(app, stream, path, payload, ticket, session_id=None):
+    """The whole streamed generation, shared by the WSGI and ASGI endpoints.
+    
+    Checks Ollama, waits for a scheduler slot, then tries each model the
+    router and circuit breakers allow, falling back to a canned answer.
+    The transport's driver carries out every yielded instruction.
+    """
+    endpoint_type = stream.endpoint_type
+    try:
+        # The cached monitor state answers at once; check_ollama probes if it has none yet
+        if not (app.extensions['ollama_pool'].available or (yield Call(check_ollama, ()))):
+            yield Emit(sse_event({'error': 'AI service unavailable'}))
+            return
+        
+        if not (yield AwaitSlot(ticket, app.config.get('GENERATION_QUEUE_TIMEOUT', 120))):
+            yield Call(log_system_event, ('WARNING', 'Gave up waiting for a generation slot', endpoint_type))
+            yield Emit(sse_event({'error': 'AI service busy'}))
+            return
+        
+        failover, router = app.extensions['model_failover'], app.extensions['model_router']
+        preferred = router.choose(ticket.priority, app.extensions['generation_scheduler'].load()).model
+        hedge = should_hedge(app, endpoint_type)
+        tried, error = [], None
+        while True:
+            # Models whose breaker is open are skipped without being called
+            model = failover.next_model(tried, preferred)
+            if model is None:
+                break
+            tried.append(model)
+            stream.use_model(model, failover.primary)
+            model_payload = dict(payload, model=model)
+            if hedge:
+                error = yield RaceHosts(path, model_payload, session_id)
+            else:
+                error = yield from host_steps(app, path, model_payload, stream, session_id)
+            failover.record(model, error is None, stream.first_token_latency, error and error.detail)
+            if error is None:
+                if hedge:
+                    app.extensions['hedge_policy'].observe(stream.first_token_latency)
+                router.observe(model, *(stream.token_stats or (0, 0)))
+                yield Call(stream.save, ())
+                yield Emit(sse_event({'done': True}))
+                return
+            yield Call(log_system_event, (error.level, f'{error.detail} ({model})', endpoint_type))
+            if stream.parts:
+                # Part of this answer already reached the patient; another model cannot continue it
+                yield Emit(sse_event({'error': error.message}))
+                return
+        
+        fallback = yield Call(fallback_response, (endpoint_type,))
+        if fallback is None:
+            yield Emit(sse_event({'error': error.message if error else 'AI service unavailable'}))
+            return
+        yield Call(log_system_event, ('WARNING', 'No AI model available, sent fallback response', endpoint_type))
+        stream.use_model(FALLBACK_MODEL)
+        for event in stream.replay(fallback):
+            yield Emit(event)
+        yield Call(stream.save, ())
+        yield Emit(sse_event({'done': True}))
+    
+    except Exception as e:
+        yield Call(log_system_event, ('ERROR', f'AI streaming error: {str(e)}', endpoint_type))
+        yield Emit(sse_event({'error': 'Unexpected error'}))
+    finally:
+        stream.log_framing_issues(app.logger)
+
+def replay_steps(stream, text):
+    """A cache hit: no queueing and no Ollama call."""
+    try:
+        for event in stream.replay(text):
+            yield Emit(event)
+        yield Call(stream.save, ())
+        yield Emit(sse_event({'done': True}))
+    except Exception as e:
+        yield Call(log_system_event, ('ERROR', f'Cached response replay error: {str(e)}', stream.endpoint_type))
+        yield Emit(sse_event({'error': 'Unexpected error'}))
+
+def dashboard_steps(subscription, max_age=None):
+    """Push new assessments and urgency changes to one staff dashboard.
+
+    With ``max_age`` the stream ends after that many seconds; EventSource
+    then reconnects on its own, resuming from the last event id.
+    """
+    deadline = time.monotonic() + max_age if max_age else None
+    try:
+        yield Emit('retry: 5000\n\n')
+        while True:
+            timeout = DASHBOARD_KEEPALIVE
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
                     return
-                
-                for chunk in resp.iter_text():
-                    if chunk.strip():
-                        try:
-                            data = json.loads(chunk)
-                            if data.get('response'):
-                                full_response += data['response']
-                                yield f"data: {json.dumps({'chunk': data['response']})}\n\n"
-                            if data.get('done'):
-                                # Save assistant response
-                                response_time = (datetime.now() - start_time).total_seconds()
-                                save_ai_response(record_id, full_response, response_time, endpoint_type)
-                                yield f"data: {json.dumps({'done': True})}\n\n"
-                                return
-                        except json.JSONDecodeError:
-                            continue
-                            
-        except httpx.TimeoutException:
-            log_system_event('ERROR', 'AI request timeout', endpoint_type)
-            yield f"data: {json.dumps({'error': 'Request timeout'})}\n\n"
-        except Exception as e:
-            log_system_event('ERROR', f'AI streaming error: {str(e)}', endpoint_type)
-            yield f"data: {json.dumps({'error': 'Unexpected error'})}\n\n"
+                timeout = min(timeout, remaining)
+            events = yield AwaitEvents(subscription, timeout)
+            if not events:
+                yield Emit(': keep-alive\n\n')
+                continue
+            for event in events:
+                yield Emit(dashboard_sse(event))
+                if event.type == RESYNC:
+                    return
+    finally:
+        subscription.close()
+
+def run_steps(steps, stream=None):
+    """Carry out streaming steps on this request thread, yielding SSE events."""
+    result = error = None
+    try:
+        while True:
+            try:
+                step = steps.throw(error) if error is not None else steps.send(result)
+            except StopIteration:
+                return
+            result = error = None
+            try:
+                if isinstance(step, Emit):
+                    yield step.event
+                elif isinstance(step, Call):
+                    result = step.func(*step.args)
+                elif isinstance(step, AwaitSlot):
+                    result = yield from wait_for_generation_slot(step.ticket, step.timeout)
+                elif isinstance(step, StreamFrom):
+                    result = yield from generate_with_model(step.url, step.payload, stream)
+                elif isinstance(step, RaceHosts):
+                    result = yield from generate_hedged(step.path, step.payload, stream, step.session_id)
+                else:
+                    result = step.subscription.get(timeout=step.timeout)
+            except Exception as e:
+                error = e
+    finally:
+        steps.close()
+
+def wait_for_generation_slot(ticket, timeout):
+    """Block until ``ticket`` may run, yielding SSE queue-position events.
+    
+    Returns ``True`` once granted, ``False`` if ``timeout`` expires first.
+    """
+    last_position = None
+    while not ticket.granted:
+        position = ticket.position
+        if position and position != last_position:
+            last_position = position
+            yield sse_event({'queue_position': position})
+        if ticket.waited > timeout:
+            return False
+        ticket.wait(QUEUE_POLL_INTERVAL)
+    return True
+
+def replay_cached_response(stream, text):
+    """SSE generator for a cache hit."""
+    try:
+        yield from run_steps(replay_steps(stream, text), stream)
+    finally:
+        yield SSE_DONE
+
+def stream_ollama_response(prompt, record_id, endpoint_type, priority=PRIORITY_CHAT, session_id=None):
+    """Stream response from Ollama with error handling and logging."""
+    path, payload = ollama_generate_request(prompt)
+    stream = GenerationStream.for_app(current_app, record_id, endpoint_type)
+    stream.cache_key = response_cache_key(endpoint_type, payload)
+    cached = get_response_cache().get(stream.cache_key) if stream.cache_key else None
+    if cached is not None:
+        return Response(
+            stream_with_context(replay_cached_response(stream, cached)),
+            mimetype='text/event-stream',
+            headers=SSE_HEADERS
+        )
+    
+    scheduler = get_generation_scheduler()
+    try:
+        ticket = scheduler.submit(endpoint_type, priority)
+    except GenerationQueueFull as e:
+        log_system_event('WARNING', 'Generation queue full, request rejected', endpoint_type)
+        return queue_full_response(e.retry_after)
+    steps = generation_steps(current_app._get_current_object(), stream, path, payload, ticket, session_id)
+    
+    def generate():
+        try:
+            yield from run_steps(steps, stream)
         finally:
-            yield "data: [DONE]\n\n"
+            scheduler.release(ticket)
+            yield SSE_DONE
 
-    return Response(
+    response = Response(
         stream_with_context(generate()),
         mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'X-Accel-Buffering': 'no'  # Disable nginx buffering
-        }
+        headers=SSE_HEADERS
     )
+    # Frees the slot even if the client disconnects before the generator starts
+    response.call_on_close(lambda: scheduler.release(ticket))
+    return response
+
+def save_urgency_level(record_id, urgency):
+    """Record the urgency of a triage answer that is still generating."""
+    try:
+        assessment = db.session.get(TriageAssessment, record_id)
+        if assessment:
+            previous_level = assessment.urgency_level
+            assessment.urgency_level = urgency.level
+            assessment.confidence_score = urgency.confidence
+            db.session.commit()
+            publish_urgency_change(assessment, previous_level)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Failed to save urgency level: {e}")
+        return
+    if urgency.level == EMERGENCY:
+        log_system_event('WARNING', f'Emergency urgency detected mid-stream for assessment {record_id}', 'triage')
 
-def save_ai_response(record_id, response, response_time, endpoint_type):
+def save_ai_response(record_id, response, response_time, endpoint_type, urgency=None, model=None):
     """Save AI response to database."""
+    assessment = previous_level = None
     try:
         if endpoint_type == 'chat':
-            # Save chat assistant response
+            # Save chat assistant response alongside the user's message
+            user_msg = db.session.get(ChatMessage, record_id)
             assistant_msg = ChatMessage(
-                session_id=session['session_id'],
-                patient_id=ChatMessage.query.get(record_id).patient_id,
+                session_id=user_msg.session_id,
+                patient_id=user_msg.patient_id,
                 message=response,
                 role='assistant',
                 response_time=response_time
@@ -896,27 +1851,25 @@ def save_ai_response(record_id, response, response_time, endpoint_type):
             # Update triage assessment
             assessment = TriageAssessment.query.get(record_id)
             if assessment:
+                previous_level = assessment.urgency_level
+                urgency = urgency or classify_urgency(response)
                 assessment.ai_response = response
-                assessment.urgency_level = parse_urgency_level(response)
-                assessment.ai_model_used = current_app.config['PRIMARY_MODEL']
+                assessment.urgency_level = urgency.level
+                assessment.recommendations = response[:500]  # First 500 chars
+                assessment.confidence_score = urgency.confidence
+                assessment.ai_model_used = model or current_app.config['PRIMARY_MODEL']
         
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Failed to save AI response: {e}")
+        return
+    if assessment:
+        publish_urgency_change(assessment, previous_level)
 
 def parse_urgency_level(response):
     """Parse urgency level from AI response."""
-    response_lower = response.lower()
-    
-    if any(keyword in response_lower for keyword in ['emergency', '999', 'life-threatening']):
-        return 'Emergency'
-    elif any(keyword in response_lower for keyword in ['urgent', '111', 'immediate']):
-        return 'Urgent'
-    elif any(keyword in response_lower for keyword in ['gp', 'doctor', 'appointment']):
-        return 'Standard'
-    else:
-        return 'Self-care'
+    return classify_urgency(response).level
 
 # Application factory
 app = None
@@ -930,8 +1883,13 @@ def get_app():
 
 if __name__ == '__main__':
     app = create_app()
+    # With the reloader on this also runs in the watching parent, which serves nothing
+    if not app.config.get('DEBUG', False) or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        migrate_database(app)
+        start_background_services(app)
     print("🏥 NHS Digital Triage System Starting...")
-    print(f"🤖 Ollama: {'✅ Available' if check_ollama() else '❌ Not Available'}")
+    with app.app_context():
+        print(f"🤖 Ollama: {'✅ Available' if check_ollama(force=True) else '❌ Not Available'}")
     print("🌐 Interfaces:")
     print("   🏠 Home: http://localhost:5000")
     print("   💬 Chat: http://localhost:5000/chat")
@@ -0,0 +1,364 @@
+"""
+asgi.py - ASGI entry point for NHS Digital Triage
+
+Serves the SSE streaming endpoints (/api/chat/stream/<id>,
+/api/triage/stream/<id> and /api/dashboard/stream) natively on the event
+loop with httpx.AsyncClient, so a slow generation no longer pins a worker
+thread per patient.  What to do - model choice, failover, saving - comes
+from the transport-neutral steps in app.py; this module only carries them
+out asynchronously.  Every other request is handed to the Flask WSGI app
+unchanged.
+
+Run with:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import io
+import json
+import math
+import re
+from urllib.parse import parse_qs
+
+import anyio
+import httpx
+
+from app import (
+    create_app, get_app, migrate_database, start_background_services, stop_background_services,
+    db, ChatMessage, TriageAssessment, GenerationStream,
+    create_chat_prompt, create_assessment_prompt, generation_priority, log_system_event,
+    get_response_cache, ollama_generate_request, response_cache_key, sse_event,
+    SSE_DONE, SSE_HEADERS, QUEUE_POLL_INTERVAL,
+    Emit, Call, AwaitSlot, StreamFrom, RaceHosts, generation_steps, replay_steps, dashboard_steps,
+    INCOMPLETE_RESPONSE, NO_HOST_ERROR, race_failure, request_error, status_error
+)
+from generation_scheduler import GenerationQueueFull
+from hedging import TEXT, AsyncAttempt, HedgeRace
+from wsgi_adapter import WSGIAdapter, build_environ
+
+STREAM_ROUTE = re.compile(r'^/api/(chat|triage)/stream/(\d+)$')
+DASHBOARD_STREAM_ROUTE = '/api/dashboard/stream'
+
+
+class TriageASGIApp:
+    """Dispatch streaming routes to async handlers, everything else to Flask."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WSGIAdapter(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            if scope['path'] == DASHBOARD_STREAM_ROUTE:
+                hook_headers = await anyio.to_thread.run_sync(self.in_request_context, scope, None)
+                if hook_headers is not None:
+                    await self.dashboard_stream(scope, receive, send, hook_headers)
+                    return
+            match = STREAM_ROUTE.match(scope['path'])
+            if match:
+                prepared = await anyio.to_thread.run_sync(
+                    self.in_request_context, scope, self.prepare_generation, match.group(1), int(match.group(2))
+                )
+                if prepared is not None and prepared['cached'] is not None:
+                    stream = prepared['stream']
+                    await self.stream(receive, send, lambda send_event: self.run_generation(
+                        replay_steps(stream, prepared['cached']), stream, send_event), prepared['headers'])
+                    return
+                if prepared is not None:
+                    await self.admit_and_stream(prepared, receive, send)
+                    return
+            # Unknown record, or a request hook answered: Flask serves it as usual
+
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await anyio.to_thread.run_sync(migrate_database, self.flask_app)
+                start_background_services(self.flask_app)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Monitors, warm-up and keep-alive use the clients: stop them first
+                await anyio.to_thread.run_sync(stop_background_services, self.flask_app)
+                clients = self.flask_app.extensions['ollama_http']
+                await clients.aclose()
+                await anyio.to_thread.run_sync(clients.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def in_request_context(self, scope, func, *args):
+        """Run Flask's request hooks around ``func(*args)`` (in a worker thread).
+        
+        Routes served here then behave like Flask-served ones: the
+        before-request hooks run (session, first-request service start) and
+        the headers the after-request hooks add (CORS, session cookie) are
+        returned, as ``result['headers']`` or, without ``func``, on their own.
+        ``None`` means a hook answered or ``func`` found nothing: let Flask
+        serve the request.
+        """
+        with self.flask_app.request_context(build_environ(scope, io.BytesIO())):
+            try:
+                if self.flask_app.preprocess_request() is not None:
+                    return None
+                result = func(*args) if func else {}
+                if result is None:
+                    return None
+                response = self.flask_app.process_response(self.flask_app.response_class())
+                headers = [(name.lower().encode('latin1'), value.encode('latin1'))
+                           for name, value in response.headers.items()
+                           if name.lower() not in ('content-type', 'content-length')]
+                if func is None:
+                    return headers
+                result['headers'] = headers
+                return result
+            finally:
+                db.session.remove()
+
+    def prepare_generation(self, endpoint_type, record_id):
+        """Load the record and build the prompt (needs a request context)."""
+        if endpoint_type == 'chat':
+            record = db.session.get(ChatMessage, record_id)
+            prompt = record and create_chat_prompt(record.message)
+        else:
+            record = db.session.get(TriageAssessment, record_id)
+            prompt = record and create_assessment_prompt(record)
+        if record is None:
+            return None
+        path, payload = ollama_generate_request(prompt)
+        stream = GenerationStream.for_app(self.flask_app, record_id, endpoint_type)
+        stream.cache_key = response_cache_key(endpoint_type, payload)
+        return {
+            'path': path,
+            'payload': payload,
+            'session_id': record.session_id,
+            'priority': generation_priority(endpoint_type, record),
+            'stream': stream,
+            'cached': get_response_cache().get(stream.cache_key) if stream.cache_key else None
+        }
+
+    def run_in_app_context(self, func, *args):
+        with self.flask_app.app_context():
+            try:
+                return func(*args)
+            finally:
+                db.session.remove()
+
+    async def admit_and_stream(self, prepared, receive, send):
+        scheduler = self.flask_app.extensions['generation_scheduler']
+        endpoint_type = prepared['stream'].endpoint_type
+        try:
+            ticket = scheduler.submit(endpoint_type, prepared['priority'])
+        except GenerationQueueFull as e:
+            await anyio.to_thread.run_sync(
+                self.run_in_app_context, log_system_event,
+                'WARNING', 'Generation queue full, request rejected', endpoint_type
+            )
+            await self.send_queue_full(send, e.retry_after, prepared['headers'])
+            return
+        stream = prepared['stream']
+        steps = generation_steps(self.flask_app, stream, prepared['path'], prepared['payload'], ticket,
+                                 prepared['session_id'])
+        try:
+            await self.stream(receive, send, lambda send_event: self.run_generation(steps, stream, send_event),
+                              prepared['headers'])
+        finally:
+            scheduler.release(ticket)
+
+    async def send_queue_full(self, send, retry_after, hook_headers=()):
+        body = json.dumps({'error': 'AI service busy, please retry shortly', 'retry_after': retry_after}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'retry-after', str(retry_after).encode())
+            ] + list(hook_headers)
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def run_steps(self, steps, send_event, stream=None, wake=None):
+        """Async driver for the shared steps in app.py (``app.run_steps`` is the sync one)."""
+        result = error = None
+        try:
+            while True:
+                try:
+                    step = steps.throw(error) if error is not None else steps.send(result)
+                except StopIteration:
+                    return
+                result = error = None
+                try:
+                    if isinstance(step, Emit):
+                        await send_event(step.event)
+                    elif isinstance(step, Call):
+                        result = await anyio.to_thread.run_sync(self.run_in_app_context, step.func, *step.args)
+                    elif isinstance(step, AwaitSlot):
+                        result = await self.wait_for_slot(step.ticket, step.timeout, send_event)
+                    elif isinstance(step, StreamFrom):
+                        result = await self.generate_with_model(step.url, step.payload, stream, send_event)
+                    elif isinstance(step, RaceHosts):
+                        result = await self.generate_hedged(step.path, step.payload, stream, send_event,
+                                                            step.session_id)
+                    else:
+                        result = await self.wait_for_events(step.subscription, step.timeout, wake)
+                except Exception as e:
+                    error = e
+        finally:
+            steps.close()
+
+    async def run_generation(self, steps, stream, send_event):
+        """Run generation or replay steps, always ending with ``[DONE]`` like the sync path."""
+        try:
+            await self.run_steps(steps, send_event, stream)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await send_event(SSE_DONE)
+
+    async def wait_for_events(self, subscription, timeout, wake):
+        events = subscription.drain()
+        if not events:
+            with anyio.move_on_after(timeout):
+                await wake.wait()
+            wake.clear()
+            events = subscription.drain()
+        return events
+
+    async def wait_for_slot(self, ticket, timeout, send_event):
+        """Async twin of ``app.wait_for_generation_slot``."""
+        loop = asyncio.get_running_loop()
+        granted = anyio.Event()
+        ticket.on_grant(lambda: loop.call_soon_threadsafe(granted.set))
+
+        last_position = None
+        while not granted.is_set():
+            position = ticket.position
+            if position and position != last_position:
+                last_position = position
+                await send_event(sse_event({'queue_position': position}))
+            if ticket.waited > timeout:
+                return False
+            with anyio.move_on_after(QUEUE_POLL_INTERVAL):
+                await granted.wait()
+        return True
+
+    async def stream(self, receive, send, produce, hook_headers=()):
+        """Send an SSE response whose events come from ``produce(send_event)``."""
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream; charset=utf-8')] + [
+                (name.lower().encode(), value.encode()) for name, value in SSE_HEADERS.items()
+            ] + list(hook_headers)
+        })
+
+        async def send_event(event):
+            await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+
+        async with anyio.create_task_group() as tg:
+            async def watch_disconnect():
+                # Stop generating (and free the Ollama connection) if the patient leaves
+                while (await receive())['type'] != 'http.disconnect':
+                    pass
+                tg.cancel_scope.cancel()
+
+            tg.start_soon(watch_disconnect)
+            try:
+                await produce(send_event)
+            finally:
+                tg.cancel_scope.cancel()
+
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def dashboard_stream(self, scope, receive, send, hook_headers=()):
+        headers = dict(scope['headers'])
+        last_event_id = (headers.get(b'last-event-id', b'').decode()
+                         or parse_qs(scope['query_string'].decode()).get('last_event_id', [None])[0])
+        subscription = self.flask_app.extensions['event_bus'].subscribe(last_event_id)
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        subscription.on_event(lambda: loop.call_soon_threadsafe(wake.set))
+        await self.stream(receive, send, lambda send_event: self.run_steps(
+            dashboard_steps(subscription), send_event, wake=wake), hook_headers)
+
+    async def feed_stream(self, texts, stream, send_event):
+        """Async twin of ``app.feed_stream``; ``texts`` is an async iterator."""
+        async for text in texts:
+            for event in stream.feed(text):
+                await send_event(event)
+            if stream.urgency_pending:
+                await anyio.to_thread.run_sync(self.run_in_app_context, stream.persist_urgency)
+            if stream.done:
+                break
+        else:
+            for event in stream.flush():
+                await send_event(event)
+        return None if stream.done else INCOMPLETE_RESPONSE
+
+    async def generate_with_model(self, url, payload, stream, send_event):
+        """Async twin of ``app.generate_with_model``."""
+        client = self.flask_app.extensions['ollama_http'].async_client
+        try:
+            async with client.stream('POST', url, json=payload) as resp:
+                if resp.status_code != 200:
+                    return status_error(resp.status_code)
+                return await self.feed_stream(resp.aiter_text(), stream, send_event)
+        except httpx.TransportError as e:
+            return request_error(e)
+
+    async def generate_hedged(self, path, payload, stream, send_event, session_id=None):
+        """Async twin of ``app.generate_hedged``."""
+        client = self.flask_app.extensions['ollama_http'].async_client
+        outbox, inbox = anyio.create_memory_object_stream(math.inf)
+        async with anyio.create_task_group() as tasks:
+            def launch(host):
+                attempt = AsyncAttempt(client, host.url(path), payload, outbox.send)
+                tasks.start_soon(attempt.run)
+                return attempt
+
+            race = HedgeRace(self.flask_app.extensions['ollama_pool'], self.flask_app.extensions['hedge_policy'],
+                             launch, session_id)
+            down_error = None
+            try:
+                if not race.start():
+                    return NO_HOST_ERROR
+                while not race.settled:
+                    with anyio.move_on_after(race.timeout()) as waiting:
+                        race.report(*await inbox.receive())
+                    if waiting.cancelled_caught:
+                        race.on_timeout()
+                if race.winner is None:
+                    return race_failure(*race.failure)
+
+                async def winner_texts():
+                    yield race.first_text
+                    while True:
+                        attempt, kind, value = await inbox.receive()
+                        if attempt is not race.winner:
+                            continue
+                        if kind != TEXT:
+                            if isinstance(value, Exception):
+                                raise value
+                            return
+                        yield value
+
+                try:
+                    error = await self.feed_stream(winner_texts(), stream, send_event)
+                except httpx.TransportError as e:
+                    error = request_error(e)
+                down_error = error and error.host_down and error.detail
+                return error
+            finally:
+                race.close(down_error)
+
+def create_asgi_app(config_name=None):
+    """Build the ASGI application around a fresh Flask app."""
+    return TriageASGIApp(create_app(config_name))
+
+
+# Wrap the module-level Flask app so both servers share one set of pools/monitors
+application = TriageASGIApp(get_app())
@@ -12,6 +12,9 @@ import time
 import sys
 import os
 
+# One keep-alive session for every probe so the checks reuse connections
+http = requests.Session()
+
 def check_ollama_installation():
     """Check if Ollama is installed."""
     print("🔍 Checking Ollama installation...")
@@ -32,7 +35,7 @@ def check_ollama_service():
     """Check if Ollama service is running."""
     print("🔍 Checking Ollama service...")
     try:
-        response = requests.get('http://localhost:11434/api/version', timeout=5)
+        response = http.get('http://localhost:11434/api/version', timeout=5)
         if response.status_code == 200:
             data = response.json()
             print(f"✅ Ollama service running: v{data.get('version', 'unknown')}")
@@ -71,7 +74,7 @@ def test_ai_generation():
     """Test AI model generation."""
     print("🔍 Testing AI generation...")
     try:
-        response = requests.post('http://localhost:11434/api/generate', 
+        response = http.post('http://localhost:11434/api/generate', 
                                json={
                                    'model': 'gemma3:4b',
                                    'prompt': 'Hello, how are you?',
@@ -97,7 +100,7 @@ def check_flask_app():
     """Check if Flask app is running."""
     print("🔍 Checking Flask application...")
     try:
-        response = requests.get('http://localhost:5000/api/health', timeout=5)
+        response = http.get('http://localhost:5000/api/health', timeout=5)
         if response.status_code == 200:
             data = response.json()
             if data.get('status') == 'healthy':
@@ -0,0 +1,162 @@
+"""
+circuit_breaker.py - Per-model circuit breakers and failover order
+
+Each model gets a ``CircuitBreaker`` fed with the outcome of every
+generation: failed calls and calls whose first token took longer than
+``slow_call_seconds`` both count as bad.  Once ``min_calls`` outcomes are in
+the window and the bad fraction reaches ``failure_rate`` the breaker opens
+and the model is skipped outright, so patients stop waiting on a failing
+path.  After ``open_seconds`` one trial call is let through (half-open); its
+outcome closes the breaker again or re-opens it.
+
+``ModelFailover`` walks the configured models in order (PRIMARY_MODEL, then
+BACKUP_MODEL, or the caller's preferred model first) and hands out the first
+one whose breaker allows a call.
+"""
+
+import threading
+import time
+from collections import deque
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a sliding window of call outcomes."""
+
+    def __init__(self, window=20, min_calls=5, failure_rate=0.5, slow_call_seconds=20.0,
+                 open_seconds=30.0, clock=time.monotonic):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # True for a bad call
+        self._state = CLOSED
+        self._opened_at = None
+        self._trial_started = None
+
+        self.opened = 0
+        self.rejected = 0
+        self.last_error = None
+
+    @property
+    def state(self):
+        with self._lock:
+            self._advance()
+            return self._state
+
+    def _advance(self):
+        if self._state == OPEN and self.clock() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._trial_started = None
+
+    def allow(self):
+        """Whether a call may go ahead now; in half-open state only one trial may."""
+        with self._lock:
+            self._advance()
+            if self._state == CLOSED:
+                return True
+            # A trial that never reported back (client gone) does not block the next forever
+            if self._state == HALF_OPEN and (self._trial_started is None
+                                             or self.clock() - self._trial_started >= self.open_seconds):
+                self._trial_started = self.clock()
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok, latency=None, error=None):
+        """Record one call's outcome; ``latency`` is its time to first token."""
+        bad = not ok or (latency is not None and latency > self.slow_call_seconds)
+        with self._lock:
+            if not ok:
+                self.last_error = error
+            if self._state == HALF_OPEN:
+                if bad:
+                    self._open()
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                return
+            self._outcomes.append(bad)
+            if (self._state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate):
+                self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = self.clock()
+        self._trial_started = None
+        self._outcomes.clear()
+        self.opened += 1
+
+    def stats(self):
+        with self._lock:
+            self._advance()
+            return {
+                'state': self._state,
+                'recent_calls': len(self._outcomes),
+                'recent_bad_calls': sum(self._outcomes),
+                'times_opened': self.opened,
+                'rejected': self.rejected,
+                'last_error': self.last_error,
+            }
+
+
+class ModelFailover:
+    """Ordered models, each behind its own breaker."""
+
+    def __init__(self, models, **breaker_options):
+        # dict.fromkeys keeps order and drops a backup that equals the primary
+        self.models = [model for model in dict.fromkeys(models) if model]
+        self.breakers = {model: CircuitBreaker(**breaker_options) for model in self.models}
+        self._lock = threading.Lock()
+        self.served = {}
+        self.failovers = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            [config.get('PRIMARY_MODEL'), config.get('BACKUP_MODEL')],
+            window=config.get('BREAKER_WINDOW', 20),
+            min_calls=config.get('BREAKER_MIN_CALLS', 5),
+            failure_rate=config.get('BREAKER_FAILURE_RATE', 0.5),
+            slow_call_seconds=config.get('BREAKER_SLOW_CALL_SECONDS', 20.0),
+            open_seconds=config.get('BREAKER_OPEN_SECONDS', 30.0)
+        )
+
+    @property
+    def primary(self):
+        return self.models[0] if self.models else None
+
+    def next_model(self, tried=(), preferred=None):
+        """The first untried model whose breaker allows a call, or ``None``."""
+        order = self.models
+        if preferred in self.models:
+            order = [preferred] + [model for model in self.models if model != preferred]
+        for model in order:
+            if model not in tried and self.breakers[model].allow():
+                if model != order[0]:
+                    self._count('failovers')
+                return model
+        self._count('fallbacks')
+        return None
+
+    def record(self, model, ok, latency=None, error=None):
+        self.breakers[model].record(ok, latency, error)
+        if ok:
+            with self._lock:
+                self.served[model] = self.served.get(model, 0) + 1
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        with self._lock:
+            counts = {'served': dict(self.served), 'failovers': self.failovers, 'fallbacks': self.fallbacks}
+        return {'models': {model: breaker.stats() for model, breaker in self.breakers.items()}, **counts}
@@ -14,12 +14,85 @@ class Config:
     
     # AI/Ollama Settings
     OLLAMA_BASE_URL = os.environ.get('OLLAMA_BASE_URL') or 'http://localhost:11434'
+    # Comma-separated Ollama hosts to balance across; defaults to OLLAMA_BASE_URL alone
+    OLLAMA_BASE_URLS = [url.strip() for url in (os.environ.get('OLLAMA_BASE_URLS') or OLLAMA_BASE_URL).split(',')
+                        if url.strip()]
+    OLLAMA_SESSION_AFFINITY = os.environ.get('OLLAMA_SESSION_AFFINITY', 'true').lower() == 'true'  # keep a session on one host
+    OLLAMA_AFFINITY_TTL = float(os.environ.get('OLLAMA_AFFINITY_TTL', 1800))  # seconds a session stays pinned after its last turn
+    OLLAMA_AFFINITY_MAX_SESSIONS = int(os.environ.get('OLLAMA_AFFINITY_MAX_SESSIONS', 10000))
     PRIMARY_MODEL = os.environ.get('PRIMARY_MODEL') or 'llama3.2:3b'
     BACKUP_MODEL = os.environ.get('BACKUP_MODEL') or 'llama3.2:1b'
     AI_TIMEOUT = int(os.environ.get('AI_TIMEOUT', 60))
     AI_TEMPERATURE = float(os.environ.get('AI_TEMPERATURE', 0.3))
     AI_TOP_P = float(os.environ.get('AI_TOP_P', 0.9))
     
+    # Ollama availability monitor (background probe, cached state)
+    OLLAMA_MONITOR_ENABLED = os.environ.get('OLLAMA_MONITOR_ENABLED', 'true').lower() == 'true'
+    OLLAMA_HEALTH_INTERVAL = float(os.environ.get('OLLAMA_HEALTH_INTERVAL', 15))
+    OLLAMA_HEALTH_TTL = float(os.environ.get('OLLAMA_HEALTH_TTL', 45))
+    OLLAMA_HEALTH_TIMEOUT = float(os.environ.get('OLLAMA_HEALTH_TIMEOUT', 3))
+    
+    # Model warm-up: load models before patient traffic and keep them resident
+    WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', 'true').lower() == 'true'
+    OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '30m')  # sent with every generation, e.g. '30m', '2h'
+    KEEP_WARM_INTERVAL = float(os.environ.get('KEEP_WARM_INTERVAL', 240))  # seconds between keep-warm pings
+    KEEP_WARM_IDLE = float(os.environ.get('KEEP_WARM_IDLE', 3600))  # stop pinging after this long without traffic (0: never)
+    WARMUP_MAX_BACKOFF = float(os.environ.get('WARMUP_MAX_BACKOFF', 30))  # seconds between /api/tags retries, at most
+    WARMUP_LOAD_TIMEOUT = float(os.environ.get('WARMUP_LOAD_TIMEOUT', 120))  # seconds to load one model
+    
+    # Pooled Ollama HTTP client (read timeout is AI_TIMEOUT, applied per chunk)
+    OLLAMA_POOL_MAX_CONNECTIONS = int(os.environ.get('OLLAMA_POOL_MAX_CONNECTIONS', 20))
+    OLLAMA_POOL_MAX_KEEPALIVE = int(os.environ.get('OLLAMA_POOL_MAX_KEEPALIVE', 10))
+    OLLAMA_KEEPALIVE_EXPIRY = float(os.environ.get('OLLAMA_KEEPALIVE_EXPIRY', 30))
+    OLLAMA_CONNECT_TIMEOUT = float(os.environ.get('OLLAMA_CONNECT_TIMEOUT', 3))
+    OLLAMA_POOL_TIMEOUT = float(os.environ.get('OLLAMA_POOL_TIMEOUT', 5))
+    OLLAMA_STREAM_MAX_LINE = int(os.environ.get('OLLAMA_STREAM_MAX_LINE', 1024 * 1024))  # chars per NDJSON line
+    
+    # Model failover: a circuit breaker per model over its recent calls
+    BREAKER_WINDOW = int(os.environ.get('BREAKER_WINDOW', 20))  # recent calls considered
+    BREAKER_MIN_CALLS = int(os.environ.get('BREAKER_MIN_CALLS', 5))  # calls needed before the breaker can open
+    BREAKER_FAILURE_RATE = float(os.environ.get('BREAKER_FAILURE_RATE', 0.5))  # bad fraction that opens it
+    BREAKER_SLOW_CALL_SECONDS = float(os.environ.get('BREAKER_SLOW_CALL_SECONDS', 20))  # first token slower than this is bad
+    BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', 30))  # before a half-open trial call
+    AI_FALLBACK_ENABLED = os.environ.get('AI_FALLBACK_ENABLED', 'true').lower() == 'true'  # canned advice when no model answers
+    
+    # Hedged triage: re-send a generation to a second host when its first token is late (needs 2+ hosts)
+    HEDGE_ENABLED = os.environ.get('HEDGE_ENABLED', 'false').lower() == 'true'
+    HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 95))  # of recent triage first-token latencies
+    HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', 1))  # seconds; the percentile is clamped to this range
+    HEDGE_MAX_DELAY = float(os.environ.get('HEDGE_MAX_DELAY', 15))
+    HEDGE_DEFAULT_DELAY = float(os.environ.get('HEDGE_DEFAULT_DELAY', 5))  # until HEDGE_MIN_SAMPLES latencies are known
+    HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', 20))
+    HEDGE_MAX_RATIO = float(os.environ.get('HEDGE_MAX_RATIO', 0.1))  # at most this many hedges per triage request
+    
+    # Load-adaptive model choice: under pressure chat turns use BACKUP_MODEL, triage stays on PRIMARY_MODEL
+    MODEL_ROUTING_ENABLED = os.environ.get('MODEL_ROUTING_ENABLED', 'true').lower() == 'true'
+    MODEL_LATENCY_SLO_SECONDS = float(os.environ.get('MODEL_LATENCY_SLO_SECONDS', 30))  # predicted primary answer time
+    MODEL_DOWNGRADE_LOAD = int(os.environ.get('MODEL_DOWNGRADE_LOAD', 3))  # generations running or queued, incl. this one
+    MODEL_RATE_WINDOW = int(os.environ.get('MODEL_RATE_WINDOW', 20))  # recent generations behind tokens/sec
+    
+    # Generation admission control (concurrent /api/generate calls + waiting queue)
+    GENERATION_MAX_IN_FLIGHT = int(os.environ.get('GENERATION_MAX_IN_FLIGHT', 2))
+    GENERATION_MAX_QUEUE = int(os.environ.get('GENERATION_MAX_QUEUE', 20))
+    GENERATION_QUEUE_TIMEOUT = float(os.environ.get('GENERATION_QUEUE_TIMEOUT', 120))  # seconds
+    GENERATION_RETRY_AFTER = int(os.environ.get('GENERATION_RETRY_AFTER', 10))  # seconds, before any timings exist
+    GENERATION_AGING_SECONDS = float(os.environ.get('GENERATION_AGING_SECONDS', 30))  # head start triage gets over chat
+    GENERATION_MAX_EMERGENCY_OVERFLOW = int(os.environ.get('GENERATION_MAX_EMERGENCY_OVERFLOW', 10))  # extra queue slots only emergencies may use
+    
+    # Cache of completed triage generations, keyed on prompt + model + sampling options
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 3600))  # seconds
+    
+    # /api/system-status table counts are cached for this long (seconds)
+    STATUS_SNAPSHOT_TTL = float(os.environ.get('STATUS_SNAPSHOT_TTL', 10))
+    DASHBOARD_EVENT_HISTORY = int(os.environ.get('DASHBOARD_EVENT_HISTORY', 500))  # live-feed events kept for Last-Event-ID resume
+    # Each WSGI dashboard stream holds a worker thread: cap them, and end each one
+    # after this many seconds (the browser reconnects and resumes from Last-Event-ID)
+    DASHBOARD_MAX_STREAMS = int(os.environ.get('DASHBOARD_MAX_STREAMS', 20))
+    DASHBOARD_STREAM_MAX_AGE = float(os.environ.get('DASHBOARD_STREAM_MAX_AGE', 300))
+    DASHBOARD_STREAM_RETRY_AFTER = int(os.environ.get('DASHBOARD_STREAM_RETRY_AFTER', 30))  # seconds, when at the cap
+    
     # Security Settings
     WTF_CSRF_ENABLED = True
     WTF_CSRF_TIME_LIMIT = 3600
@@ -28,12 +101,38 @@ class Config:
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
     LOG_FILE = os.environ.get('LOG_FILE', 'logs/nhs_triage.log')
     
-    # Rate Limiting
+    # SystemLog write-behind (rows are bulk-inserted by a background thread)
+    SYSTEM_LOG_ASYNC = os.environ.get('SYSTEM_LOG_ASYNC', 'true').lower() == 'true'
+    SYSTEM_LOG_QUEUE_SIZE = int(os.environ.get('SYSTEM_LOG_QUEUE_SIZE', 10000))
+    SYSTEM_LOG_BATCH_SIZE = int(os.environ.get('SYSTEM_LOG_BATCH_SIZE', 200))
+    SYSTEM_LOG_FLUSH_INTERVAL = float(os.environ.get('SYSTEM_LOG_FLUSH_INTERVAL', 2))  # seconds
+    SYSTEM_LOG_BLOCK_TIMEOUT = float(os.environ.get('SYSTEM_LOG_BLOCK_TIMEOUT', 0.05))  # max wait for room, warnings/errors only
+    
+    # SQLite connection profile (applied to every new connection; ignored for other databases)
+    SQLITE_PRAGMAS = {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),  # readers and the writer stop blocking each other
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),  # durable at checkpoints, safe with WAL
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # ms to wait for a lock
+        'cache_size': -int(os.environ.get('SQLITE_CACHE_KIB', 20000)),  # negative means KiB, not pages
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'temp_store': 'MEMORY'
+    }
+    SQLITE_READ_POOL_ENABLED = os.environ.get('SQLITE_READ_POOL_ENABLED', 'true').lower() == 'true'
+    SQLITE_READ_POOL_SIZE = int(os.environ.get('SQLITE_READ_POOL_SIZE', 5))  # query-only connections for dashboards/stats
+    SQLITE_READ_POOL_OVERFLOW = int(os.environ.get('SQLITE_READ_POOL_OVERFLOW', 10))
+    
+    # Rate Limiting (memory:// per process, redis://... shared between workers)
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'true').lower() == 'true'
     RATELIMIT_STORAGE_URL = os.environ.get('REDIS_URL', 'memory://')
-    RATELIMIT_DEFAULT = "100 per hour"
+    RATELIMIT_DEFAULT = os.environ.get('RATELIMIT_DEFAULT', "100 per hour")  # per client IP, per route
+    RATELIMIT_ROUTE_LIMITS = {  # per session
+        'chat': os.environ.get('RATELIMIT_CHAT', "10 per hour"),
+        'triage': os.environ.get('RATELIMIT_TRIAGE', "20 per hour")
+    }
     
     # Medical Settings
     MAX_ASSESSMENT_DURATION = int(os.environ.get('MAX_ASSESSMENT_DURATION', 3600))  # 1 hour
+    EMERGENCY_SEVERITY_THRESHOLD = int(os.environ.get('EMERGENCY_SEVERITY_THRESHOLD', 8))  # 1-10, prioritised as emergency
     EMERGENCY_KEYWORDS = [
         'chest pain', 'difficulty breathing', 'unconscious', 'severe bleeding',
         'allergic reaction', 'stroke symptoms', 'heart attack', 'suicide'
@@ -42,6 +141,12 @@ class Config:
     # Data Retention
     PATIENT_DATA_RETENTION_DAYS = int(os.environ.get('PATIENT_DATA_RETENTION_DAYS', 30))
     CHAT_DATA_RETENTION_DAYS = int(os.environ.get('CHAT_DATA_RETENTION_DAYS', 7))
+    RETENTION_ENABLED = os.environ.get('RETENTION_ENABLED', 'true').lower() == 'true'
+    RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', 3600))  # seconds between purges
+    RETENTION_INITIAL_DELAY = float(os.environ.get('RETENTION_INITIAL_DELAY', 300))  # first purge after boot
+    RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))  # starting rows per delete
+    RETENTION_BATCH_BUDGET = float(os.environ.get('RETENTION_BATCH_BUDGET', 0.25))  # seconds; slower batches shrink
+    RETENTION_RUN_BUDGET = float(os.environ.get('RETENTION_RUN_BUDGET', 30))  # seconds; the rest waits for the next run
     
     @staticmethod
     def init_app(app):
@@ -67,6 +172,10 @@ class TestingConfig(Config):
     # Testing-specific settings
     AI_TIMEOUT = 10  # Shorter timeout for tests
     PATIENT_DATA_RETENTION_DAYS = 1
+    OLLAMA_MONITOR_ENABLED = False  # No background probing in tests
+    SYSTEM_LOG_ASYNC = False  # Write log rows immediately so tests can assert on them
+    RETENTION_ENABLED = False  # Tests call purge_expired_data directly
+    WARMUP_ENABLED = False  # Tests call ModelWarmer.warm_host directly
 
 class ProductionConfig(Config):
     """Production configuration."""
@@ -74,6 +183,15 @@ class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///nhs_triage.db'
     
+    # Writer pool: SSE saves, chat inserts and log batches share these connections
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': 3600,
+        'pool_pre_ping': True
+    }
+    
     # Production-specific security
     SESSION_COOKIE_SECURE = True
     SESSION_COOKIE_HTTPONLY = True
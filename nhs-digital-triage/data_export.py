@@ -0,0 +1,234 @@
+"""
+data_export.py - Streaming, constant-memory data export
+
+Rows are read from the database in ``yield_per`` batches (assessments with
+their patient joined in the same query) and written out one record at a
+time, so memory stays flat however many rows are exported.  Writers take
+any text stream; ``open_export`` adds optional gzip compression.
+
+For analytics, ``write_columnar`` writes a table to Parquet or Arrow IPC
+with typed columns: categoricals for low-cardinality text such as
+``urgency_level``, list columns for the JSON arrays, and one row group per
+database batch.  It needs the optional ``pyarrow`` package.
+"""
+
+import csv
+import gzip
+import io
+import json
+import sys
+from contextlib import contextmanager
+
+from sqlalchemy import select, func, types
+from sqlalchemy.orm import joinedload
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for --format parquet/arrow
+    pa = pq = None
+
+from app import db, Patient, TriageAssessment, ChatMessage
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_TABLES = {
+    'patients': Patient,
+    'triage_assessments': TriageAssessment,
+    'chat_messages': ChatMessage,
+}
+COLUMNAR_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+# Low-cardinality text stored as dictionary-encoded (categorical) columns
+CATEGORICAL_COLUMNS = {'gender', 'symptom_category', 'duration', 'urgency_level', 'ai_model_used', 'role'}
+
+CSV_HEADER = [
+    'Patient Name', 'Age', 'Gender', 'Primary Symptom',
+    'Severity', 'Urgency Level', 'Assessment Date'
+]
+
+
+def count_rows(model, since=None):
+    return db.session.scalar(_since(select(func.count()).select_from(model), model, since))
+
+
+def changed_at(model):
+    """The column an incremental export compares against ``since``.
+
+    Rows changed strictly after ``since`` are exported, so passing the
+    previous run's ``latest`` back in neither repeats its newest rows nor
+    skips any changed since.
+    """
+    return getattr(model, 'updated_at', model.created_at)
+
+
+def _since(query, model, since):
+    return query.where(changed_at(model) > since) if since else query
+
+
+def iter_patients(batch_size=EXPORT_BATCH_SIZE, since=None):
+    """Yield every patient, fetched ``batch_size`` rows at a time."""
+    query = _since(select(Patient), Patient, since).order_by(Patient.id)
+    yield from db.session.scalars(query.execution_options(yield_per=batch_size))
+
+
+def iter_assessments(batch_size=EXPORT_BATCH_SIZE, since=None):
+    """Yield every assessment with its patient already loaded."""
+    query = (_since(select(TriageAssessment), TriageAssessment, since)
+             .options(joinedload(TriageAssessment.patient))
+             .order_by(TriageAssessment.id))
+    yield from db.session.scalars(query.execution_options(yield_per=batch_size))
+
+
+def assessment_csv_row(assessment):
+    patient = assessment.patient
+    return [
+        f"{patient.first_name} {patient.last_name}" if patient else '',
+        patient.age if patient else '',
+        patient.gender if patient else '',
+        assessment.primary_symptom,
+        assessment.severity,
+        assessment.urgency_level,
+        assessment.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    ]
+
+
+def write_json(stream, patients, assessments, export_timestamp):
+    """Write the ``{"patients": [...], "assessments": [...]}`` document incrementally."""
+    stream.write('{\n  "export_timestamp": %s,\n' % json.dumps(export_timestamp))
+    for name, records, last in (('patients', patients, False), ('assessments', assessments, True)):
+        stream.write(f'  "{name}": [')
+        separator = '\n    '
+        for record in records:
+            stream.write(separator + json.dumps(record.to_dict()))
+            separator = ',\n    '
+        stream.write('\n  ]' + ('\n' if last else ',\n'))
+    stream.write('}\n')
+
+
+def write_jsonl(stream, patients, assessments):
+    """Write one JSON object per line, tagged with its record type."""
+    for record_type, records in (('patient', patients), ('assessment', assessments)):
+        for record in records:
+            stream.write(json.dumps({'type': record_type, **record.to_dict()}) + '\n')
+
+
+def write_csv(stream, assessments):
+    writer = csv.writer(stream)
+    writer.writerow(CSV_HEADER)
+    for assessment in assessments:
+        writer.writerow(assessment_csv_row(assessment))
+
+
+def arrow_type(column):
+    if isinstance(column.type, types.JSON):
+        return pa.list_(pa.string())
+    if isinstance(column.type, types.Boolean):
+        return pa.bool_()
+    if isinstance(column.type, types.Integer):
+        return pa.int64()
+    if isinstance(column.type, types.Float):
+        return pa.float64()
+    if isinstance(column.type, types.DateTime):
+        # Stored as naive UTC
+        return pa.timestamp('us', tz='UTC')
+    if column.name in CATEGORICAL_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+def arrow_schema(model):
+    return pa.schema([pa.field(column.name, arrow_type(column), nullable=column.nullable)
+                      for column in model.__table__.columns])
+
+
+def _as_list(value):
+    if value is None:
+        return None
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    return [str(item) for item in value]
+
+
+def _record_batch(schema, rows, categories):
+    arrays = []
+    for index, field in enumerate(schema):
+        values = [row[index] for row in rows]
+        if pa.types.is_dictionary(field.type):
+            # Append-only dictionaries: each batch's dictionary extends the last,
+            # which Arrow IPC files can store as deltas
+            codes = categories.setdefault(field.name, {})
+            indices = [None if value is None else codes.setdefault(value, len(codes)) for value in values]
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(indices, type=pa.int32()),
+                                                         pa.array(list(codes), type=pa.string())))
+            continue
+        if pa.types.is_list(field.type):
+            values = [_as_list(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def require_pyarrow():
+    """Fail before any work starts when the optional ``pyarrow`` package is missing."""
+    if pa is None:
+        raise RuntimeError("Parquet/Arrow export needs the 'pyarrow' package (pip install pyarrow)")
+
+
+def write_columnar(model, path, output_format='parquet', since=None,
+                   batch_size=EXPORT_BATCH_SIZE, on_batch=None):
+    """Write ``model``'s table to ``path`` as Parquet or Arrow IPC.
+
+    Returns ``(rows, latest)`` where ``latest`` is the newest change
+    timestamp written, i.e. the ``since`` for this table's next incremental
+    export (``since`` again if nothing changed).  Tables move at different
+    rates, so each keeps its own watermark.
+    """
+    require_pyarrow()
+    schema = arrow_schema(model)
+    change_index = list(model.__table__.columns).index(changed_at(model).expression)
+    query = _since(select(*model.__table__.columns), model, since).order_by(model.id)
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+
+    if output_format == 'parquet':
+        writer = pq.ParquetWriter(path, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+    rows, latest, categories = 0, None, {}
+    try:
+        for partition in result.partitions():
+            # One row group (or IPC record batch) per database batch
+            writer.write_batch(_record_batch(schema, partition, categories))
+            rows += len(partition)
+            newest = max((row[change_index] for row in partition if row[change_index]), default=None)
+            if newest and (latest is None or newest > latest):
+                latest = newest
+            if on_batch:
+                on_batch(len(partition))
+    finally:
+        writer.close()
+    return rows, latest or since
+
+
+@contextmanager
+def open_export(path=None, compress=False):
+    """Open ``path`` (or stdout) for text output, gzip-compressed if asked."""
+    if path is None:
+        if not compress:
+            yield sys.stdout
+            return
+        raw, owned = sys.stdout.buffer, False
+    else:
+        raw, owned = open(path, 'wb'), True
+    try:
+        binary = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+        stream = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+        try:
+            yield stream
+        finally:
+            stream.flush()
+            stream.detach()
+            if compress:
+                binary.close()
+    finally:
+        if owned:
+            raw.close()
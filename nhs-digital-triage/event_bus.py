@@ -0,0 +1,151 @@
+"""
+event_bus.py - In-process publish/subscribe for live dashboard updates
+
+Publishers (request handlers) call ``EventBus.publish``; every connected
+dashboard holds a ``Subscription`` and receives only the new events.  The
+bus keeps a short ring buffer of recent events so a reconnecting browser can
+resume from its ``Last-Event-ID``.  Event ids carry a per-process epoch, so
+an id from before a restart (or one older than the buffer) asks the client
+to resync instead of silently missing events.
+"""
+
+import itertools
+import threading
+import uuid
+from collections import deque, namedtuple
+
+BusEvent = namedtuple('BusEvent', ['id', 'type', 'data'])
+
+RESYNC = 'resync'
+
+
+class Subscription:
+    """One subscriber's pending events; readable from a thread or an event loop."""
+
+    def __init__(self, bus, max_pending):
+        self.bus = bus
+        self.max_pending = max_pending
+        self.overflowed = False
+        self.closed = False
+        self._pending = deque()
+        self._ready = threading.Condition(threading.Lock())
+        self._callbacks = []
+
+    def _push(self, event):
+        with self._ready:
+            if self.closed:
+                return
+            if len(self._pending) >= self.max_pending:
+                # A subscriber this far behind resyncs rather than buffering forever
+                self.overflowed = True
+                self._pending.clear()
+                self._pending.append(BusEvent(event.id, RESYNC, {}))
+            elif not self.overflowed:
+                self._pending.append(event)
+            self._ready.notify_all()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except RuntimeError:
+                pass  # subscriber's event loop already closed; close() will follow
+
+    def drain(self):
+        """Return and clear every pending event without blocking."""
+        with self._ready:
+            events = list(self._pending)
+            self._pending.clear()
+            return events
+
+    def get(self, timeout=None):
+        """Block until events arrive (or ``timeout``) and return them."""
+        with self._ready:
+            if not self._pending and not self.closed:
+                self._ready.wait(timeout)
+            events = list(self._pending)
+            self._pending.clear()
+            return events
+
+    def on_event(self, callback):
+        """Call ``callback()`` (from the publisher's thread) whenever events arrive."""
+        with self._ready:
+            self._callbacks.append(callback)
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify_all()
+        self.bus._unsubscribe(self)
+
+
+class EventBus:
+    """Fan out published events to all current subscribers."""
+
+    def __init__(self, history=500, max_pending=1000):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+
+        self.published = 0
+
+    def publish(self, event_type, data):
+        with self._lock:
+            event = BusEvent(f"{self.epoch}-{next(self._ids)}", event_type, data)
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+            self.published += 1
+        for subscription in subscribers:
+            subscription._push(event)
+        return event
+
+    def subscribe(self, last_event_id=None):
+        """Subscribe, replaying anything published after ``last_event_id``."""
+        subscription = Subscription(self, self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if last_event_id:
+                backlog = self._since(last_event_id)
+                if backlog is None:
+                    backlog = [BusEvent(self._latest_id(), RESYNC, {})]
+                subscription._pending.extend(backlog)
+        return subscription
+
+    def latest_id(self):
+        """Id of the newest event, to render into a page as its resume cursor."""
+        with self._lock:
+            return self._latest_id()
+
+    def _latest_id(self):
+        return self._history[-1].id if self._history else f"{self.epoch}-0"
+
+    def _since(self, last_event_id):
+        epoch, _, seq = last_event_id.partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        events = [event for event in self._history if self._seq(event) > seq]
+        # Anything between the client's id and our oldest retained event is lost
+        oldest = self._seq(self._history[0]) if self._history else seq + 1
+        if seq + 1 < oldest:
+            return None
+        return events
+
+    @staticmethod
+    def _seq(event):
+        return int(event.id.rpartition('-')[2])
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self.published,
+                'history': len(self._history),
+            }
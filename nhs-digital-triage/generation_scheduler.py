@@ -0,0 +1,246 @@
+"""
+generation_scheduler.py - Admission control for AI generations
+
+Caps how many /api/generate calls run against the model host at once and
+queues the rest in a bounded priority queue.  Tickets can be waited on from
+a WSGI thread (``wait``) or an event loop (``on_grant`` callbacks), so the
+sync and async streaming paths share one scheduler per process.
+
+Ordering: emergencies always go first.  Routine triage and chat share one
+aged ordering - each lane below triage is treated as if it had arrived
+``aging_seconds`` later - so chat yields to triage but never starves.
+Emergencies may also overfill the queue, but only by
+``max_emergency_overflow`` tickets: the lane is chosen from what the patient
+enters, so it cannot be allowed to bypass the bound altogether.
+"""
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+
+# Scheduling lanes, most urgent first
+PRIORITY_EMERGENCY = 0
+PRIORITY_TRIAGE = 1
+PRIORITY_CHAT = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_EMERGENCY: 'emergency',
+    PRIORITY_TRIAGE: 'triage',
+    PRIORITY_CHAT: 'chat',
+}
+
+
+class GenerationQueueFull(Exception):
+    """Raised when the generation queue cannot accept another request."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Generation queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class GenerationTicket:
+    """A single queued or running generation."""
+
+    WAITING, RUNNING, DONE = 'waiting', 'running', 'done'
+
+    def __init__(self, ticket_id, kind, priority=PRIORITY_CHAT, aging_seconds=30.0):
+        self.id = ticket_id
+        self.kind = kind
+        self.priority = priority
+        self.state = self.WAITING
+        self.enqueued_at = time.monotonic()
+        # Emergencies strictly first; other lanes compete on arrival time plus a per-lane handicap
+        if priority == PRIORITY_EMERGENCY:
+            self.sort_key = (0, self.enqueued_at, ticket_id)
+        else:
+            self.sort_key = (1, self.enqueued_at + (priority - PRIORITY_TRIAGE) * aging_seconds, ticket_id)
+        self.granted_at = None
+        self._granted = threading.Event()
+        self._callbacks = []
+        self.scheduler = None
+
+    def __lt__(self, other):
+        return self.sort_key < other.sort_key
+
+    @property
+    def granted(self):
+        return self._granted.is_set()
+
+    @property
+    def position(self):
+        """1-based place in the queue, or 0 once the generation may run."""
+        return self.scheduler.position(self) if self.scheduler else 0
+
+    def wait(self, timeout=None):
+        """Block until granted; returns ``False`` on timeout."""
+        return self._granted.wait(timeout)
+
+    def on_grant(self, callback):
+        """Call ``callback()`` once granted (immediately if already granted)."""
+        with self.scheduler._lock:
+            if not self.granted:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def _grant(self):
+        self.state = self.RUNNING
+        self.granted_at = time.monotonic()
+        self._granted.set()
+        callbacks, self._callbacks = self._callbacks, []
+        return callbacks
+
+    @property
+    def waited(self):
+        end = self.granted_at if self.granted_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+
+class GenerationScheduler:
+    """Bounded concurrency plus a bounded priority queue in front of Ollama."""
+
+    def __init__(self, max_in_flight=2, max_queue=20, default_retry_after=10, history=200,
+                 aging_seconds=30.0, max_emergency_overflow=10):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.max_emergency_overflow = max(0, max_emergency_overflow)
+        self.default_retry_after = default_retry_after
+        self.aging_seconds = aging_seconds
+
+        self._lock = threading.Lock()
+        self._queue = []  # heap of GenerationTicket ordered by sort_key
+        self._in_flight = 0
+        self._ids = itertools.count(1)
+
+        self._wait_times = deque(maxlen=history)
+        self._service_times = deque(maxlen=history)
+        self.admitted = 0
+        self.rejected = 0
+        self.abandoned = 0
+        self.completed = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_in_flight=config.get('GENERATION_MAX_IN_FLIGHT', 2),
+            max_queue=config.get('GENERATION_MAX_QUEUE', 20),
+            default_retry_after=config.get('GENERATION_RETRY_AFTER', 10),
+            aging_seconds=config.get('GENERATION_AGING_SECONDS', 30),
+            max_emergency_overflow=config.get('GENERATION_MAX_EMERGENCY_OVERFLOW', 10)
+        )
+
+    # Admission
+    def has_capacity(self, priority=PRIORITY_CHAT):
+        """Cheap pre-check for endpoints that create work for a later stream."""
+        with self._lock:
+            return self._in_flight < self.max_in_flight or len(self._queue) < self._queue_limit(priority)
+
+    def submit(self, kind='chat', priority=PRIORITY_CHAT):
+        """Admit a generation, raising ``GenerationQueueFull`` if there is no room.
+
+        Emergencies may overfill the queue by up to ``max_emergency_overflow``.
+        """
+        ticket = GenerationTicket(next(self._ids), kind, priority, self.aging_seconds)
+        ticket.scheduler = self
+        callbacks = []
+        with self._lock:
+            if self._in_flight < self.max_in_flight and not self._queue:
+                self._in_flight += 1
+                callbacks = ticket._grant()
+                self._wait_times.append(0.0)
+            elif len(self._queue) < self._queue_limit(priority):
+                heapq.heappush(self._queue, ticket)
+            else:
+                self.rejected += 1
+                raise GenerationQueueFull(self._retry_after_locked())
+            self.admitted += 1
+        for callback in callbacks:
+            callback()
+        return ticket
+
+    def release(self, ticket):
+        """Finish or abandon a ticket and hand its slot to the next in line (idempotent)."""
+        callbacks = []
+        with self._lock:
+            if ticket.state == GenerationTicket.DONE:
+                return
+            if ticket.state == GenerationTicket.RUNNING:
+                self._in_flight -= 1
+                self.completed += 1
+                self._service_times.append(time.monotonic() - ticket.granted_at)
+            else:
+                try:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                except ValueError:
+                    pass
+                self.abandoned += 1
+            ticket.state = GenerationTicket.DONE
+
+            while self._queue and self._in_flight < self.max_in_flight:
+                callbacks.extend(self._grant_next_locked())
+        for callback in callbacks:
+            callback()
+
+    def _queue_limit(self, priority):
+        if priority == PRIORITY_EMERGENCY:
+            return self.max_queue + self.max_emergency_overflow
+        return self.max_queue
+
+    def _grant_next_locked(self):
+        ticket = heapq.heappop(self._queue)
+        self._in_flight += 1
+        callbacks = ticket._grant()
+        self._wait_times.append(ticket.waited)
+        return callbacks
+
+    def position(self, ticket):
+        with self._lock:
+            if ticket.state != GenerationTicket.WAITING:
+                return 0
+            return 1 + sum(1 for other in self._queue if other.sort_key < ticket.sort_key)
+
+    # Metrics
+    def load(self):
+        """Generations running plus waiting."""
+        with self._lock:
+            return self._in_flight + len(self._queue)
+
+    def _retry_after_locked(self):
+        if not self._service_times:
+            return self.default_retry_after
+        mean_service = sum(self._service_times) / len(self._service_times)
+        backlog = len(self._queue) + self._in_flight
+        return max(1, math.ceil(mean_service * backlog / self.max_in_flight))
+
+    def retry_after(self):
+        with self._lock:
+            return self._retry_after_locked()
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._wait_times)
+            oldest = max((ticket.waited for ticket in self._queue), default=0.0)
+            lanes = {name: 0 for name in PRIORITY_NAMES.values()}
+            for ticket in self._queue:
+                lanes[PRIORITY_NAMES[ticket.priority]] += 1
+            return {
+                'in_flight': self._in_flight,
+                'max_in_flight': self.max_in_flight,
+                'queue_depth': len(self._queue),
+                'queue_depth_by_lane': lanes,
+                'max_queue': self.max_queue,
+                'max_emergency_overflow': self.max_emergency_overflow,
+                'oldest_wait_seconds': round(oldest, 3),
+                'wait_seconds_avg': round(sum(waits) / len(waits), 3) if waits else 0.0,
+                'wait_seconds_p95': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+                'wait_seconds_max': round(waits[-1], 3) if waits else 0.0,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'abandoned': self.abandoned,
+                'completed': self.completed,
+                'retry_after': self._retry_after_locked(),
+            }
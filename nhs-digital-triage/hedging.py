@@ -0,0 +1,287 @@
+"""
+hedging.py - Hedged triage generations across Ollama hosts
+
+One stalled host dominates the tail of time-to-first-token.  With hedging
+on, a triage generation whose first token has not arrived after
+``HedgePolicy.delay()`` seconds - the ``percentile`` of recent first-token
+latencies, clamped to ``[min_delay, max_delay]`` - is sent again to a second
+healthy host.  Whichever attempt streams first is used and the other is
+cancelled, even while still waiting for headers; closing its connection
+makes Ollama stop generating.  A host is released only once its attempt has
+actually exited, so least-outstanding routing never undercounts it.  Hedges
+spend a budget that grows by ``max_ratio`` per eligible request (capped at
+``burst``), so a slow cluster is never doubled in load.
+
+``HedgeRace`` holds the bookkeeping for one generation and is shared by the
+sync and async paths.  The attempts themselves - ``AsyncAttempt`` and, for
+WSGI threads, ``ThreadedAttempt`` - read one raw Ollama stream on an event
+loop, where cancellation interrupts any pending read, and report
+``(attempt, kind, value)`` tuples to their driver.
+"""
+
+import threading
+import time
+from collections import deque
+
+import anyio
+import httpx
+
+# What an attempt reports
+STATUS, TEXT, END, ERROR = 'status', 'text', 'end', 'error'
+
+
+def connection_failed(kind, value):
+    """Whether an attempt failed because its host could not be reached (not merely slow)."""
+    return (kind == ERROR and isinstance(value, httpx.TransportError)
+            and not isinstance(value, httpx.TimeoutException))
+
+
+class HedgePolicy:
+    """Hedge delay from recent first-token latencies, plus the hedge budget."""
+
+    def __init__(self, percentile=95, min_delay=1.0, max_delay=15.0, default_delay=5.0,
+                 min_samples=20, window=200, max_ratio=0.1, burst=2.0):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self.burst = burst
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._budget = 1.0
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            percentile=config.get('HEDGE_PERCENTILE', 95),
+            min_delay=config.get('HEDGE_MIN_DELAY', 1.0),
+            max_delay=config.get('HEDGE_MAX_DELAY', 15.0),
+            default_delay=config.get('HEDGE_DEFAULT_DELAY', 5.0),
+            min_samples=config.get('HEDGE_MIN_SAMPLES', 20),
+            max_ratio=config.get('HEDGE_MAX_RATIO', 0.1)
+        )
+
+    def observe(self, first_token_seconds):
+        if first_token_seconds is not None:
+            with self._lock:
+                self._latencies.append(first_token_seconds)
+
+    def delay(self):
+        """Seconds to wait for a first token before hedging."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.default_delay
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+        return min(self.max_delay, max(self.min_delay, latencies[index]))
+
+    def request(self):
+        """Count an eligible generation; each one earns ``max_ratio`` of a hedge."""
+        with self._lock:
+            self.requests += 1
+            self._budget = min(self.burst, self._budget + self.max_ratio)
+
+    def try_hedge(self):
+        with self._lock:
+            if self._budget < 1.0:
+                self.budget_denied += 1
+                return False
+            self._budget -= 1.0
+            self.hedges += 1
+            return True
+
+    def record_win(self, hedge_won):
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+
+    def stats(self):
+        delay = self.delay()
+        with self._lock:
+            return {
+                'delay_seconds': round(delay, 3),
+                'latency_samples': len(self._latencies),
+                'requests': self.requests,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'budget_denied': self.budget_denied,
+                'hedge_rate': round(self.hedges / self.requests, 4) if self.requests else 0.0,
+                'hedge_win_rate': round(self.hedge_wins / self.hedges, 4) if self.hedges else 0.0,
+            }
+
+
+class HedgeRace:
+    """One generation raced across hosts.
+
+    ``launch(host)`` must start an attempt on ``host`` and return it.  The
+    driver calls ``start()``, then feeds every reported tuple to ``report``
+    until ``settled``, calling ``on_timeout()`` whenever ``timeout()``
+    elapses with nothing reported.  Afterwards ``winner`` (with
+    ``first_text``) or ``failure`` is set; ``close()`` must always follow.
+    """
+
+    def __init__(self, pool, policy, launch, session_id=None):
+        self.pool = pool
+        self.policy = policy
+        self.launch = launch
+        self.session_id = session_id
+
+        self.attempts = []
+        self.hedge_at = None
+        self.winner = None
+        self.first_text = None
+        self.failure = None  # (kind, value) of the last attempt to fail
+        self.settled = False
+
+    def start(self):
+        """Launch the first attempt; ``False`` if there is no host at all."""
+        self.policy.request()
+        host = self.pool.acquire(self.session_id)
+        if host is None:
+            return False
+        self.hedge_at = time.monotonic() + self.policy.delay()
+        self._launch(host)
+        return True
+
+    def _launch(self, host):
+        attempt = self.launch(host)
+        attempt.host = host
+        attempt.finished = False
+        self.attempts.append(attempt)
+
+    def timeout(self):
+        """Seconds until the hedge is due, or ``None`` once it no longer can be."""
+        if self.hedge_at is None:
+            return None
+        return max(0.0, self.hedge_at - time.monotonic())
+
+    def on_timeout(self):
+        """The first token is late: hedge to another healthy host if the budget allows."""
+        self.hedge_at = None
+        host = self.pool.acquire(exclude=[attempt.host for attempt in self.attempts], healthy_only=True)
+        if host is None:
+            return
+        if not self.policy.try_hedge():
+            self.pool.release(host)
+            return
+        self._launch(host)
+
+    def report(self, attempt, kind, value):
+        if attempt.finished or self.settled:
+            return
+        if kind == TEXT:
+            self.winner, self.first_text, self.settled = attempt, value, True
+            self.policy.record_win(attempt is not self.attempts[0])
+            for other in self.attempts:
+                if other is not attempt:
+                    self._finish(other)
+            return
+        if kind == STATUS and value == 200:
+            return
+
+        down = connection_failed(kind, value)
+        self._finish(attempt, f'AI connection error: {value}' if down else None)
+        self.failure = (kind, value)
+        if any(not other.finished for other in self.attempts):
+            return
+        if down:
+            # Nothing else is running: retry on a host this generation has not tried
+            host = self.pool.acquire(self.session_id, exclude=[other.host for other in self.attempts],
+                                     healthy_only=True)
+            if host is not None:
+                self._launch(host)
+                return
+        self.settled = True
+
+    def _finish(self, attempt, down_error=None):
+        if not attempt.finished:
+            attempt.finished = True
+            attempt.cancel()
+            # The host stays counted as busy until the attempt has really stopped using it
+            attempt.when_exited(lambda: self.pool.release(attempt.host, down_error))
+
+    def close(self, down_error=None):
+        """Cancel whatever is still running and return every host."""
+        for attempt in self.attempts:
+            self._finish(attempt, down_error if attempt is self.winner else None)
+
+
+class AsyncAttempt:
+    """Read one streaming POST; run ``run()`` as a task and report through ``send``."""
+
+    def __init__(self, client, url, payload, send, scope=None):
+        self.client = client
+        self.url = url
+        self.payload = payload
+        self.send = send
+        self.scope = scope if scope is not None else anyio.CancelScope()
+        self._exit_lock = threading.Lock()
+        self._exited = False
+        self._on_exit = []
+
+    async def run(self):
+        try:
+            with self.scope:
+                try:
+                    async with self.client.stream('POST', self.url, json=self.payload) as resp:
+                        await self.send((self, STATUS, resp.status_code))
+                        if resp.status_code != 200:
+                            return
+                        async for text in resp.aiter_text():
+                            await self.send((self, TEXT, text))
+                    await self.send((self, END, None))
+                except Exception as e:
+                    await self.send((self, ERROR, e))
+        finally:
+            with self._exit_lock:
+                self._exited = True
+                callbacks, self._on_exit = self._on_exit, []
+            for callback in callbacks:
+                callback()
+
+    def when_exited(self, callback):
+        """Call ``callback()`` once ``run`` has returned (immediately if it has)."""
+        with self._exit_lock:
+            if not self._exited:
+                self._on_exit.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        self.scope.cancel()
+
+
+class ThreadedAttempt(AsyncAttempt):
+    """``AsyncAttempt`` driven from a WSGI thread, reporting to ``outbox.put``.
+
+    It runs on ``portal``'s event loop: a blocking ``httpx.Client`` read on a
+    host that never sends headers could not be interrupted.
+    """
+
+    def __init__(self, portal, client, url, payload, outbox):
+        # Cancel scopes can only be created on the loop they will run on
+        super().__init__(client, url, payload, self._put, portal.call(anyio.CancelScope))
+        self.portal = portal
+        self.outbox = outbox
+
+    async def _put(self, item):
+        self.outbox.put(item)
+
+    def start(self):
+        self.portal.start_task_soon(self.run)
+        return self
+
+    def cancel(self):
+        # CancelScope is not thread-safe; cancel it on the loop that runs the attempt
+        try:
+            self.portal.call(self.scope.cancel)
+        except RuntimeError:
+            pass  # the portal has stopped, taking the attempt with it
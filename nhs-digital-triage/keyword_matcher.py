@@ -0,0 +1,59 @@
+"""
+keyword_matcher.py - Precompiled red-flag phrase matching
+
+Compiles a keyword list once into a single case-insensitive alternation
+regex so the input text is scanned in one pass, however many phrases there
+are.  Phrases match on word boundaries (so "unconscious" does not fire on
+"subconscious") and tolerate plurals and irregular whitespace between words.
+"""
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+KeywordMatch = namedtuple('KeywordMatch', ['keyword', 'start', 'end'])
+
+
+class KeywordMatcher:
+    """Find occurrences of a fixed set of phrases in free text."""
+
+    def __init__(self, keywords):
+        # Longest first so overlapping phrases resolve to the most specific one
+        self.keywords = tuple(sorted({k.strip().lower() for k in keywords if k and k.strip()},
+                                     key=lambda k: (-len(k), k)))
+        if self.keywords:
+            alternatives = '|'.join(f'({self._phrase_pattern(k)})' for k in self.keywords)
+            self._pattern = re.compile(rf'\b(?:{alternatives})(?:e?s)?\b', re.IGNORECASE)
+        else:
+            self._pattern = None
+
+    @staticmethod
+    def _phrase_pattern(keyword):
+        return r'\s+'.join(re.escape(word) for word in keyword.split())
+
+    def finditer(self, text):
+        """Yield a ``KeywordMatch`` for every phrase found, left to right."""
+        if not self._pattern or not text:
+            return
+        for match in self._pattern.finditer(text):
+            yield KeywordMatch(self.keywords[match.lastindex - 1], match.start(), match.end())
+
+    def find_all(self, text):
+        return list(self.finditer(text))
+
+    def search(self, text):
+        """Return the first ``KeywordMatch`` in ``text`` or ``None``."""
+        return next(self.finditer(text), None)
+
+    def __contains__(self, text):
+        return self.search(text) is not None
+
+
+@lru_cache(maxsize=8)
+def _compiled(keywords):
+    return KeywordMatcher(keywords)
+
+
+def get_matcher(keywords):
+    """Return the shared matcher for ``keywords``, compiling it on first use."""
+    return _compiled(tuple(keywords))
@@ -0,0 +1,133 @@
+"""
+log_writer.py - Write-behind batching for audit log rows
+
+Request handlers hand rows to ``BatchLogWriter.log`` and return straight
+away; a background thread bulk-inserts them every ``flush_interval`` seconds
+or as soon as ``batch_size`` rows are waiting.  The queue is bounded: when it
+is full, routine rows are shed at once and important ones (warnings and
+errors) wait at most ``block_timeout`` for room before being dropped, so a
+stalled database can never hold up a patient request for long.
+"""
+
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BatchLogWriter:
+    """Bounded queue of rows drained in batches by ``write_batch(rows)``."""
+
+    def __init__(self, write_batch, max_queue=10000, batch_size=200, flush_interval=2.0,
+                 block_timeout=0.05, synchronous=False):
+        self.write_batch = write_batch
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        # Synchronous writers flush on every call (tests, one-off scripts)
+        self.synchronous = synchronous
+
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._write_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.shed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def log(self, row, important=False):
+        """Queue ``row`` for writing; returns ``False`` if it had to be discarded."""
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            if not important:
+                self._count('shed')
+                return False
+            try:
+                self._queue.put(row, timeout=self.block_timeout)
+            except queue.Full:
+                self._count('dropped')
+                logger.warning("System log queue full, dropped: %.200s", row.get('message'))
+                return False
+        self._count('queued')
+
+        if self.synchronous:
+            self.flush()
+        elif self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+        return True
+
+    def flush(self):
+        """Write everything queued so far; returns the number of rows written."""
+        written = 0
+        with self._write_lock:
+            while True:
+                batch = []
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    return written
+                try:
+                    self.write_batch(batch)
+                except Exception as e:
+                    self._count('failed', len(batch))
+                    logger.error(f"Failed to write {len(batch)} system log rows: {e}")
+                    continue
+                written += len(batch)
+                with self._stats_lock:
+                    self.written += len(batch)
+                    self.batches += 1
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def start(self):
+        """Start the background writer (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='system-log-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the writer and flush whatever is still queued."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"System log writer crashed: {e}")
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue': self._queue.maxsize,
+                'queued': self.queued,
+                'written': self.written,
+                'batches': self.batches,
+                'shed': self.shed,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'running': bool(self._thread and self._thread.is_alive()),
+            }
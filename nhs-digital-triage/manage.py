@@ -1,13 +1,15 @@
 import os
 import sys
+import time
 import click
+from contextlib import nullcontext
 from datetime import datetime, timezone, timedelta
 import json
 
 # Add the current directory to the path to import our app
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import create_app, db
+from app import create_app, db, migrate_database
 from app import Patient, ChatMessage, TriageAssessment, SystemLog
 
 @click.group()
@@ -23,7 +25,17 @@ def init_db(env):
     with app.app_context():
         click.echo('Creating database tables...')
         db.create_all()
-        click.echo('✅ Database initialized successfully!')
+    migrate_database(app)
+    click.echo('✅ Database initialized successfully!')
+
+@cli.command()
+@click.option('--env', default='development', help='Environment to use')
+def migrate(env):
+    """Add new indexes and switch SQLite to its configured journal mode."""
+    app = create_app(env)
+    click.echo('Migrating database...')
+    migrate_database(app)
+    click.echo('✅ Database migrated successfully!')
 
 @cli.command()
 @click.option('--env', default='development', help='Environment to use')
@@ -36,7 +48,8 @@ def reset_db(env):
         db.drop_all()
         click.echo('Creating new tables...')
         db.create_all()
-        click.echo('✅ Database reset successfully!')
+    migrate_database(app)
+    click.echo('✅ Database reset successfully!')
 
 @cli.command()
 @click.option('--env', default='development', help='Environment to use')
@@ -134,110 +147,163 @@ def create_sample_data(env):
 
 @cli.command()
 @click.option('--env', default='development', help='Environment to use')
-@click.option('--days', default=30, help='Days of data to retain')
+@click.option('--days', type=int,
+              help='Days of data to retain (default: CHAT_DATA_RETENTION_DAYS / PATIENT_DATA_RETENTION_DAYS)')
 def cleanup_data(env, days):
     """Clean up old data."""
+    from app import purge_expired_data
+    
     app = create_app(env)
     with app.app_context():
-        cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
-        
-        # Clean up old chat messages
-        old_messages = ChatMessage.query.filter(ChatMessage.created_at < cutoff_date)
-        message_count = old_messages.count()
-        old_messages.delete()
-        
-        # Clean up old system logs
-        old_logs = SystemLog.query.filter(SystemLog.created_at < cutoff_date)
-        log_count = old_logs.count()
-        old_logs.delete()
-        
-        db.session.commit()
+        # Same batched purge as the background job, plus the audit log
+        purged, _ = purge_expired_data(days=days, system_logs=True)
         
-        click.echo(f'✅ Cleaned up {message_count} old chat messages')
-        click.echo(f'✅ Cleaned up {log_count} old system logs')
+        click.echo(f"✅ Cleaned up {purged.get('chat_messages', 0)} old chat messages")
+        click.echo(f"✅ Cleaned up {purged.get('patients', 0)} old patients "
+                   f"with {purged.get('triage_assessments', 0)} assessments")
+        click.echo(f"✅ Cleaned up {purged.get('system_logs', 0)} old system logs")
 
 @cli.command()
 @click.option('--env', default='development', help='Environment to use')
-def show_stats(env):
+@click.option('--json', 'as_json', is_flag=True, help='Print the statistics as JSON')
+@click.option('--watch', type=float, metavar='SECONDS', help='Refresh every SECONDS until interrupted')
+def show_stats(env, as_json, watch):
     """Show system statistics."""
+    from app import collect_triage_stats
+    
     app = create_app(env)
     with app.app_context():
-        total_patients = Patient.query.count()
-        total_assessments = TriageAssessment.query.count()
-        total_messages = ChatMessage.query.count()
-        
-        # Urgency breakdown
-        emergency = TriageAssessment.query.filter_by(urgency_level='Emergency').count()
-        urgent = TriageAssessment.query.filter_by(urgency_level='Urgent').count()
-        standard = TriageAssessment.query.filter_by(urgency_level='Standard').count()
-        selfcare = TriageAssessment.query.filter_by(urgency_level='Self-care').count()
-        
-        # Recent activity (last 24 hours)
-        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
-        recent_assessments = TriageAssessment.query.filter(
-            TriageAssessment.created_at > yesterday
-        ).count()
-        
-        click.echo('\n📊 NHS Digital Triage System Statistics')
-        click.echo('=' * 50)
-        click.echo(f'Total Patients: {total_patients}')
-        click.echo(f'Total Assessments: {total_assessments}')
-        click.echo(f'Total Chat Messages: {total_messages}')
-        click.echo(f'Recent Assessments (24h): {recent_assessments}')
-        click.echo('\n🚨 Urgency Level Breakdown:')
-        click.echo(f'  Emergency: {emergency}')
-        click.echo(f'  Urgent: {urgent}')
-        click.echo(f'  Standard: {standard}')
-        click.echo(f'  Self-care: {selfcare}')
+        while True:
+            stats = collect_triage_stats()
+            # End the read transaction so the next refresh sees new rows
+            db.session.remove()
+            
+            if watch and not as_json:
+                click.clear()
+            if as_json:
+                click.echo(json.dumps(stats, indent=None if watch else 2))
+            else:
+                _print_stats(stats)
+            
+            if not watch:
+                return
+            try:
+                time.sleep(watch)
+            except KeyboardInterrupt:
+                return
+
+def _print_stats(stats):
+    click.echo('\n📊 NHS Digital Triage System Statistics')
+    click.echo('=' * 50)
+    click.echo(f'Total Patients: {stats["total_patients"]}')
+    click.echo(f'Total Assessments: {stats["total_assessments"]}')
+    click.echo(f'Total Chat Messages: {stats["total_chat_messages"]}')
+    click.echo(f'Recent Assessments (24h): {stats["recent_assessments_24h"]}')
+    click.echo(f'Recent Assessments (7d): {stats["recent_assessments_7d"]}')
+    click.echo('\n🚨 Urgency Level Breakdown:')
+    for level, count in stats['urgency_levels'].items():
+        click.echo(f'  {level}: {count}')
+    if stats['unassessed_assessments']:
+        click.echo(f'  (not included: {stats["unassessed_assessments"]} answered by the fallback message)')
+    click.echo('\n🩺 Symptom Categories:')
+    for category, count in stats['symptom_categories'].items():
+        click.echo(f'  {category}: {count}')
+    click.echo(f'\nGenerated at {stats["generated_at"]}')
+
+def _update_per_batch(rows, bar, batch_size):
+    """Pass ``rows`` through, advancing ``bar`` once per batch rather than once per row."""
+    pending = 0
+    for row in rows:
+        yield row
+        pending += 1
+        if pending == batch_size:
+            bar.update(pending)
+            pending = 0
+    bar.update(pending)
 
 @cli.command()
 @click.option('--env', default='development', help='Environment to use')
-@click.option('--format', 'output_format', default='json', type=click.Choice(['json', 'csv']))
-@click.option('--output', help='Output file path')
-def export_data(env, output_format, output):
+@click.option('--format', 'output_format', default='json',
+              type=click.Choice(['json', 'jsonl', 'csv', 'parquet', 'arrow']))
+@click.option('--output', help='Output file path (a directory for parquet/arrow)')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip-compress the output')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows fetched from the database per batch')
+@click.option('--progress/--no-progress', default=None, help='Show a progress bar (default: when writing to a file)')
+@click.option('--since', type=click.DateTime(['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f']),
+              help='Only export rows created or updated after this UTC time')
+@click.option('--table', 'tables', multiple=True,
+              type=click.Choice(['patients', 'triage_assessments', 'chat_messages']),
+              help='Table to export with parquet/arrow (repeatable, default: all)')
+def export_data(env, output_format, output, compress, batch_size, progress, since, tables):
     """Export system data."""
+    from data_export import (COLUMNAR_FORMATS, count_rows, iter_patients, iter_assessments,
+                             open_export, write_csv, write_json, write_jsonl)
+    
+    if output_format in COLUMNAR_FORMATS:
+        if compress:
+            raise click.UsageError('--gzip applies to json, jsonl and csv; parquet and arrow are compressed already')
+        export_columnar(env, output_format, output, batch_size, since, tables)
+        return
+    if tables:
+        raise click.UsageError('--table is only used with --format parquet or arrow')
+    
     app = create_app(env)
     with app.app_context():
-        if output_format == 'json':
-            data = {
-                'patients': [p.to_dict() for p in Patient.query.all()],
-                'assessments': [a.to_dict() for a in TriageAssessment.query.all()],
-                'export_timestamp': datetime.now(timezone.utc).isoformat()
-            }
+        if output_format == 'csv' and not output:
+            output = f'nhs_triage_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        if output and compress and not output.endswith('.gz'):
+            output += '.gz'
+        if progress is None:
+            progress = bool(output)
+        
+        progress_bar = nullcontext()
+        if progress:
+            total = count_rows(TriageAssessment, since) + (count_rows(Patient, since) if output_format != 'csv' else 0)
+            progress_bar = click.progressbar(length=total, label='Exporting', file=sys.stderr)
+        
+        with open_export(output, compress) as stream, progress_bar as bar:
+            def tracked(rows):
+                return rows if bar is None else _update_per_batch(rows, bar, batch_size)
             
-            if output:
-                with open(output, 'w') as f:
-                    json.dump(data, f, indent=2)
-                click.echo(f'✅ Data exported to {output}')
+            assessments = tracked(iter_assessments(batch_size, since))
+            if output_format == 'json':
+                write_json(stream, tracked(iter_patients(batch_size, since)), assessments,
+                           datetime.now(timezone.utc).isoformat())
+            elif output_format == 'jsonl':
+                write_jsonl(stream, tracked(iter_patients(batch_size, since)), assessments)
             else:
-                click.echo(json.dumps(data, indent=2))
+                write_csv(stream, assessments)
         
-        elif output_format == 'csv':
-            import csv
-            
-            if not output:
-                output = f'nhs_triage_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-            
-            with open(output, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow([
-                    'Patient Name', 'Age', 'Gender', 'Primary Symptom', 
-                    'Severity', 'Urgency Level', 'Assessment Date'
-                ])
-                
-                for assessment in TriageAssessment.query.all():
-                    writer.writerow([
-                        f"{assessment.patient.first_name} {assessment.patient.last_name}",
-                        assessment.patient.age,
-                        assessment.patient.gender,
-                        assessment.primary_symptom,
-                        assessment.severity,
-                        assessment.urgency_level,
-                        assessment.created_at.strftime('%Y-%m-%d %H:%M:%S')
-                    ])
-            
+        if output:
             click.echo(f'✅ Data exported to {output}')
 
+def export_columnar(env, output_format, output, batch_size, since, tables):
+    """Write one Parquet/Arrow file per table into the ``output`` directory."""
+    from data_export import COLUMNAR_FORMATS, EXPORT_TABLES, require_pyarrow, write_columnar
+    
+    try:
+        require_pyarrow()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    output = output or f'nhs_triage_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+    os.makedirs(output, exist_ok=True)
+    
+    app = create_app(env)
+    with app.app_context():
+        watermarks = {}
+        for table in tables or EXPORT_TABLES:
+            path = os.path.join(output, table + COLUMNAR_FORMATS[output_format])
+            rows, latest = write_columnar(EXPORT_TABLES[table], path, output_format,
+                                          since=since, batch_size=batch_size)
+            click.echo(f'✅ {rows} rows from {table} exported to {path}')
+            if latest:
+                watermarks[table] = latest
+        
+        # One watermark per table: a shared maximum would skip a slower table's rows
+        for table, latest in watermarks.items():
+            click.echo(f'Next incremental export of {table}: '
+                       f'--table {table} --since {latest.strftime("%Y-%m-%dT%H:%M:%S.%f")}')
+
 @cli.command()
 @click.option('--env', default='development', help='Environment to use')
 def check_health(env):
@@ -256,7 +322,7 @@ def check_health(env):
         
         # Ollama connectivity
         from app import check_ollama
-        if check_ollama():
+        if check_ollama(force=True):
             click.echo('✅ Ollama AI: Available')
         else:
             click.echo('❌ Ollama AI: Unavailable')
@@ -0,0 +1,136 @@
+"""
+model_router.py - Load-adaptive choice between PRIMARY_MODEL and BACKUP_MODEL
+
+On a CPU-only host every extra concurrent generation slows all the others,
+so under load the larger model's answers arrive far too late.
+``LoadAdaptiveRouter`` picks a model per request once it holds a generation
+slot: triage and emergencies always get the primary model, while chat turns
+move to the smaller backup model when
+
+* the generation load (running plus queued, including this request) reaches
+  ``downgrade_load``, or
+* the primary model's recent throughput predicts a response slower than
+  ``latency_slo`` seconds (recent mean response length / recent tokens/sec).
+
+Throughput comes from the generations themselves (``observe``); every
+decision is counted by lane, model and reason for /api/metrics.
+"""
+
+import logging
+import threading
+from collections import deque, namedtuple
+
+from generation_scheduler import PRIORITY_CHAT, PRIORITY_NAMES
+
+logger = logging.getLogger(__name__)
+
+RoutingDecision = namedtuple('RoutingDecision', ['model', 'reason'])
+
+# Decision reasons
+PRIORITY, DISABLED, NORMAL, LOAD, SLO = 'priority', 'disabled', 'normal', 'load', 'slo'
+
+
+class LoadAdaptiveRouter:
+    """Route chat to the backup model while the primary cannot meet the SLO."""
+
+    def __init__(self, primary, backup=None, latency_slo=30.0, downgrade_load=3, window=20, enabled=True):
+        self.primary = primary
+        self.backup = backup if backup != primary else None
+        self.latency_slo = latency_slo
+        self.downgrade_load = downgrade_load
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._samples = {}  # model -> deque of (tokens, seconds)
+        self._window = window
+        self._decisions = {}  # (lane, model, reason) -> count
+        self.downgrading = False
+        self.last_prediction = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config.get('PRIMARY_MODEL'),
+            config.get('BACKUP_MODEL'),
+            latency_slo=config.get('MODEL_LATENCY_SLO_SECONDS', 30.0),
+            downgrade_load=config.get('MODEL_DOWNGRADE_LOAD', 3),
+            window=config.get('MODEL_RATE_WINDOW', 20),
+            enabled=config.get('MODEL_ROUTING_ENABLED', True)
+        )
+
+    def observe(self, model, tokens, seconds):
+        """Record a finished generation of ``tokens`` tokens in ``seconds``."""
+        if not tokens or not seconds or seconds <= 0:
+            return
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self._window)).append((tokens, seconds))
+
+    def _rate_locked(self, model):
+        samples = self._samples.get(model)
+        if not samples:
+            return None, None
+        tokens = sum(sample[0] for sample in samples)
+        seconds = sum(sample[1] for sample in samples)
+        return tokens / seconds, tokens / len(samples)
+
+    def predicted_seconds(self, model=None):
+        """Expected generation time of a typical answer on ``model`` at its recent rate."""
+        with self._lock:
+            return self._predicted_locked(model or self.primary)
+
+    def _predicted_locked(self, model):
+        rate, mean_tokens = self._rate_locked(model)
+        return mean_tokens / rate if rate else None
+
+    def choose(self, priority, load):
+        """Pick the model for a request in ``priority``'s lane.
+
+        ``load`` is the number of generations running or queued, this one included.
+        """
+        with self._lock:
+            if priority != PRIORITY_CHAT:
+                decision = RoutingDecision(self.primary, PRIORITY)
+            elif not self.enabled or not self.backup:
+                decision = RoutingDecision(self.primary, DISABLED)
+            else:
+                self.last_prediction = self._predicted_locked(self.primary)
+                if load >= self.downgrade_load:
+                    decision = RoutingDecision(self.backup, LOAD)
+                elif self.last_prediction is not None and self.last_prediction > self.latency_slo:
+                    decision = RoutingDecision(self.backup, SLO)
+                else:
+                    decision = RoutingDecision(self.primary, NORMAL)
+                self._note_transition_locked(decision, load)
+            key = (PRIORITY_NAMES.get(priority, str(priority)), decision.model, decision.reason)
+            self._decisions[key] = self._decisions.get(key, 0) + 1
+        return decision
+
+    def _note_transition_locked(self, decision, load):
+        downgrading = decision.model == self.backup
+        if downgrading != self.downgrading:
+            self.downgrading = downgrading
+            if downgrading:
+                logger.warning(f"Routing chat to {self.backup} ({decision.reason}, load {load}, "
+                               f"predicted {self.last_prediction or 0:.1f}s)")
+            else:
+                logger.info(f"Routing chat back to {self.primary}")
+
+    def stats(self):
+        with self._lock:
+            decisions = {}
+            for (lane, model, reason), count in self._decisions.items():
+                decisions.setdefault(lane, {}).setdefault(model, {})[reason] = count
+            rates = {}
+            for model in self._samples:
+                rate, mean_tokens = self._rate_locked(model)
+                rates[model] = {'tokens_per_second': round(rate, 2), 'mean_tokens': round(mean_tokens, 1)}
+            prediction = self._predicted_locked(self.primary)
+            return {
+                'enabled': self.enabled and bool(self.backup),
+                'downgrading_chat': self.downgrading,
+                'latency_slo_seconds': self.latency_slo,
+                'downgrade_load': self.downgrade_load,
+                'predicted_primary_seconds': round(prediction, 2) if prediction is not None else None,
+                'models': rates,
+                'decisions': decisions,
+            }
@@ -0,0 +1,246 @@
+"""
+model_warmup.py - Model warm-up at startup and keep-warm pings
+
+Loading a model into Ollama takes seconds on a CPU host, and whoever sends
+the next generation pays for it: the first patient after a deploy, or after
+Ollama evicted an idle model.  ``ModelWarmer`` pays it instead.  At startup
+it polls each host's ``/api/tags``, backing off exponentially, until the
+host answers and lists the primary model, then sends one empty-prompt
+generation per model - Ollama loads the model and returns without
+generating.  Only the primary model gates readiness: a backup model that is
+not pulled (or fails to load) is reported under ``missing`` and retried by
+the keep-warm pings.  Until a host is warm the pool only uses it when no
+warm host is left, and until any host is warm /api/ready reports
+``warming``.
+
+Afterwards, every ``interval`` seconds while there has been patient traffic
+within ``idle_after`` seconds, it checks ``/api/ps`` on each warm host,
+reloads any model that is no longer resident and refreshes ``keep_alive``
+on the rest.
+"""
+
+import logging
+import threading
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Overall readiness
+WARMING, READY, DISABLED = 'warming', 'ready', 'disabled'
+
+# Per-host progress
+WAITING, MISSING, LOADING, WARM = 'waiting_for_host', 'missing_models', 'loading', 'warm'
+
+
+def model_key(name):
+    """Ollama lists an untagged model as ``name:latest``."""
+    return name if ':' in name else f'{name}:latest'
+
+
+class ModelWarmer:
+    """Warm every configured model on every pooled host, then keep it resident.
+
+    The first of ``models`` is required; the rest are warmed best-effort.
+    """
+
+    def __init__(self, pool, models, keep_alive='30m', interval=240.0, idle_after=3600.0,
+                 initial_backoff=1.0, max_backoff=30.0, probe_timeout=3.0, load_timeout=120.0,
+                 activity=None):
+        self.pool = pool
+        self.models = [model for model in dict.fromkeys(models) if model]
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.idle_after = idle_after
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.probe_timeout = probe_timeout
+        self.load_timeout = load_timeout
+        self.activity = activity  # callable returning a counter that moves with patient traffic
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._hosts = {host.base_url: {'state': WAITING, 'missing': [], 'last_error': None}
+                       for host in pool.hosts}
+        self._started = False
+        self._ready = False
+        self._last_activity = None
+        self._active_at = time.monotonic()
+
+        self.loads = 0
+        self.reloads = 0
+        self.pings = 0
+        self.warm_seconds = None
+
+    @classmethod
+    def from_config(cls, config, pool, **kwargs):
+        return cls(
+            pool,
+            [config.get('PRIMARY_MODEL'), config.get('BACKUP_MODEL')],
+            keep_alive=config.get('OLLAMA_KEEP_ALIVE', '30m'),
+            interval=config.get('KEEP_WARM_INTERVAL', 240.0),
+            idle_after=config.get('KEEP_WARM_IDLE', 3600.0),
+            max_backoff=config.get('WARMUP_MAX_BACKOFF', 30.0),
+            probe_timeout=config.get('OLLAMA_HEALTH_TIMEOUT', 3.0),
+            load_timeout=config.get('WARMUP_LOAD_TIMEOUT', 120.0),
+            **kwargs
+        )
+
+    @property
+    def state(self):
+        if not self._started:
+            return DISABLED
+        return READY if self._ready else WARMING
+
+    def _set(self, host, state, missing=(), error=None):
+        with self._lock:
+            self._hosts[host.base_url] = {'state': state, 'missing': list(missing), 'last_error': error}
+
+    def _model_names(self, host, path):
+        response = self.pool.client.get(host.url(path), timeout=self.probe_timeout)
+        response.raise_for_status()
+        return {model_key(model.get('name') or model.get('model', ''))
+                for model in response.json().get('models', [])}
+
+    def load(self, host, model):
+        """Load ``model`` on ``host`` (instant if already resident) and reset its keep-alive."""
+        response = self.pool.client.post(host.url('/api/generate'), json={
+            'model': model,
+            'prompt': '',
+            'keep_alive': self.keep_alive,
+            'stream': False,
+        }, timeout=self.load_timeout)
+        response.raise_for_status()
+
+    def warm_host(self, host):
+        """One warm-up attempt on ``host``; ``True`` once the primary model is loaded."""
+        try:
+            present = self._model_names(host, '/api/tags')
+        except (httpx.HTTPError, ValueError) as e:
+            self._set(host, WAITING, error=str(e) or e.__class__.__name__)
+            return False
+        missing = [model for model in self.models if model_key(model) not in present]
+        if self.models[:1] and self.models[0] in missing:
+            self._set(host, MISSING, missing=missing)
+            return False
+
+        self._set(host, LOADING, missing=missing)
+        started = time.monotonic()
+        try:
+            missing = self._load_all(host, missing)
+            self.loads += len(self.models) - len(missing)
+        except httpx.HTTPError as e:
+            self._set(host, WAITING, error=str(e) or e.__class__.__name__)
+            return False
+        self._set(host, WARM, missing=missing)
+        host.warming = False
+        if missing:
+            logger.warning(f"Backup models not available on {host.base_url}: {', '.join(missing)}")
+        if not self._ready:
+            self._ready = True
+            self.warm_seconds = round(time.monotonic() - started, 3)
+            logger.info(f"Models warm on {host.base_url} in {self.warm_seconds}s: {', '.join(self.models)}")
+        return True
+
+    def _load_all(self, host, skip=()):
+        """Load every model not in ``skip``; returns the backups that are unavailable.
+
+        Only a failure to load the primary model raises.
+        """
+        unavailable = []
+        for index, model in enumerate(self.models):
+            if model in skip:
+                unavailable.append(model)
+                continue
+            try:
+                self.load(host, model)
+            except httpx.HTTPError as e:
+                if index == 0:
+                    raise
+                logger.warning(f"Could not load {model} on {host.base_url}: {e}")
+                unavailable.append(model)
+        return unavailable
+
+    def traffic_expected(self):
+        """Whether patient traffic was seen within ``idle_after`` seconds (always, if 0)."""
+        if self.activity is not None:
+            count = self.activity()
+            if count != self._last_activity:
+                self._last_activity = count
+                self._active_at = time.monotonic()
+        return not self.idle_after or time.monotonic() - self._active_at < self.idle_after
+
+    def keep_warm(self):
+        """Reload evicted models on warm hosts, retry missing backups and refresh the keep-alive."""
+        if not self.traffic_expected():
+            return
+        for host in self.pool.hosts:
+            if self._hosts[host.base_url]['state'] != WARM or not host.available:
+                continue
+            missing = self._hosts[host.base_url]['missing']
+            try:
+                resident = self._model_names(host, '/api/ps')
+                cold = [model for model in self.models
+                        if model_key(model) not in resident and model not in missing]
+                if cold:
+                    # Steer traffic elsewhere while the evicted model reloads
+                    host.warming = True
+                    logger.info(f"Reloading evicted models on {host.base_url}: {', '.join(cold)}")
+                still_missing = self._load_all(host)
+                self._set(host, WARM, missing=still_missing)
+                self.reloads += len([model for model in cold if model not in still_missing])
+                self.pings += 1
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning(f"Keep-warm ping to {host.base_url} failed: {e}")
+            finally:
+                host.warming = False
+
+    def start(self):
+        """Mark every host cold and start warming in the background (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        for host in self.pool.hosts:
+            host.warming = True
+        self._started = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='model-warmup', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        backoff = self.initial_backoff
+        next_ping = time.monotonic() + self.interval
+        while not self._stop.is_set():
+            pending = [host for host in self.pool.hosts if self._hosts[host.base_url]['state'] != WARM]
+            pending = [host for host in pending if not self.warm_host(host)]
+            if time.monotonic() >= next_ping:
+                self.keep_warm()
+                next_ping = time.monotonic() + self.interval
+            if pending:
+                # Host still starting, or models still being pulled: back off
+                self._stop.wait(backoff)
+                backoff = min(self.max_backoff, backoff * 2)
+            else:
+                backoff = self.initial_backoff
+                self._stop.wait(max(0.0, next_ping - time.monotonic()))
+
+    def snapshot(self):
+        with self._lock:
+            hosts = {url: dict(state) for url, state in self._hosts.items()}
+        return {
+            'state': self.state,
+            'models': self.models,
+            'keep_alive': self.keep_alive,
+            'hosts': hosts,
+            'warm_seconds': self.warm_seconds,
+            'loads': self.loads,
+            'reloads': self.reloads,
+            'pings': self.pings,
+        }
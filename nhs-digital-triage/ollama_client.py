@@ -0,0 +1,525 @@
+"""
+ollama_client.py - Ollama connectivity helpers for NHS Digital Triage
+
+Keeps the knowledge of how we talk to the Ollama model hosts in one place so
+request handlers never have to probe the network themselves.  With several
+hosts configured, ``OllamaHostPool`` health-checks each one independently and
+hands every generation to the healthy host with the fewest outstanding
+requests, keeping a session on the host that already holds its context.
+"""
+
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import anyio
+import httpx
+from anyio.from_thread import BlockingPortal
+
+logger = logging.getLogger(__name__)
+
+
+class OllamaHTTPClients:
+    """Process-wide pooled HTTP clients for all Ollama traffic.
+
+    ``sync`` serves the WSGI request path; ``async_client`` is created lazily
+    on first use so it binds to the event loop of the ASGI server that uses it.
+    ``portal()`` adds an event loop thread of our own with an async client,
+    for WSGI requests that must be abortable before their headers arrive.
+    All share the same pool limits and split connect/read timeouts.
+    """
+
+    def __init__(self, max_connections=20, max_keepalive=10, keepalive_expiry=30.0,
+                 connect_timeout=3.0, read_timeout=60.0, pool_timeout=5.0, transport=None,
+                 async_transport=None):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=connect_timeout,
+            pool=pool_timeout
+        )
+        self.sync = httpx.Client(limits=self.limits, timeout=self.timeout, transport=transport)
+        self._async = None
+        self._async_transport = async_transport
+        self._portal = None
+        self._portal_client = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        return cls(
+            max_connections=config.get('OLLAMA_POOL_MAX_CONNECTIONS', 20),
+            max_keepalive=config.get('OLLAMA_POOL_MAX_KEEPALIVE', 10),
+            keepalive_expiry=config.get('OLLAMA_KEEPALIVE_EXPIRY', 30.0),
+            connect_timeout=config.get('OLLAMA_CONNECT_TIMEOUT', 3.0),
+            read_timeout=config.get('AI_TIMEOUT', 60),
+            pool_timeout=config.get('OLLAMA_POOL_TIMEOUT', 5.0),
+            **kwargs
+        )
+
+    @property
+    def async_client(self):
+        with self._lock:
+            if self._async is None or self._async.is_closed:
+                self._async = httpx.AsyncClient(limits=self.limits, timeout=self.timeout,
+                                                transport=self._async_transport)
+            return self._async
+
+    def portal(self):
+        """Return ``(portal, client)``: a background event loop and an async client bound to it.
+
+        A sync ``httpx`` read blocked on a host that never sends headers cannot
+        be interrupted, not even by closing its client; a task on this loop
+        can be cancelled at any point.
+        """
+        with self._lock:
+            if self._portal is None:
+                ready = queue.Queue()
+
+                async def serve():
+                    async with BlockingPortal() as portal:
+                        ready.put(portal)
+                        await portal.sleep_until_stopped()
+
+                # Daemon thread: never holds up interpreter exit
+                threading.Thread(target=anyio.run, args=(serve,), name='ollama-portal', daemon=True).start()
+                self._portal = ready.get()
+                self._portal_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout,
+                                                        transport=self._async_transport)
+            return self._portal, self._portal_client
+
+    def close(self):
+        """Close the sync pool and the portal (the async pool is closed by ``aclose``)."""
+        if not self.sync.is_closed:
+            self.sync.close()
+        with self._lock:
+            portal, client = self._portal, self._portal_client
+            self._portal = self._portal_client = None
+        if portal is not None:
+            try:
+                portal.call(client.aclose)
+                portal.call(portal.stop, True)
+            except RuntimeError:
+                pass  # the loop is already gone
+
+    async def aclose(self):
+        with self._lock:
+            client, self._async = self._async, None
+        if client is not None and not client.is_closed:
+            await client.aclose()
+
+
+class NDJSONDecoder:
+    """Incremental decoder for Ollama's newline-delimited JSON stream.
+
+    Network chunks do not line up with JSON lines, so partial lines are
+    buffered until their newline arrives.  Each character is scanned once;
+    a line longer than ``max_line_length`` is dropped (and counted) rather
+    than growing the buffer without bound.
+    """
+
+    def __init__(self, max_line_length=1024 * 1024):
+        self.max_line_length = max_line_length
+        self._pending = []
+        self._pending_length = 0
+        self._discarding = False
+
+        self.lines = 0
+        self.malformed = 0
+        self.oversized = 0
+
+    def feed(self, chunk):
+        """Yield every complete JSON object terminated inside ``chunk``."""
+        start = 0
+        while True:
+            newline = chunk.find('\n', start)
+            if newline == -1:
+                break
+            piece = chunk[start:newline]
+            start = newline + 1
+
+            if self._discarding:
+                self._discarding = False
+                continue
+            if self._pending_length + len(piece) > self.max_line_length:
+                self.oversized += 1
+                self._pending = []
+                self._pending_length = 0
+                continue
+            if self._pending:
+                self._pending.append(piece)
+                piece = ''.join(self._pending)
+                self._pending = []
+                self._pending_length = 0
+
+            obj = self._decode(piece)
+            if obj is not None:
+                yield obj
+
+        rest = chunk[start:]
+        if rest and not self._discarding:
+            if self._pending_length + len(rest) > self.max_line_length:
+                self.oversized += 1
+                self._pending = []
+                self._pending_length = 0
+                self._discarding = True
+            else:
+                self._pending.append(rest)
+                self._pending_length += len(rest)
+
+    def flush(self):
+        """Decode a trailing line that arrived without a final newline."""
+        if self._pending and not self._discarding:
+            piece = ''.join(self._pending)
+            self._pending = []
+            self._pending_length = 0
+            obj = self._decode(piece)
+            if obj is not None:
+                yield obj
+        self._discarding = False
+
+    def iter_objects(self, chunks):
+        """Decode a whole iterable of text chunks, e.g. ``resp.iter_text()``."""
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.flush()
+
+    def _decode(self, line):
+        line = line.strip()
+        if not line:
+            return None
+        self.lines += 1
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError:
+            self.malformed += 1
+            logger.debug("Skipping malformed NDJSON line: %.200s", line)
+            return None
+        if not isinstance(obj, dict):
+            self.malformed += 1
+            return None
+        return obj
+
+    def stats(self):
+        return {'lines': self.lines, 'malformed': self.malformed, 'oversized': self.oversized}
+
+
+class OllamaAvailabilityMonitor:
+    """Probe Ollama in the background and cache the last-known availability.
+
+    Requests read ``available`` in O(1); the network is only touched by the
+    background thread (or an explicit ``probe()`` call).  A cached result
+    older than ``ttl`` seconds is treated as unavailable so a dead prober
+    cannot keep reporting a stale "up".
+    """
+
+    def __init__(self, base_url, interval=15.0, ttl=45.0, timeout=3.0,
+                 client=None, on_change=None):
+        self.base_url = base_url.rstrip('/')
+        self.interval = interval
+        self.ttl = ttl
+        self.timeout = timeout
+        self.client = client
+        self.on_change = on_change
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._up = False
+        self._checked_at = None      # time.monotonic() of the last probe
+        self._changed_at = None      # time.monotonic() of the last up/down flip
+        self._last_error = None
+        self._transitions = 0
+        self._probes = 0
+        self._failures = 0
+
+    @property
+    def available(self):
+        """Last-known availability, ``False`` if never probed or expired."""
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at > self.ttl:
+            return False
+        return self._up
+
+    @property
+    def probed(self):
+        return self._checked_at is not None
+
+    @property
+    def is_stale(self):
+        checked_at = self._checked_at
+        return checked_at is None or time.monotonic() - checked_at > self.ttl
+
+    def probe(self):
+        """Hit ``/api/version`` once and record the result."""
+        http = self.client or httpx
+        try:
+            response = http.get(f"{self.base_url}/api/version", timeout=self.timeout)
+            up = response.status_code == 200
+            error = None if up else f'HTTP {response.status_code}'
+        except httpx.HTTPError as e:
+            up, error = False, str(e) or e.__class__.__name__
+        self._record(up, error)
+        return up
+
+    def mark_down(self, error):
+        """Record a failure seen by a real request, without waiting for the next probe."""
+        self._record(False, error)
+
+    def _record(self, up, error):
+        now = time.monotonic()
+        with self._lock:
+            previous = self._up if self._checked_at is not None else None
+            self._up = up
+            self._checked_at = now
+            self._last_error = error
+            self._probes += 1
+            if not up:
+                self._failures += 1
+            changed = previous is not None and previous != up
+            if changed or previous is None:
+                self._changed_at = now
+            if changed:
+                self._transitions += 1
+
+        if changed:
+            logger.warning("Ollama availability changed: %s -> %s%s",
+                           'up' if previous else 'down', 'up' if up else 'down',
+                           f" ({error})" if error else '')
+            if self.on_change:
+                try:
+                    self.on_change(previous, up, error)
+                except Exception as e:
+                    logger.error(f"Ollama on_change callback failed: {e}")
+
+    def snapshot(self):
+        """Return a JSON-serialisable view of the monitor state."""
+        now = time.monotonic()
+        with self._lock:
+            checked_at = self._checked_at
+            changed_at = self._changed_at
+            return {
+                'available': self.available,
+                'stale': self.is_stale,
+                'last_checked_seconds_ago': round(now - checked_at, 3) if checked_at is not None else None,
+                'state_since_seconds': round(now - changed_at, 3) if changed_at is not None else None,
+                'last_error': self._last_error,
+                'transitions': self._transitions,
+                'probes': self._probes,
+                'failures': self._failures,
+                'interval': self.interval,
+                'ttl': self.ttl,
+            }
+
+    def start(self):
+        """Start the background prober (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ollama-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.probe()
+            except Exception as e:
+                logger.error(f"Ollama health probe crashed: {e}")
+            self._stop.wait(self.interval)
+
+
+class OllamaHost:
+    """One Ollama endpoint: its own availability monitor plus load counters."""
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.base_url = monitor.base_url
+        self.outstanding = 0
+        self.requests = 0
+        self.marked_down = 0
+        self.last_picked = 0
+        self.warming = False  # models still loading; used only when no warm host is left
+
+    @property
+    def available(self):
+        return self.monitor.available
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def snapshot(self):
+        return {
+            **self.monitor.snapshot(),
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'marked_down': self.marked_down,
+            'warming': self.warming,
+        }
+
+
+class OllamaHostPool:
+    """Client-side least-outstanding-requests balancer over Ollama hosts.
+
+    Each host has its own ``OllamaAvailabilityMonitor``; the pool is
+    available while any host is.  ``acquire`` picks the healthy host with
+    the fewest generations in progress (ties go to the least recently
+    picked), preferring hosts whose models are already loaded, and, with
+    ``affinity`` on, keeps returning the same host for a ``session_id``
+    while that host stays healthy, so follow-up chat turns reuse the host's
+    cached context.  Every ``acquire`` must be paired with a ``release``.
+    """
+
+    def __init__(self, base_urls, affinity=True, affinity_ttl=1800.0, affinity_max_sessions=10000,
+                 client=None, **monitor_options):
+        self.hosts = [OllamaHost(OllamaAvailabilityMonitor(url, client=client, **monitor_options))
+                      for url in dict.fromkeys(url.rstrip('/') for url in base_urls)]
+        self.affinity = affinity
+        self.affinity_ttl = affinity_ttl
+        self.affinity_max_sessions = affinity_max_sessions
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._sessions = OrderedDict()  # session_id -> (host, expires_at), least recently used first
+        self._picks = itertools.count(1)
+
+        self.affinity_hits = 0
+        self.affinity_moves = 0  # sessions re-homed because their host went away
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        return cls(
+            config.get('OLLAMA_BASE_URLS') or [config.get('OLLAMA_BASE_URL', 'http://localhost:11434')],
+            affinity=config.get('OLLAMA_SESSION_AFFINITY', True),
+            affinity_ttl=config.get('OLLAMA_AFFINITY_TTL', 1800.0),
+            affinity_max_sessions=config.get('OLLAMA_AFFINITY_MAX_SESSIONS', 10000),
+            interval=config.get('OLLAMA_HEALTH_INTERVAL', 15),
+            ttl=config.get('OLLAMA_HEALTH_TTL', 45),
+            timeout=config.get('OLLAMA_HEALTH_TIMEOUT', 3),
+            **kwargs
+        )
+
+    @property
+    def client(self):
+        return self.hosts[0].monitor.client if self.hosts else None
+
+    @client.setter
+    def client(self, client):
+        for host in self.hosts:
+            host.monitor.client = client
+
+    @property
+    def available(self):
+        """Whether any host is known to be up."""
+        return any(host.available for host in self.hosts)
+
+    @property
+    def probed(self):
+        """Whether any host has a probe result yet (up or down)."""
+        return any(host.monitor.probed for host in self.hosts)
+
+    def probe(self):
+        """Probe every host now; ``True`` if any is up."""
+        results = [host.monitor.probe() for host in self.hosts]
+        return any(results)
+
+    def refresh(self):
+        """Probe the hosts whose result is missing or older than ``ttl``; ``True`` if any is up.
+
+        On-demand checking for when no background monitor runs.  Concurrent
+        callers wait for one probe instead of each sending their own.
+        """
+        if any(host.available for host in self.hosts):
+            return True
+        with self._refresh_lock:
+            for host in self.hosts:
+                if host.monitor.is_stale:
+                    host.monitor.probe()
+        return self.available
+
+    def acquire(self, session_id=None, exclude=(), healthy_only=False):
+        """Reserve a host for one generation, or ``None`` if every host is excluded."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [host for host in self.hosts if host not in exclude]
+            healthy = [host for host in candidates if host.available]
+            if not healthy and not healthy_only:
+                # With no host known to be up, still try one: the monitors may simply be stale
+                healthy = candidates
+            healthy = [host for host in healthy if not host.warming] or healthy
+            if not healthy:
+                return None
+            host = self._sticky_host_locked(session_id, healthy, now)
+            if host is None:
+                host = min(healthy, key=lambda candidate: (candidate.outstanding, candidate.last_picked))
+                if session_id and self.affinity:
+                    self._sessions[session_id] = (host, now + self.affinity_ttl)
+                    self._sessions.move_to_end(session_id)
+                    while len(self._sessions) > self.affinity_max_sessions:
+                        self._sessions.popitem(last=False)
+            host.outstanding += 1
+            host.requests += 1
+            host.last_picked = next(self._picks)
+            return host
+
+    def _sticky_host_locked(self, session_id, healthy, now):
+        if not (session_id and self.affinity):
+            return None
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        host, expires_at = entry
+        if expires_at < now:
+            del self._sessions[session_id]
+            return None
+        if host not in healthy:
+            self.affinity_moves += 1
+            return None
+        self._sessions[session_id] = (host, now + self.affinity_ttl)
+        self._sessions.move_to_end(session_id)
+        self.affinity_hits += 1
+        return host
+
+    def release(self, host, down_error=None):
+        """Return ``host``'s slot; ``down_error`` marks it down until its next good probe."""
+        with self._lock:
+            host.outstanding -= 1
+            if down_error:
+                host.marked_down += 1
+        if down_error:
+            host.monitor.mark_down(down_error)
+
+    def start(self):
+        for host in self.hosts:
+            host.monitor.start()
+
+    def stop(self, timeout=None):
+        for host in self.hosts:
+            host.monitor.stop(timeout)
+
+    def snapshot(self):
+        """Return a JSON-serialisable view of every host and the affinity table."""
+        hosts = {host.base_url: host.snapshot() for host in self.hosts}
+        with self._lock:
+            return {
+                'available': any(host['available'] for host in hosts.values()),
+                'hosts': hosts,
+                'affinity_sessions': len(self._sessions),
+                'affinity_hits': self.affinity_hits,
+                'affinity_moves': self.affinity_moves,
+            }
@@ -0,0 +1,220 @@
+"""
+rate_limiter.py - Pluggable request rate limiting
+
+Limits are written the way RATELIMIT_DEFAULT already is ("100 per hour") and
+enforced with a sliding-window counter: the current fixed window's count plus
+the previous window's count weighted by how much of it still overlaps.  That
+is O(1) per check and never touches the database.
+
+Backends are chosen from RATELIMIT_STORAGE_URL:
+    memory://           per-process counters (single worker, tests)
+    redis://host:6379   shared counters for multi-worker deployments
+"""
+
+import math
+import re
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import redis
+except ImportError:  # only needed for a shared (redis://) backend
+    redis = None
+
+RateLimit = namedtuple('RateLimit', ['amount', 'window'])
+
+
+class RateLimitResult(namedtuple('RateLimitResult', ['allowed', 'limit', 'remaining', 'reset_after', 'key'])):
+    """Outcome of a check; truthy when the request may proceed."""
+
+    __slots__ = ()
+
+    def __bool__(self):
+        return self.allowed
+
+
+_UNITS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+_LIMIT = re.compile(r'^\s*(\d+)\s*(?:per|/)\s*(\d+)?\s*(second|minute|hour|day)s?\s*$', re.IGNORECASE)
+
+
+def parse_limit(value):
+    """Parse "10 per hour", "10/minute" or "5 per 10 seconds" into a ``RateLimit``."""
+    if isinstance(value, RateLimit):
+        return value
+    match = _LIMIT.match(value or '')
+    if not match:
+        raise ValueError(f"Invalid rate limit: {value!r}")
+    amount, multiplier, unit = match.groups()
+    return RateLimit(int(amount), int(multiplier or 1) * _UNITS[unit.lower()])
+
+
+def _sliding_count(current, previous, window, now):
+    elapsed = now % window
+    return current + previous * (window - elapsed) / window, window - elapsed
+
+
+class MemoryBackend:
+    """Per-process sliding-window counters."""
+
+    def __init__(self, sweep_every=1000):
+        self._lock = threading.Lock()
+        self._windows = {}  # key -> [window_index, current_count, previous_count, window]
+        self._sweep_every = sweep_every
+        self._hits = 0
+
+    def hit(self, key, limit, now=None):
+        now = time.time() if now is None else now
+        index = int(now // limit.window)
+        with self._lock:
+            entry = self._windows.get(key)
+            if entry is None or entry[0] < index - 1:
+                entry = [index, 0, 0, limit.window]
+            elif entry[0] == index - 1:
+                entry = [index, 0, entry[1], limit.window]
+            self._windows[key] = entry
+
+            count, reset_after = _sliding_count(entry[1], entry[2], limit.window, now)
+            allowed = count < limit.amount
+            if allowed:
+                entry[1] += 1
+                count += 1
+
+            self._hits += 1
+            if self._hits % self._sweep_every == 0:
+                self._sweep(now)
+        return allowed, count, reset_after
+
+    def undo(self, key, limit, now=None):
+        """Give back an allowed hit, e.g. when another limit rejected the request."""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._windows.get(key)
+            if entry is not None and entry[0] == int(now // limit.window) and entry[1] > 0:
+                entry[1] -= 1
+
+    def _sweep(self, now):
+        # Forget keys idle for two whole windows; their counts can no longer matter
+        stale = [key for key, (index, _, _, window) in self._windows.items()
+                 if index < int(now // window) - 1]
+        for key in stale:
+            del self._windows[key]
+
+    def reset(self):
+        with self._lock:
+            self._windows.clear()
+
+
+class RedisBackend:
+    """Sliding-window counters shared between workers through Redis."""
+
+    def __init__(self, url, prefix='ratelimit'):
+        if redis is None:
+            raise RuntimeError("RATELIMIT_STORAGE_URL points at Redis but the 'redis' package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def hit(self, key, limit, now=None):
+        now = time.time() if now is None else now
+        index = int(now // limit.window)
+        current_key = f"{self.prefix}:{key}:{index}"
+        previous_key = f"{self.prefix}:{key}:{index - 1}"
+
+        pipe = self.client.pipeline()
+        pipe.incr(current_key)
+        pipe.expire(current_key, limit.window * 2)
+        pipe.get(previous_key)
+        current, _, previous = pipe.execute()
+
+        count, reset_after = _sliding_count(current - 1, int(previous or 0), limit.window, now)
+        allowed = count < limit.amount
+        if allowed:
+            count += 1
+        else:
+            # Rejected requests do not use up the allowance
+            self.client.decr(current_key)
+        return allowed, count, reset_after
+
+    def undo(self, key, limit, now=None):
+        """Give back an allowed hit, e.g. when another limit rejected the request."""
+        now = time.time() if now is None else now
+        self.client.decr(f"{self.prefix}:{key}:{int(now // limit.window)}")
+
+    def reset(self):
+        for key in self.client.scan_iter(f"{self.prefix}:*"):
+            self.client.delete(key)
+
+
+def create_backend(url):
+    if not url or url.startswith('memory://'):
+        return MemoryBackend()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported RATELIMIT_STORAGE_URL: {url}")
+
+
+class RateLimiter:
+    """Check named route limits against per-session and per-IP counters."""
+
+    def __init__(self, backend, route_limits=None, ip_limit='100 per hour', enabled=True):
+        self.backend = backend
+        self.route_limits = {route: parse_limit(value) for route, value in (route_limits or {}).items()}
+        self.ip_limit = parse_limit(ip_limit) if ip_limit else None
+        self.enabled = enabled
+        self.allowed = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            create_backend(config.get('RATELIMIT_STORAGE_URL', 'memory://')),
+            route_limits=config.get('RATELIMIT_ROUTE_LIMITS', {}),
+            ip_limit=config.get('RATELIMIT_DEFAULT', '100 per hour'),
+            enabled=config.get('RATELIMIT_ENABLED', True)
+        )
+
+    def check(self, route, session_id=None, remote_addr=None, now=None, session_limit=None):
+        """Count one request to ``route``; the result is the most restrictive limit hit.
+
+        ``session_limit`` replaces the route's configured per-session limit.
+        """
+        checks = []
+        session_limit = parse_limit(session_limit) if session_limit else self.route_limits.get(route)
+        if session_id and session_limit:
+            checks.append((f"{route}:session:{session_id}", session_limit))
+        if remote_addr and self.ip_limit:
+            checks.append((f"{route}:ip:{remote_addr}", self.ip_limit))
+        if not self.enabled or not checks:
+            return RateLimitResult(True, None, None, 0, None)
+
+        result = None
+        recorded = []
+        for key, limit in checks:
+            # Window length in the key keeps counters for different limits apart
+            counter = f"{key}:{limit.window}"
+            allowed, count, reset_after = self.backend.hit(counter, limit, now)
+            candidate = RateLimitResult(allowed, limit, max(0, limit.amount - math.ceil(count)),
+                                        math.ceil(reset_after), key)
+            if not allowed:
+                # A rejected request uses up none of its other allowances either
+                for counter, limit in recorded:
+                    self.backend.undo(counter, limit, now)
+                result = candidate
+                break
+            recorded.append((counter, limit))
+            if result is None or candidate.remaining < result.remaining:
+                result = candidate
+
+        if result.allowed:
+            self.allowed += 1
+        else:
+            self.rejected += 1
+        return result
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'backend': type(self.backend).__name__,
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+        }
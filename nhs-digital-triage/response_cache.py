@@ -0,0 +1,106 @@
+"""
+response_cache.py - Content-addressed cache for deterministic AI prompts
+
+Structured triage prompts are built entirely from a handful of form fields,
+so identical submissions produce identical prompts.  Completed generations
+are stored under a hash of (normalised prompt, model, sampling options) and
+replayed instead of asking Ollama again.  Eviction is LRU, bounded by total
+UTF-8 size, with a per-entry TTL.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class ResponseCache:
+    """Thread-safe LRU + TTL cache of generated text, capped in bytes."""
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=3600.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (text, size, stored_at)
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_bytes=config.get('RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024),
+            ttl=config.get('RESPONSE_CACHE_TTL', 3600)
+        )
+
+    @staticmethod
+    def make_key(prompt, model, options=None):
+        """Hash a generation request; whitespace differences do not matter."""
+        normalised = _WHITESPACE.sub(' ', prompt).strip()
+        material = json.dumps(
+            {'prompt': normalised, 'model': model, 'options': options or {}},
+            sort_keys=True, separators=(',', ':')
+        )
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached text for ``key`` or ``None``."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            text, size, stored_at = entry
+            if now - stored_at > self.ttl:
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key, text):
+        size = len(text.encode('utf-8'))
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (text, size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
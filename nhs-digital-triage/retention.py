@@ -0,0 +1,119 @@
+"""
+retention.py - Batched background purging of expired rows
+
+Retention used to be one bulk DELETE per table, run inside ``create_app`` on
+every worker boot.  ``purge_in_batches`` instead walks expired rows a batch
+of primary keys at a time, committing each batch on its own so writers are
+never locked out for long.  Batch size adapts to ``batch_budget``: a batch
+that takes longer than the budget halves the next one, a quick one grows it.
+``RetentionJob`` runs the purge periodically on a daemon thread, starting
+only after ``initial_delay`` so boot does no purge work.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def purge_in_batches(select_ids, delete_ids, batch_size=500, batch_budget=0.25,
+                     deadline=None, min_batch=50, max_batch=5000):
+    """Delete expired rows until none are left or ``deadline`` passes.
+
+    ``select_ids(limit)`` returns up to ``limit`` expired primary keys and
+    ``delete_ids(ids)`` deletes them (and their dependants) in one
+    transaction, returning ``{table: rows_deleted}``.  Returns the summed
+    counts and whether the purge finished.
+    """
+    purged = {}
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            return purged, False
+        started = time.monotonic()
+        ids = select_ids(batch_size)
+        if not ids:
+            return purged, True
+        for table, count in delete_ids(ids).items():
+            purged[table] = purged.get(table, 0) + count
+        if len(ids) < batch_size:
+            return purged, True
+
+        elapsed = time.monotonic() - started
+        if elapsed > batch_budget:
+            batch_size = max(min_batch, batch_size // 2)
+        elif elapsed < batch_budget / 2:
+            batch_size = min(max_batch, batch_size * 2)
+
+
+class RetentionJob:
+    """Call ``purge()`` every ``interval`` seconds on a background thread."""
+
+    def __init__(self, purge, interval=3600.0, initial_delay=300.0):
+        self.purge = purge
+        self.interval = interval
+        self.initial_delay = initial_delay
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.runs = 0
+        self.failures = 0
+        self.incomplete = 0
+        self.purged = {}
+        self.last_run = None
+
+    def run_once(self):
+        """Run one purge now; returns ``{table: rows_deleted}``."""
+        started = time.monotonic()
+        try:
+            purged, complete = self.purge()
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+            logger.error(f"Retention purge failed: {e}")
+            return {}
+        with self._lock:
+            self.runs += 1
+            self.incomplete += not complete
+            for table, count in purged.items():
+                self.purged[table] = self.purged.get(table, 0) + count
+            self.last_run = {
+                'at': time.time(),
+                'duration': round(time.monotonic() - started, 3),
+                'purged': purged,
+                'complete': complete,
+            }
+        return purged
+
+    def start(self):
+        """Start the background job (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='retention-purge', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        delay = self.initial_delay
+        while not self._stop.wait(delay):
+            self.run_once()
+            delay = self.interval
+
+    def stats(self):
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'failures': self.failures,
+                'incomplete_runs': self.incomplete,
+                'purged': dict(self.purged),
+                'last_run': self.last_run,
+                'running': bool(self._thread and self._thread.is_alive()),
+            }
@@ -0,0 +1,76 @@
+"""
+sqlite_tuning.py - Connection-level SQLite settings and a read-only pool
+
+SQLite's defaults (rollback journal, synchronous=FULL, no busy timeout) make
+concurrent writers fail fast with "database is locked".  ``install_pragmas``
+applies a tuned profile to every new DBAPI connection an engine opens: a
+busy timeout, memory-mapped I/O and a larger page cache.  WAL, so readers
+and the single writer no longer block each other, is a property of the
+file rather than the connection; ``set_journal_mode`` switches it once,
+from the serving entry points or ``manage.py migrate``, so merely opening
+the database never rewrites it.
+
+``create_read_engine`` opens a second, separately pooled engine on the same
+file whose connections are ``query_only``; dashboard and statistics reads
+use it so they never hold a connection the writers need.
+"""
+
+import logging
+
+from sqlalchemy import create_engine, event
+
+logger = logging.getLogger(__name__)
+
+# journal_mode is applied by set_journal_mode, the rest on every connection
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -20000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+
+def is_file_sqlite(engine):
+    return engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:')
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def install_pragmas(engine, pragmas=None, read_only=False):
+    """Apply ``pragmas`` to every connection ``engine`` opens from now on."""
+    pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+    # The journal mode is a property of the file, see set_journal_mode
+    pragmas.pop('journal_mode', None)
+    if read_only:
+        pragmas['query_only'] = 'ON'
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        try:
+            apply_pragmas(dbapi_connection, pragmas)
+        except Exception as e:
+            logger.warning(f"Could not apply SQLite pragmas: {e}")
+
+    return pragmas
+
+
+def set_journal_mode(engine, mode='WAL'):
+    """Switch ``engine``'s database file to ``mode``; returns the mode now in effect."""
+    with engine.connect() as connection:
+        return connection.exec_driver_sql(f"PRAGMA journal_mode={mode}").scalar()
+
+
+def create_read_engine(engine, pragmas=None, **engine_options):
+    """A separately pooled, query-only engine on ``engine``'s SQLite file."""
+    read_engine = create_engine(engine.url, **engine_options)
+    install_pragmas(read_engine, pragmas, read_only=True)
+    return read_engine
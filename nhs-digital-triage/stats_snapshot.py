@@ -0,0 +1,53 @@
+"""
+stats_snapshot.py - Short-lived cached snapshots of expensive aggregates
+
+Status endpoints are polled by dashboards, monitors and health checks far
+more often than their numbers change.  ``TTLSnapshot`` recomputes a value at
+most once per ``ttl`` seconds; while one caller refreshes, concurrent callers
+keep getting the previous snapshot instead of piling onto the database.
+"""
+
+import threading
+import time
+
+
+class TTLSnapshot:
+    """Cache the result of ``loader()`` for ``ttl`` seconds."""
+
+    def __init__(self, loader, ttl=10.0):
+        self.loader = loader
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._value = None
+        self._loaded_at = None
+
+        self.refreshes = 0
+
+    def get(self):
+        """Return ``(value, age_seconds)``, refreshing the snapshot if it has expired."""
+        now = time.monotonic()
+        with self._lock:
+            value, loaded_at = self._value, self._loaded_at
+        if loaded_at is not None and now - loaded_at <= self.ttl:
+            return value, now - loaded_at
+
+        # Single flight: if another thread is refreshing, serve the stale snapshot
+        if not self._refresh_lock.acquire(blocking=loaded_at is None):
+            return value, now - loaded_at
+        try:
+            with self._lock:
+                if self._loaded_at is not None and time.monotonic() - self._loaded_at <= self.ttl:
+                    return self._value, time.monotonic() - self._loaded_at
+            value = self.loader()
+            with self._lock:
+                self._value, self._loaded_at = value, time.monotonic()
+                self.refreshes += 1
+            return value, 0.0
+        finally:
+            self._refresh_lock.release()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
@@ -2,7 +2,11 @@ import unittest
 import json
 import tempfile
 import os
-from datetime import datetime, timezone
+import time
+from datetime import datetime, timezone, timedelta
+from importlib.util import find_spec
+
+HAS_PYARROW = find_spec('pyarrow') is not None
 
 # Handle different import scenarios
 try:
@@ -48,6 +52,18 @@ class NHSTriageTestCase(unittest.TestCase):
         self.app_context.pop()
         os.close(self.db_fd)
         os.unlink(self.db_path)
+    
+    def count_queries(self, func):
+        """Run ``func`` and return how many SQL statements it executed."""
+        from sqlalchemy import event
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            func()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return len(statements)
 
 class RoutesTestCase(NHSTriageTestCase):
     """Test case for application routes."""
@@ -105,6 +121,36 @@ class APITestCase(NHSTriageTestCase):
         data = json.loads(response.data)
         self.assertIn('ollama_available', data)
         self.assertIn('total_patients', data)
+    
+    def test_system_status_counts_are_cached_snapshot(self):
+        """Test that counts come from one cached aggregate until the TTL expires."""
+        from app import count_system_totals
+        self.assertEqual(count_system_totals(),
+                         {'total_patients': 0, 'total_assessments': 0, 'total_chat_messages': 0})
+        
+        self.client.get('/api/system-status')
+        db.session.add(Patient(session_id='snap', first_name='S', last_name='T', age=20, gender='male'))
+        db.session.commit()
+        
+        self.assertEqual(self.client.get('/api/system-status').get_json()['total_patients'], 0)
+        self.app.extensions['status_snapshot'].ttl = 0
+        data = self.client.get('/api/system-status').get_json()
+        self.assertEqual(data['total_patients'], 1)
+        self.assertEqual(data['stats_age_seconds'], 0.0)
+    
+    def test_snapshot_serves_stale_value_while_refreshing(self):
+        """Test that concurrent callers do not pile onto an in-progress refresh."""
+        from stats_snapshot import TTLSnapshot
+        calls = []
+        snapshot = TTLSnapshot(lambda: calls.append(1) or len(calls), ttl=60)
+        
+        self.assertEqual(snapshot.get()[0], 1)
+        self.assertEqual(snapshot.get()[0], 1)
+        snapshot.ttl = 0
+        with snapshot._refresh_lock:
+            self.assertEqual(snapshot.get()[0], 1)  # another thread is refreshing
+        self.assertEqual(snapshot.get()[0], 2)
+        self.assertEqual(snapshot.refreshes, 2)
 
 class ModelTestCase(NHSTriageTestCase):
     """Test case for database models."""
@@ -225,6 +271,101 @@ class UtilityFunctionTestCase(NHSTriageTestCase):
             self.assertEqual(parse_urgency_level(standard_response), 'Standard')
             self.assertEqual(parse_urgency_level(selfcare_response), 'Self-care')
 
+class KeywordMatcherTestCase(NHSTriageTestCase):
+    """Test case for the compiled emergency keyword matcher."""
+    
+    def test_matches_report_keyword_and_span(self):
+        """Test that every red-flag phrase is returned with its position."""
+        from app import find_emergency_keywords
+        text = 'Sudden Chest  Pain and difficulty breathing'
+        
+        matches = find_emergency_keywords(text)
+        
+        self.assertEqual([m.keyword for m in matches], ['chest pain', 'difficulty breathing'])
+        self.assertEqual(text[matches[0].start:matches[0].end], 'Chest  Pain')
+    
+    def test_word_boundaries_and_plurals(self):
+        """Test that phrases match whole words, including plurals."""
+        from keyword_matcher import KeywordMatcher
+        matcher = KeywordMatcher(['unconscious', 'heart attack'])
+        
+        self.assertIn('two heart attacks last year', matcher)
+        self.assertNotIn('a subconscious worry', matcher)
+        self.assertIsNone(matcher.search(''))
+    
+    def test_longest_phrase_wins(self):
+        """Test that overlapping phrases resolve to the most specific one."""
+        from keyword_matcher import KeywordMatcher
+        matcher = KeywordMatcher(['bleeding', 'severe bleeding'])
+        
+        self.assertEqual(matcher.find_all('severe bleeding')[0].keyword, 'severe bleeding')
+    
+    def test_matcher_rebuilt_when_keywords_change(self):
+        """Test that the matcher follows EMERGENCY_KEYWORDS edits."""
+        from app import emergency_keyword_matcher, detect_emergency_keywords
+        matcher = emergency_keyword_matcher()
+        self.assertIs(emergency_keyword_matcher(), matcher)
+        
+        self.app.config['EMERGENCY_KEYWORDS'] = self.app.config['EMERGENCY_KEYWORDS'] + ['seizure']
+        
+        self.assertIsNot(emergency_keyword_matcher(), matcher)
+        self.assertTrue(detect_emergency_keywords('she had a seizure'))
+
+class UrgencyClassifierTestCase(NHSTriageTestCase):
+    """Test case for the urgency classifier."""
+    
+    def test_structured_header_wins(self):
+        """Test that the URGENCY LEVEL header overrides body keywords."""
+        from urgency_classifier import classify_urgency
+        result = classify_urgency('**URGENCY LEVEL:** Standard\n\nIf it worsens, call 999.')
+        
+        self.assertEqual(result.level, 'Standard')
+        self.assertEqual(result.source, 'header')
+        self.assertGreater(result.confidence, 0.9)
+    
+    def test_prompt_template_is_not_an_answer(self):
+        """Test that an echoed '[Emergency/Urgent/...]' template is ignored."""
+        from urgency_classifier import classify_urgency
+        result = classify_urgency('**URGENCY LEVEL:** [Emergency/Urgent/Standard/Self-care]\nSee your GP.')
+        
+        self.assertEqual((result.level, result.source), ('Standard', 'keywords'))
+    
+    def test_negated_mentions_are_skipped(self):
+        """Test that 'not an emergency' does not classify as Emergency."""
+        from urgency_classifier import classify_urgency
+        
+        self.assertEqual(classify_urgency('This is not an emergency. Book a GP appointment.').level, 'Standard')
+        self.assertEqual(classify_urgency("Don't hesitate to call 999.").level, 'Emergency')
+        self.assertEqual(classify_urgency('Rest and fluids.').confidence, 0.3)
+    
+    def test_incremental_feed_resolves_header_once(self):
+        """Test that streamed tokens resolve the header as soon as it is complete."""
+        from urgency_classifier import UrgencyClassifier
+        classifier = UrgencyClassifier()
+        
+        results = [classifier.feed(chunk) for chunk in ['**URGENCY ', 'LEVEL:** Emer', 'gency', '\n', 'Call 999']]
+        
+        self.assertEqual([r and r.level for r in results], [None, None, None, 'Emergency', None])
+        self.assertEqual(classifier.finish().level, 'Emergency')
+        self.assertEqual(classifier.counts['Emergency'], 1)  # '999'; the header line is not counted
+    
+    def test_save_ai_response_records_confidence(self):
+        """Test that the classifier populates confidence_score."""
+        from app import save_ai_response
+        patient = Patient(session_id='urgency', first_name='Urgency', last_name='Test', age=30, gender='male')
+        db.session.add(patient)
+        db.session.commit()
+        assessment = TriageAssessment(session_id='urgency', patient_id=patient.id,
+                                      symptom_category='pain', primary_symptom='Headache',
+                                      severity=3, duration='today')
+        db.session.add(assessment)
+        db.session.commit()
+        
+        save_ai_response(assessment.id, '**URGENCY LEVEL:** Urgent\nCall 111.', 1.0, 'triage')
+        
+        self.assertEqual(assessment.urgency_level, 'Urgent')
+        self.assertEqual(assessment.confidence_score, 0.95)
+
 class SecurityTestCase(NHSTriageTestCase):
     """Test case for security features."""
     
@@ -253,6 +394,154 @@ class SecurityTestCase(NHSTriageTestCase):
             self.assertIn('session_id', sess)
             self.assertIsNotNone(sess['session_id'])
 
+class RateLimiterTestCase(NHSTriageTestCase):
+    """Test case for the sliding-window rate limiter."""
+    
+    def test_parse_limit(self):
+        """Test the "N per unit" limit syntax."""
+        from rate_limiter import parse_limit
+        self.assertEqual(parse_limit('100 per hour'), (100, 3600))
+        self.assertEqual(parse_limit('5/minute'), (5, 60))
+        self.assertEqual(parse_limit('3 per 10 seconds'), (3, 10))
+        with self.assertRaises(ValueError):
+            parse_limit('lots')
+    
+    def test_sliding_window_carries_previous_window(self):
+        """Test that the previous window still counts while it overlaps."""
+        from rate_limiter import MemoryBackend, parse_limit
+        backend, limit = MemoryBackend(), parse_limit('4 per 100 seconds')
+        
+        for _ in range(4):
+            self.assertTrue(backend.hit('k', limit, now=90)[0])
+        self.assertFalse(backend.hit('k', limit, now=99)[0])
+        # Halfway into the next window half of the previous four still count
+        self.assertTrue(backend.hit('k', limit, now=150)[0])
+        self.assertTrue(backend.hit('k', limit, now=150)[0])
+        self.assertFalse(backend.hit('k', limit, now=150)[0])
+        self.assertTrue(backend.hit('k', limit, now=210)[0])
+    
+    def test_session_and_ip_limits_are_separate(self):
+        """Test that a busy IP is limited even across fresh sessions."""
+        from rate_limiter import MemoryBackend, RateLimiter
+        limiter = RateLimiter(MemoryBackend(), route_limits={'chat': '2 per hour'}, ip_limit='3 per hour')
+        
+        self.assertTrue(limiter.check('chat', 'a', '10.0.0.1'))
+        self.assertTrue(limiter.check('chat', 'a', '10.0.0.1'))
+        self.assertEqual(limiter.check('chat', 'a', '10.0.0.1').key, 'chat:session:a')
+        self.assertTrue(limiter.check('chat', 'b', '10.0.0.1'))
+        
+        result = limiter.check('chat', 'c', '10.0.0.1')
+        self.assertFalse(result)
+        self.assertEqual(result.key, 'chat:ip:10.0.0.1')
+        self.assertTrue(limiter.check('triage', 'c', '10.0.0.2'))
+    
+    def test_ip_rejection_does_not_use_the_session_allowance(self):
+        """Test that a request the IP limit rejects is not counted against its session."""
+        from rate_limiter import MemoryBackend, RateLimiter
+        limiter = RateLimiter(MemoryBackend(), route_limits={'chat': '2 per hour'}, ip_limit='1 per hour')
+        
+        self.assertTrue(limiter.check('chat', 'a', '10.0.0.1', now=0))
+        for _ in range(3):
+            self.assertEqual(limiter.check('chat', 'b', '10.0.0.1', now=1).key, 'chat:ip:10.0.0.1')
+        
+        result = limiter.check('chat', 'b', '10.0.0.2', now=2)
+        self.assertTrue(result)
+        self.assertEqual(result.remaining, 0)
+        self.assertTrue(limiter.check('chat', 'b', '10.0.0.3', now=3))
+    
+    def test_chat_endpoint_returns_429_with_retry_after(self):
+        """Test that the chat route rejects without touching the message table."""
+        self.app.extensions['ollama_pool'].hosts[0].monitor._record(True, None)
+        self.app.config['RATELIMIT_ROUTE_LIMITS'] = {'chat': '1 per hour'}
+        from rate_limiter import RateLimiter
+        self.app.extensions['rate_limiter'] = RateLimiter.from_config(self.app.config)
+        
+        self.assertEqual(self.client.post('/api/chat', json={'message': 'hello'}).status_code, 200)
+        response = self.client.post('/api/chat', json={'message': 'hello again'})
+        
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(response.headers['X-RateLimit-Remaining'], '0')
+        self.assertEqual(ChatMessage.query.count(), 1)
+    
+    def test_limit_and_window_override_the_route_limit(self):
+        """Test that rate_limit_check keeps its limit/window keyword overrides."""
+        from app import rate_limit_check
+        with self.app.test_request_context():
+            self.assertTrue(rate_limit_check('override-session', limit=2))
+            self.assertTrue(rate_limit_check('override-session', limit=2))
+            result = rate_limit_check('override-session', limit=2)
+            self.assertFalse(result)
+            self.assertEqual(result.limit.window, 3600)
+            
+            self.assertTrue(rate_limit_check('window-session', 1, 60))
+            result = rate_limit_check('window-session', 1, 60)
+            self.assertFalse(result)
+            self.assertEqual((result.limit.amount, result.limit.window), (1, 60))
+            self.assertLessEqual(result.reset_after, 60)
+    
+    def test_redis_backend_requires_client_library(self):
+        """Test that a redis:// URL without redis-py fails clearly."""
+        import rate_limiter
+        if rate_limiter.redis is not None:
+            self.skipTest("redis package installed")
+        with self.assertRaises(RuntimeError):
+            rate_limiter.create_backend('redis://localhost:6379/0')
+
+class SystemLogWriterTestCase(NHSTriageTestCase):
+    """Test case for write-behind SystemLog batching."""
+    
+    def make_writer(self, **kwargs):
+        from log_writer import BatchLogWriter
+        self.batches = []
+        return BatchLogWriter(self.batches.append, **kwargs)
+    
+    def test_rows_are_written_in_batches(self):
+        """Test that queued rows are flushed in bounded batches."""
+        writer = self.make_writer(batch_size=2)
+        for i in range(5):
+            writer.log({'message': str(i)})
+        
+        self.assertEqual(self.batches, [])
+        self.assertEqual(writer.flush(), 5)
+        self.assertEqual([len(batch) for batch in self.batches], [2, 2, 1])
+        self.assertEqual(writer.stats()['batches'], 3)
+    
+    def test_full_queue_sheds_routine_rows_and_bounds_waits(self):
+        """Test that a full queue never blocks for long."""
+        writer = self.make_writer(max_queue=1, block_timeout=0.01)
+        self.assertTrue(writer.log({'message': 'first'}))
+        
+        self.assertFalse(writer.log({'message': 'info'}))
+        started = time.monotonic()
+        self.assertFalse(writer.log({'message': 'error'}, important=True))
+        
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual((writer.shed, writer.dropped), (1, 1))
+    
+    def test_background_writer_flushes_on_stop(self):
+        """Test that stopping the writer drains the queue."""
+        writer = self.make_writer(flush_interval=60)
+        writer.start()
+        writer.log({'message': 'pending'})
+        
+        writer.stop()
+        
+        self.assertEqual(self.batches, [[{'message': 'pending'}]])
+        self.assertFalse(writer.stats()['running'])
+    
+    def test_log_event_does_not_commit_request_session(self):
+        """Test that logging leaves the caller's unit of work alone."""
+        from app import log_system_event
+        patient = Patient(session_id='pending', first_name='P', last_name='Q', age=30, gender='female')
+        db.session.add(patient)
+        
+        log_system_event('WARNING', 'Something happened', 'test')
+        db.session.rollback()
+        
+        self.assertEqual(SystemLog.query.filter_by(message='Something happened').count(), 1)
+        self.assertIsNone(Patient.query.filter_by(session_id='pending').first())
+
 class DataRetentionTestCase(NHSTriageTestCase):
     """Test case for data retention policies."""
     
@@ -296,6 +585,115 @@ class DataRetentionTestCase(NHSTriageTestCase):
             patients = Patient.query.all()
             self.assertEqual(len(patients), 1)
             self.assertEqual(patients[0].first_name, 'New')
+    
+    def add_patient(self, name, days_old, assessment_days_old=None):
+        created_at = datetime.now(timezone.utc) - timedelta(days=days_old)
+        patient = Patient(session_id=f'{name}-session', first_name=name, last_name='Patient',
+                          age=40, gender='male', created_at=created_at)
+        db.session.add(patient)
+        db.session.flush()
+        db.session.add(ChatMessage(session_id=patient.session_id, patient_id=patient.id,
+                                   message='Hello', role='user', created_at=created_at))
+        if assessment_days_old is not None:
+            db.session.add(TriageAssessment(
+                session_id=patient.session_id, patient_id=patient.id, primary_symptom='Cough',
+                severity=2, duration='today',
+                created_at=datetime.now(timezone.utc) - timedelta(days=assessment_days_old)
+            ))
+        db.session.commit()
+        return patient
+    
+    def test_purge_cascades_to_assessments_and_messages(self):
+        """Test that purged patients take their dependent rows with them."""
+        from app import purge_expired_data
+        self.add_patient('Old', days_old=40, assessment_days_old=40)
+        self.add_patient('Returning', days_old=40, assessment_days_old=0)
+        
+        purged, complete = purge_expired_data()
+        
+        self.assertTrue(complete)
+        self.assertEqual(purged, {'chat_messages': 2, 'triage_assessments': 1, 'patients': 1})
+        self.assertEqual([p.first_name for p in Patient.query.all()], ['Returning'])
+        self.assertEqual(TriageAssessment.query.count(), 1)
+        self.assertEqual(ChatMessage.query.count(), 0)
+
+    def test_manual_cleanup_purges_system_logs_with_days_override(self):
+        """Test the manage.py cleanup_data purge: one retention period, audit log included."""
+        from app import purge_expired_data
+        self.add_patient('Old', days_old=15, assessment_days_old=15)
+        self.add_patient('Recent', days_old=5)
+        for days_old in (15, 5):
+            db.session.add(SystemLog(level='INFO', message='event',
+                                     created_at=datetime.now(timezone.utc) - timedelta(days=days_old)))
+        db.session.commit()
+
+        purged, complete = purge_expired_data(days=10, system_logs=True)
+
+        self.assertTrue(complete)
+        self.assertEqual(purged, {'chat_messages': 1, 'triage_assessments': 1, 'patients': 1, 'system_logs': 1})
+        self.assertEqual([p.first_name for p in Patient.query.all()], ['Recent'])
+        self.assertEqual(SystemLog.query.count(), 1)
+
+    def test_purge_runs_in_bounded_batches(self):
+        """Test that a passed deadline stops the purge between batches."""
+        import time
+        from app import purge_expired_data
+        for i in range(5):
+            self.add_patient(f'Old{i}', days_old=40)
+        self.app.config['RETENTION_BATCH_SIZE'] = 2
+        
+        purged, complete = purge_expired_data(deadline=time.monotonic())
+        self.assertEqual((purged, complete), ({}, False))
+        
+        purged, complete = purge_expired_data()
+        self.assertTrue(complete)
+        self.assertEqual(purged['patients'], 5)
+    
+    def test_batch_size_adapts_to_budget(self):
+        """Test that slow batches shrink and fast ones grow."""
+        from retention import purge_in_batches
+        remaining, sizes = list(range(100)), []
+        
+        def select_ids(limit):
+            sizes.append(limit)
+            return remaining[:limit]
+        
+        def delete_ids(ids):
+            del remaining[:len(ids)]
+            return {'rows': len(ids)}
+        
+        purged, complete = purge_in_batches(select_ids, delete_ids, batch_size=10, batch_budget=60,
+                                            min_batch=5, max_batch=40)
+        self.assertEqual((purged, complete), ({'rows': 100}, True))
+        self.assertEqual(sizes[:3], [10, 20, 40])
+        
+        remaining[:] = range(20)
+        sizes.clear()
+        purge_in_batches(select_ids, delete_ids, batch_size=10, batch_budget=-1, min_batch=5)
+        self.assertEqual(sizes[:2], [10, 5])
+    
+    def test_startup_does_no_purge_work(self):
+        """Test that building the app neither purges nor starts the job in tests."""
+        self.add_patient('Old', days_old=40)
+        
+        create_app('testing')
+        
+        self.assertEqual(Patient.query.count(), 1)
+        self.assertFalse(self.app.extensions['retention_job'].stats()['running'])
+    
+    def test_job_records_purge_metrics(self):
+        """Test that each run's counts are accumulated for /api/metrics."""
+        from app import purge_expired_data
+        self.add_patient('Old', days_old=40)
+        job = self.app.extensions['retention_job']
+        job.purge = purge_expired_data
+        
+        job.run_once()
+        
+        metrics = json.loads(self.client.get('/api/metrics').data)['retention']
+        self.assertEqual(metrics['runs'], 1)
+        self.assertEqual(metrics['purged']['patients'], 1)
+        self.assertTrue(metrics['last_run']['complete'])
 
 class IntegrationTestCase(NHSTriageTestCase):
     """Integration tests for complete workflows."""
@@ -368,6 +766,2084 @@ class PerformanceTestCase(NHSTriageTestCase):
         self.assertEqual(len(recent_patients), 20)
         self.assertLess(query_time, 1.0)  # Should complete in under 1 second
 
+class OllamaMonitorTestCase(unittest.TestCase):
+    """Test case for the cached Ollama availability monitor."""
+    
+    def _monitor(self, handler, **kwargs):
+        import httpx
+        from ollama_client import OllamaAvailabilityMonitor
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        return OllamaAvailabilityMonitor('http://ollama.test', client=client, **kwargs)
+    
+    def test_unprobed_monitor_reports_unavailable(self):
+        """Test that an unprobed monitor fails closed."""
+        monitor = self._monitor(lambda request: None)
+        self.assertFalse(monitor.available)
+        self.assertTrue(monitor.is_stale)
+    
+    def test_probe_caches_state_and_tracks_transitions(self):
+        """Test that probes update the cached state and count up/down flips."""
+        import httpx
+        status = {'code': 200}
+        changes = []
+        monitor = self._monitor(
+            lambda request: httpx.Response(status['code'], json={'version': '0.1'}),
+            on_change=lambda previous, up, error: changes.append((previous, up))
+        )
+        
+        self.assertTrue(monitor.probe())
+        self.assertTrue(monitor.available)
+        
+        status['code'] = 500
+        self.assertFalse(monitor.probe())
+        self.assertFalse(monitor.available)
+        
+        snapshot = monitor.snapshot()
+        self.assertEqual(snapshot['transitions'], 1)
+        self.assertEqual(snapshot['failures'], 1)
+        self.assertEqual(snapshot['last_error'], 'HTTP 500')
+        self.assertEqual(changes, [(True, False)])
+    
+    def test_expired_state_is_unavailable(self):
+        """Test that a result older than the TTL is not trusted."""
+        import httpx
+        monitor = self._monitor(lambda request: httpx.Response(200), ttl=0)
+        monitor.probe()
+        time.sleep(0.01)
+        self.assertFalse(monitor.available)
+
+class MockOllamaTestCase(NHSTriageTestCase):
+    """Base test case with the app's Ollama clients pointed at a fake host."""
+    
+    def setUp(self):
+        super().setUp()
+        self.ollama_requests = []
+        self.ollama_body = b''
+        self.use_mock_ollama()
+    
+    def use_mock_ollama(self):
+        """Point the app's pooled client at an in-memory Ollama."""
+        import httpx
+        from ollama_client import OllamaHTTPClients
+        
+        def handler(request):
+            self.ollama_requests.append(request)
+            if request.url.path == '/api/version':
+                return httpx.Response(200, json={'version': 'test'})
+            return httpx.Response(200, content=self.ollama_body)
+        
+        transport = httpx.MockTransport(handler)
+        clients = OllamaHTTPClients(transport=transport, async_transport=transport)
+        self.app.extensions['ollama_http'] = clients
+        pool = self.app.extensions['ollama_pool']
+        pool.client = clients.sync
+        pool.probe()
+    
+    def asgi_get(self, path):
+        """GET ``path`` through the ASGI entry point."""
+        import asyncio
+        import httpx
+        from asgi import TriageASGIApp
+        
+        async def fetch():
+            transport = httpx.ASGITransport(app=TriageASGIApp(self.app))
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                return await client.get(path)
+        
+        return asyncio.run(fetch())
+    
+    def create_assessment(self, primary_symptom='Headache', severity=4):
+        patient = Patient.query.filter_by(session_id='stream-session').first()
+        if not patient:
+            patient = Patient(session_id='stream-session', first_name='Stream',
+                              last_name='Test', age=40, gender='female')
+            db.session.add(patient)
+            db.session.commit()
+        assessment = TriageAssessment(session_id='stream-session', patient_id=patient.id,
+                                      symptom_category='pain', primary_symptom=primary_symptom,
+                                      severity=severity, duration='today')
+        db.session.add(assessment)
+        db.session.commit()
+        return assessment
+    
+    def create_chat_message(self, session_id='stream-session'):
+        message = ChatMessage(session_id=session_id, message='Is this normal?', role='user')
+        db.session.add(message)
+        db.session.commit()
+        return message
+
+class OllamaStreamingTestCase(MockOllamaTestCase):
+    """Test case for streaming AI responses through the pooled client."""
+    
+    def test_triage_stream_uses_pooled_client(self):
+        """Test that triage streaming goes through the app-scoped client."""
+        self.ollama_body = b'{"response": "See your GP.", "done": true}\n'
+        assessment = self.create_assessment()
+        
+        response = self.client.get(f'/api/triage/stream/{assessment.id}')
+        body = response.get_data(as_text=True)
+        
+        self.assertIn('"chunk": "See your GP."', body)
+        self.assertIn('data: [DONE]', body)
+        self.assertEqual(self.ollama_requests[-1].url.path, '/api/generate')
+        self.assertEqual(db.session.get(TriageAssessment, assessment.id).ai_response, 'See your GP.')
+    
+    def test_triage_stream_reassembles_split_ndjson_lines(self):
+        """Test that tokens split across network chunks are not dropped."""
+        self.ollama_body = iter([
+            b'{"response": "Call ', b'999"}\n{"resp', b'onse": " now."}\n',
+            b'{"done": true}'
+        ])
+        assessment = self.create_assessment()
+        
+        body = self.client.get(f'/api/triage/stream/{assessment.id}').get_data(as_text=True)
+        
+        self.assertIn('"chunk": "Call 999"', body)
+        self.assertIn('"chunk": " now."', body)
+        self.assertIn('"done": true', body)
+        self.assertEqual(db.session.get(TriageAssessment, assessment.id).ai_response, 'Call 999 now.')
+    
+    def test_stream_fails_fast_when_ollama_down(self):
+        """Test that a cached 'down' state short-circuits generation."""
+        assessment = self.create_assessment()
+        self.app.extensions['ollama_pool'].hosts[0].monitor._record(False, 'down')
+        generate_calls = len(self.ollama_requests)
+        
+        body = self.client.get(f'/api/triage/stream/{assessment.id}').get_data(as_text=True)
+        
+        self.assertIn('AI service unavailable', body)
+        self.assertEqual(len(self.ollama_requests), generate_calls)
+    
+    def test_client_pool_settings_come_from_config(self):
+        """Test that pool limits and split timeouts are read from config."""
+        from ollama_client import OllamaHTTPClients
+        clients = OllamaHTTPClients.from_config({
+            'OLLAMA_POOL_MAX_CONNECTIONS': 7,
+            'OLLAMA_CONNECT_TIMEOUT': 1.5,
+            'AI_TIMEOUT': 42
+        })
+        self.assertEqual(clients.limits.max_connections, 7)
+        self.assertEqual(clients.timeout.connect, 1.5)
+        self.assertEqual(clients.timeout.read, 42)
+        clients.close()
+
+class AsyncStreamingTestCase(MockOllamaTestCase):
+    """Test case for the ASGI streaming path."""
+    
+    def test_async_stream_matches_sse_wire_format(self):
+        """Test that the ASGI path emits the same SSE wire format."""
+        self.ollama_body = b'{"response": "See your ", "done": false}\n{"response": "GP.", "done": true}\n'
+        assessment = self.create_assessment()
+        
+        response = self.asgi_get(f'/api/triage/stream/{assessment.id}')
+        
+        self.assertEqual(response.headers['content-type'], 'text/event-stream; charset=utf-8')
+        self.assertEqual(response.text, (
+            'data: {"chunk": "See your "}\n\n'
+            'data: {"chunk": "GP."}\n\n'
+            'data: {"done": true}\n\n'
+            'data: [DONE]\n\n'
+        ))
+        db.session.expire_all()
+        self.assertEqual(db.session.get(TriageAssessment, assessment.id).ai_response, 'See your GP.')
+    
+    def test_unknown_record_falls_through_to_flask(self):
+        """Test that unknown records fall through to Flask's 404."""
+        response = self.asgi_get('/api/triage/stream/999')
+        self.assertEqual(response.status_code, 404)
+    
+    def test_async_stream_fails_fast_when_ollama_down(self):
+        """Test that the async path honours the cached 'down' state."""
+        assessment = self.create_assessment()
+        self.app.extensions['ollama_pool'].hosts[0].monitor._record(False, 'down')
+        generate_calls = len(self.ollama_requests)
+        
+        response = self.asgi_get(f'/api/triage/stream/{assessment.id}')
+        
+        self.assertIn('AI service unavailable', response.text)
+        self.assertEqual(len(self.ollama_requests), generate_calls)
+    
+    def test_non_stream_routes_are_served_by_flask(self):
+        """Test that ordinary routes pass through to the WSGI app."""
+        response = self.asgi_get('/api/health')
+        self.assertEqual(response.json()['status'], 'healthy')
+
+    def test_slow_flask_requests_overlap(self):
+        """Test that WSGI requests run concurrently rather than on one shared thread."""
+        import asyncio
+        import httpx
+        from asgi import TriageASGIApp
+
+        health_check = self.app.view_functions['health_check']
+
+        def slow_health_check():
+            time.sleep(0.5)
+            return health_check()
+
+        self.app.view_functions['health_check'] = slow_health_check
+
+        async def fetch_both():
+            transport = httpx.ASGITransport(app=TriageASGIApp(self.app))
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                return await asyncio.gather(client.get('/api/health'), client.get('/api/health'))
+
+        started = time.monotonic()
+        responses = asyncio.run(fetch_both())
+        elapsed = time.monotonic() - started
+
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertLess(elapsed, 0.9)
+
+    def test_request_body_and_status_reach_flask(self):
+        """Test that POST bodies, statuses and headers pass through the WSGI adapter."""
+        import asyncio
+        import httpx
+        from asgi import TriageASGIApp
+
+        async def post():
+            transport = httpx.ASGITransport(app=TriageASGIApp(self.app))
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                return await client.post('/api/patient/register', json={'firstName': 'Ann'})
+
+        response = asyncio.run(post())
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.headers['content-type'], 'application/json')
+        # firstName was read from the body, so validation stops at the next field
+        self.assertEqual(response.json()['error'], 'lastName is required')
+
+    def test_stream_routes_get_flask_request_hooks(self):
+        """Test that ASGI-served streams carry the same CORS headers and session cookie as Flask routes."""
+        import asyncio
+        import httpx
+        from asgi import TriageASGIApp
+        self.ollama_body = b'{"response": "ok", "done": true}\n'
+        assessment = self.create_assessment()
+
+        async def fetch(path):
+            transport = httpx.ASGITransport(app=TriageASGIApp(self.app))
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                return await client.get(path, headers={'Origin': 'https://portal.example'})
+
+        stream = asyncio.run(fetch(f'/api/triage/stream/{assessment.id}'))
+        flask = self.client.get('/api/health', headers={'Origin': 'https://portal.example'})
+
+        self.assertEqual(stream.headers['access-control-allow-origin'],
+                         flask.headers['Access-Control-Allow-Origin'])
+        self.assertIn('session=', stream.headers['set-cookie'])
+        self.assertEqual(stream.headers['content-type'], 'text/event-stream; charset=utf-8')
+
+    def test_wsgi_environ_from_asgi_scope(self):
+        """Test that the adapter builds a PEP 3333 environ from the ASGI scope."""
+        import io
+        from wsgi_adapter import build_environ
+        scope = {
+            'type': 'http', 'method': 'GET', 'http_version': '1.1', 'scheme': 'https',
+            'root_path': '/triage', 'path': '/triage/api/health', 'query_string': b'a=1',
+            'server': ('example.nhs.uk', 443), 'client': ('10.0.0.7', 50000),
+            'headers': [(b'content-type', b'text/plain'), (b'accept', b'text/html'), (b'accept', b'*/*')],
+        }
+        
+        environ = build_environ(scope, io.BytesIO())
+        
+        self.assertEqual((environ['SCRIPT_NAME'], environ['PATH_INFO']), ('/triage', '/api/health'))
+        self.assertEqual(environ['QUERY_STRING'], 'a=1')
+        self.assertEqual(environ['REMOTE_ADDR'], '10.0.0.7')
+        self.assertEqual((environ['SERVER_NAME'], environ['SERVER_PORT']), ('example.nhs.uk', '443'))
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'text/html,*/*')
+        self.assertEqual(environ['wsgi.url_scheme'], 'https')
+
+    def test_lifespan_starts_background_services(self):
+        """Test that background threads start with the server, not when the app is created."""
+        import asyncio
+        from unittest import mock
+        from asgi import TriageASGIApp
+
+        for key in ('OLLAMA_MONITOR_ENABLED', 'RETENTION_ENABLED', 'WARMUP_ENABLED'):
+            self.app.config[key] = True
+        services = [self.app.extensions[name] for name in ('ollama_pool', 'retention_job', 'model_warmer')]
+        for service in services:
+            service.start = mock.Mock()
+            service.stop = mock.Mock()
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(TriageASGIApp(self.app)({'type': 'lifespan'}, receive, send))
+
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        for service in services:
+            service.start.assert_called_once_with()
+            service.stop.assert_called_once()
+
+    def test_lifespan_stops_background_services_before_closing_clients(self):
+        """Test that no monitor or warm-up thread is left using a closed client at shutdown."""
+        import asyncio
+        from unittest import mock
+        from asgi import TriageASGIApp
+
+        clients = self.app.extensions['ollama_http']
+        closed_at_stop = []
+        for name in ('ollama_pool', 'retention_job', 'model_warmer'):
+            self.app.extensions[name].stop = mock.Mock(
+                side_effect=lambda *args, **kwargs: closed_at_stop.append(clients.sync.is_closed))
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            pass
+
+        asyncio.run(TriageASGIApp(self.app)({'type': 'lifespan'}, receive, send))
+
+        self.assertEqual(closed_at_stop, [False, False, False])
+        self.assertTrue(clients.sync.is_closed)
+
+class GenerationSchedulerTestCase(unittest.TestCase):
+    """Test case for generation admission control."""
+    
+    def test_fifo_queue_and_release(self):
+        """Test that waiting tickets are granted in arrival order."""
+        from generation_scheduler import GenerationScheduler
+        scheduler = GenerationScheduler(max_in_flight=1, max_queue=5)
+        
+        first = scheduler.submit('triage')
+        second = scheduler.submit('chat')
+        third = scheduler.submit('chat')
+        
+        self.assertTrue(first.granted)
+        self.assertEqual((second.position, third.position), (1, 2))
+        
+        scheduler.release(first)
+        self.assertTrue(second.granted)
+        self.assertFalse(third.granted)
+        self.assertEqual(third.position, 1)
+        
+        scheduler.release(second)
+        scheduler.release(second)  # idempotent
+        self.assertTrue(third.granted)
+        self.assertEqual(scheduler.stats()['in_flight'], 1)
+    
+    def test_emergencies_jump_the_queue(self):
+        """Test that emergency generations are granted before earlier routine work."""
+        from generation_scheduler import (
+            GenerationScheduler, PRIORITY_EMERGENCY, PRIORITY_TRIAGE, PRIORITY_CHAT
+        )
+        scheduler = GenerationScheduler(max_in_flight=1, max_queue=5)
+        running = scheduler.submit('chat', PRIORITY_CHAT)
+        chat = scheduler.submit('chat', PRIORITY_CHAT)
+        triage = scheduler.submit('triage', PRIORITY_TRIAGE)
+        emergency = scheduler.submit('triage', PRIORITY_EMERGENCY)
+        
+        self.assertEqual((emergency.position, triage.position, chat.position), (1, 2, 3))
+        scheduler.release(running)
+        self.assertTrue(emergency.granted)
+        scheduler.release(emergency)
+        self.assertTrue(triage.granted)
+        self.assertFalse(chat.granted)
+    
+    def test_chat_ages_ahead_of_newer_triage(self):
+        """Test that a chat waiting longer than the aging window is not starved."""
+        from generation_scheduler import GenerationScheduler, PRIORITY_TRIAGE, PRIORITY_CHAT
+        scheduler = GenerationScheduler(max_in_flight=1, max_queue=5, aging_seconds=0.05)
+        running = scheduler.submit('chat', PRIORITY_CHAT)
+        chat = scheduler.submit('chat', PRIORITY_CHAT)
+        time.sleep(0.1)
+        triage = scheduler.submit('triage', PRIORITY_TRIAGE)
+        
+        scheduler.release(running)
+        
+        self.assertTrue(chat.granted)
+        self.assertFalse(triage.granted)
+    
+    def test_emergency_admitted_when_queue_full(self):
+        """Test that admission control never turns away an emergency."""
+        from generation_scheduler import GenerationScheduler, PRIORITY_EMERGENCY
+        scheduler = GenerationScheduler(max_in_flight=1, max_queue=0)
+        scheduler.submit()
+        
+        self.assertTrue(scheduler.has_capacity(PRIORITY_EMERGENCY))
+        self.assertEqual(scheduler.submit('triage', PRIORITY_EMERGENCY).position, 1)
+    
+    def test_emergency_overflow_is_bounded(self):
+        """Test that the emergency lane cannot grow the queue without limit."""
+        from generation_scheduler import GenerationScheduler, GenerationQueueFull, PRIORITY_EMERGENCY
+        scheduler = GenerationScheduler(max_in_flight=1, max_queue=1, max_emergency_overflow=2)
+        scheduler.submit()
+        for _ in range(3):
+            scheduler.submit('triage', PRIORITY_EMERGENCY)
+        
+        self.assertFalse(scheduler.has_capacity(PRIORITY_EMERGENCY))
+        with self.assertRaises(GenerationQueueFull):
+            scheduler.submit('triage', PRIORITY_EMERGENCY)
+    
+    def test_full_queue_rejects_with_retry_after(self):
+        """Test that admission fails once the queue is full."""
+        from generation_scheduler import GenerationScheduler, GenerationQueueFull
+        scheduler = GenerationScheduler(max_in_flight=1, max_queue=1, default_retry_after=7)
+        scheduler.submit()
+        scheduler.submit()
+        
+        with self.assertRaises(GenerationQueueFull) as ctx:
+            scheduler.submit()
+        
+        self.assertEqual(ctx.exception.retry_after, 7)
+        self.assertFalse(scheduler.has_capacity())
+        self.assertEqual(scheduler.stats()['rejected'], 1)
+    
+    def test_abandoned_ticket_leaves_queue(self):
+        """Test that releasing a waiting ticket removes it without using a slot."""
+        from generation_scheduler import GenerationScheduler
+        scheduler = GenerationScheduler(max_in_flight=1, max_queue=5)
+        running = scheduler.submit()
+        waiting = scheduler.submit()
+        
+        scheduler.release(waiting)
+        stats = scheduler.stats()
+        
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['abandoned'], 1)
+        self.assertTrue(running.granted)
+
+class GenerationAdmissionTestCase(MockOllamaTestCase):
+    """Test case for queue admission on the streaming endpoints."""
+    
+    def fill_queue(self):
+        from generation_scheduler import GenerationScheduler
+        scheduler = GenerationScheduler(max_in_flight=1, max_queue=0, default_retry_after=12)
+        self.app.extensions['generation_scheduler'] = scheduler
+        return scheduler, scheduler.submit('chat')
+    
+    def test_stream_rejected_with_retry_after_when_full(self):
+        """Test that a full queue returns 503 with Retry-After."""
+        assessment = self.create_assessment()
+        self.fill_queue()
+        
+        response = self.client.get(f'/api/triage/stream/{assessment.id}')
+        
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '12')
+    
+    def test_emergency_flood_rejected_with_retry_after(self):
+        """Test that severity 8+ submissions cannot queue without limit."""
+        from generation_scheduler import GenerationScheduler, PRIORITY_EMERGENCY
+        scheduler = GenerationScheduler(max_in_flight=1, max_queue=0, default_retry_after=12,
+                                        max_emergency_overflow=3)
+        self.app.extensions['generation_scheduler'] = scheduler
+        scheduler.submit('chat')
+        for _ in range(3):
+            scheduler.submit('triage', PRIORITY_EMERGENCY)
+        assessment = self.create_assessment('Headache', 9)
+        
+        response = self.client.get(f'/api/triage/stream/{assessment.id}')
+        
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '12')
+    
+    def test_queued_stream_reports_position(self):
+        """Test that a queued request is told its place before generating."""
+        import threading
+        from generation_scheduler import GenerationScheduler
+        scheduler = GenerationScheduler(max_in_flight=1, max_queue=5)
+        self.app.extensions['generation_scheduler'] = scheduler
+        busy = scheduler.submit('chat')
+        threading.Timer(0.2, scheduler.release, args=(busy,)).start()
+        self.ollama_body = b'{"response": "ok", "done": true}\n'
+        assessment = self.create_assessment()
+        
+        body = self.client.get(f'/api/triage/stream/{assessment.id}').get_data(as_text=True)
+        
+        self.assertLess(body.index('"queue_position": 1'), body.index('"chunk": "ok"'))
+    
+    def test_severe_triage_uses_emergency_lane(self):
+        """Test that severity and red-flag symptoms pick the emergency lane."""
+        from app import generation_priority
+        from generation_scheduler import PRIORITY_EMERGENCY, PRIORITY_TRIAGE
+        
+        self.assertEqual(generation_priority('triage', self.create_assessment('Headache', 4)), PRIORITY_TRIAGE)
+        self.assertEqual(generation_priority('triage', self.create_assessment('Headache', 9)), PRIORITY_EMERGENCY)
+        self.assertEqual(generation_priority('triage', self.create_assessment('Chest pain', 3)), PRIORITY_EMERGENCY)
+    
+    def test_additional_symptoms_string_is_one_symptom(self):
+        """Test that a bare string is matched as a symptom, not letter by letter."""
+        from app import triage_priority
+        from generation_scheduler import PRIORITY_EMERGENCY, PRIORITY_TRIAGE
+        
+        self.assertEqual(triage_priority('Headache', 3, 'chest pain'), PRIORITY_EMERGENCY)
+        self.assertEqual(triage_priority('Headache', 3, 'c'), PRIORITY_TRIAGE)
+        self.assertEqual(triage_priority('Headache', 3, {'chest': 'pain'}), PRIORITY_TRIAGE)
+    
+    def test_stream_releases_slot_when_done(self):
+        """Test that a finished stream hands its slot back."""
+        self.ollama_body = b'{"response": "ok", "done": true}\n'
+        assessment = self.create_assessment()
+        
+        self.client.get(f'/api/triage/stream/{assessment.id}').get_data()
+        
+        stats = self.app.extensions['generation_scheduler'].stats()
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['completed'], 1)
+    
+    def test_queue_metrics_endpoint(self):
+        """Test that queue depth and wait time are exposed as metrics."""
+        response = self.client.get('/api/metrics')
+        data = json.loads(response.data)
+        
+        self.assertIn('queue_depth', data['generation_queue'])
+        self.assertIn('wait_seconds_p95', data['generation_queue'])
+
+class NDJSONDecoderTestCase(unittest.TestCase):
+    """Test case for the incremental NDJSON stream decoder."""
+    
+    def test_partial_lines_are_buffered(self):
+        """Test that objects split across chunks are decoded once complete."""
+        from ollama_client import NDJSONDecoder
+        decoder = NDJSONDecoder()
+        chunks = ['{"response": "a"}\n{"resp', 'onse": "b"', '}\n{"done": true}']
+        
+        objects = list(decoder.iter_objects(chunks))
+        
+        self.assertEqual(objects, [{'response': 'a'}, {'response': 'b'}, {'done': True}])
+        self.assertEqual(decoder.malformed, 0)
+    
+    def test_malformed_lines_are_counted(self):
+        """Test that garbage lines are skipped and counted."""
+        from ollama_client import NDJSONDecoder
+        decoder = NDJSONDecoder()
+        
+        objects = list(decoder.iter_objects(['not json\n[1, 2]\n{"ok": 1}\n']))
+        
+        self.assertEqual(objects, [{'ok': 1}])
+        self.assertEqual(decoder.malformed, 2)
+    
+    def test_oversized_line_is_dropped(self):
+        """Test that the partial-line buffer is bounded."""
+        from ollama_client import NDJSONDecoder
+        decoder = NDJSONDecoder(max_line_length=10)
+        
+        objects = list(decoder.iter_objects(['{"response": ', '"' + 'x' * 20, '"}\n{"ok": 1}\n']))
+        
+        self.assertEqual(objects, [{'ok': 1}])
+        self.assertEqual(decoder.oversized, 1)
+
+    def test_oversized_line_completed_in_next_chunk_is_dropped(self):
+        """Test that the limit covers the buffered prefix plus the final piece."""
+        from ollama_client import NDJSONDecoder
+        decoder = NDJSONDecoder(max_line_length=20)
+
+        objects = list(decoder.iter_objects(['{"response": "', 'x' * 15 + '"}\n{"ok": 1}\n']))
+
+        self.assertEqual(objects, [{'ok': 1}])
+        self.assertEqual(decoder.oversized, 1)
+
+    def test_oversized_line_within_one_chunk_is_dropped(self):
+        """Test that a complete oversized line is counted, not decoded."""
+        from ollama_client import NDJSONDecoder
+        decoder = NDJSONDecoder(max_line_length=10)
+
+        objects = list(decoder.iter_objects(['{"response": "xxxxxxxx"}\n{"ok": 1}\n']))
+
+        self.assertEqual(objects, [{'ok': 1}])
+        self.assertEqual(decoder.oversized, 1)
+
+class ResponseCacheTestCase(MockOllamaTestCase):
+    """Test case for the deterministic triage response cache."""
+    
+    def test_key_ignores_whitespace_but_not_model_or_options(self):
+        """Test that cache keys are normalised but content-addressed."""
+        from response_cache import ResponseCache
+        key = ResponseCache.make_key('Severity:  4/10\n', 'llama3.2:3b', {'temperature': 0.3})
+        
+        self.assertEqual(key, ResponseCache.make_key('Severity: 4/10', 'llama3.2:3b', {'temperature': 0.3}))
+        self.assertNotEqual(key, ResponseCache.make_key('Severity: 4/10', 'llama3.2:1b', {'temperature': 0.3}))
+        self.assertNotEqual(key, ResponseCache.make_key('Severity: 4/10', 'llama3.2:3b', {'temperature': 0.7}))
+    
+    def test_lru_eviction_respects_byte_cap(self):
+        """Test that the least recently used entries are evicted first."""
+        from response_cache import ResponseCache
+        cache = ResponseCache(max_bytes=10)
+        cache.put('a', 'aaaa')
+        cache.put('b', 'bbbb')
+        cache.get('a')
+        cache.put('c', 'cccc')
+        
+        self.assertEqual(cache.get('a'), 'aaaa')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['bytes'], 8)
+        self.assertEqual(cache.evictions, 1)
+        self.assertFalse(cache.put('d', 'x' * 11))
+    
+    def test_expired_entries_are_misses(self):
+        """Test that entries older than the TTL are dropped."""
+        from response_cache import ResponseCache
+        cache = ResponseCache(ttl=0.0)
+        cache.put('a', 'text')
+        time.sleep(0.01)
+        
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache.expirations, 1)
+    
+    def test_identical_triage_is_replayed_without_ollama(self):
+        """Test that a repeat submission is served from the cache."""
+        self.ollama_body = b'{"response": "See your GP.", "done": true}\n'
+        first = self.create_assessment()
+        self.client.get(f'/api/triage/stream/{first.id}').get_data()
+        generate_calls = len(self.ollama_requests)
+        
+        second = self.create_assessment()
+        body = self.client.get(f'/api/triage/stream/{second.id}').get_data(as_text=True)
+        
+        self.assertIn('"chunk": "See your GP."', body)
+        self.assertIn('"done": true', body)
+        self.assertEqual(len(self.ollama_requests), generate_calls)
+        self.assertEqual(db.session.get(TriageAssessment, second.id).ai_response, 'See your GP.')
+        
+        stats = self.client.get('/api/metrics').get_json()['response_cache']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+    
+    def test_async_path_replays_cached_triage(self):
+        """Test that the ASGI path serves cache hits with the same wire format."""
+        self.ollama_body = b'{"response": "See your GP.", "done": true}\n'
+        first = self.create_assessment()
+        self.client.get(f'/api/triage/stream/{first.id}').get_data()
+        self.app.extensions['ollama_pool'].hosts[0].monitor._record(False, 'down')
+        
+        second = self.create_assessment()
+        response = self.asgi_get(f'/api/triage/stream/{second.id}')
+        
+        self.assertEqual(response.text, (
+            'data: {"chunk": "See your GP."}\n\n'
+            'data: {"done": true}\n\n'
+            'data: [DONE]\n\n'
+        ))
+    
+    def test_different_symptoms_and_chat_are_not_shared(self):
+        """Test that only identical triage prompts hit the cache."""
+        self.ollama_body = b'{"response": "Rest.", "done": true}\n'
+        self.client.get(f'/api/triage/stream/{self.create_assessment().id}').get_data()
+        self.client.get(f'/api/triage/stream/{self.create_assessment(severity=5).id}').get_data()
+        
+        stats = self.app.extensions['response_cache'].stats()
+        self.assertEqual((stats['hits'], stats['entries']), (0, 2))
+
+class EarlyUrgencyTestCase(MockOllamaTestCase):
+    """Test case for urgency surfaced while the triage answer streams."""
+    
+    EMERGENCY_BODY = (
+        b'{"response": "**URGENCY LEVEL:** Emer"}\n{"response": "gency\\n"}\n'
+        b'{"response": "Call 999 now."}\n{"response": " Chest pain can be serious.", "done": true}\n'
+    )
+    
+    def test_urgency_event_precedes_remaining_tokens(self):
+        """Test that the urgency event is sent as soon as the header resolves."""
+        self.ollama_body = self.EMERGENCY_BODY
+        assessment = self.create_assessment(primary_symptom='Chest pain')
+        
+        response = self.client.get(f'/api/triage/stream/{assessment.id}')
+        events = [line for line in response.get_data(as_text=True).split('\n\n') if line]
+        
+        self.assertEqual(events[2], 'data: {"urgency": "Emergency"}')
+        self.assertEqual(events[3], 'data: {"chunk": "Call 999 now."}')
+        stored = db.session.get(TriageAssessment, assessment.id)
+        self.assertEqual((stored.urgency_level, stored.confidence_score), ('Emergency', 0.95))
+        self.assertTrue(SystemLog.query.filter(SystemLog.message.like('Emergency urgency detected%')).first())
+    
+    def test_urgency_persisted_before_stream_completes(self):
+        """Test that the level is stored even if the stream is cut short."""
+        self.ollama_body = self.EMERGENCY_BODY.rsplit(b'\n', 2)[0] + b'\n'
+        assessment = self.create_assessment(primary_symptom='Chest pain')
+        
+        body = self.client.get(f'/api/triage/stream/{assessment.id}').get_data(as_text=True)
+        
+        self.assertIn('Incomplete AI response', body)
+        db.session.expire_all()
+        stored = db.session.get(TriageAssessment, assessment.id)
+        self.assertEqual(stored.urgency_level, 'Emergency')
+        self.assertIsNone(stored.ai_response)
+    
+    def test_async_path_emits_urgency_event(self):
+        """Test that the ASGI path surfaces and stores the urgency too."""
+        self.ollama_body = self.EMERGENCY_BODY
+        assessment = self.create_assessment(primary_symptom='Chest pain')
+        
+        response = self.asgi_get(f'/api/triage/stream/{assessment.id}')
+        
+        self.assertIn('data: {"urgency": "Emergency"}\n\ndata: {"chunk": "Call 999 now."}', response.text)
+        db.session.expire_all()
+        self.assertEqual(db.session.get(TriageAssessment, assessment.id).urgency_level, 'Emergency')
+    
+    def test_chat_streams_have_no_urgency_event(self):
+        """Test that chat answers are not classified mid-stream."""
+        from app import GenerationStream
+        stream = GenerationStream(1, 'chat')
+        
+        events = stream.feed(self.EMERGENCY_BODY.decode())
+        
+        self.assertFalse(any('urgency' in event for event in events))
+
+class StaffDashboardQueryTestCase(MockOllamaTestCase):
+    """Test case for the keyset-paginated staff dashboard query."""
+    
+    def add_assessments(self, count, **fields):
+        base = datetime(2025, 1, 1, 12, 0, 0)
+        assessments = []
+        for i in range(count):
+            assessment = self.create_assessment()
+            for name, value in fields.items():
+                setattr(assessment, name, value)
+            assessment.created_at = base + timedelta(minutes=i // 2)  # pairs share a timestamp
+            assessments.append(assessment)
+        db.session.commit()
+        return assessments
+    
+    def test_dashboard_renders_with_one_query(self):
+        """Test that patient details do not trigger a query per row."""
+        self.add_assessments(6)
+        db.session.expunge_all()
+        
+        queries = self.count_queries(lambda: self.assertEqual(self.client.get('/staff-dashboard').status_code, 200))
+        
+        self.assertLessEqual(queries, 2)
+    
+    def test_keyset_pages_cover_every_row_once(self):
+        """Test that paging by (created_at, id) neither skips nor repeats rows."""
+        from app import staff_dashboard_page, decode_dashboard_cursor
+        expected = [a.id for a in reversed(self.add_assessments(7))]
+        
+        seen, cursor = [], None
+        while True:
+            page, cursor = staff_dashboard_page(before=decode_dashboard_cursor(cursor), limit=3)
+            seen.extend(row.id for row in page)
+            if not cursor:
+                break
+        
+        self.assertEqual(seen, expected)
+        self.assertEqual(page[0].patient.first_name, 'Stream')
+    
+    def test_filters_apply_in_the_query(self):
+        """Test urgency and category filters, including unclassified as Standard."""
+        from app import staff_dashboard_page
+        self.add_assessments(2, urgency_level='Emergency')
+        self.add_assessments(1, urgency_level='Urgent', symptom_category='skin')
+        self.add_assessments(1)
+        
+        self.assertEqual(len(staff_dashboard_page(urgency='Emergency')[0]), 2)
+        self.assertEqual(len(staff_dashboard_page(category='skin')[0]), 1)
+        self.assertEqual(len(staff_dashboard_page(urgency='Standard')[0]), 1)
+        
+        body = self.client.get('/staff-dashboard?urgency=Urgent&before=garbage').get_data(as_text=True)
+        self.assertEqual(body.count('<tr data-assessment-id='), 1)
+    
+    def test_older_link_carries_filters(self):
+        """Test that the pagination link keeps the active filters."""
+        self.add_assessments(55, urgency_level='Emergency')
+        
+        body = self.client.get('/staff-dashboard?urgency=Emergency').get_data(as_text=True)
+        
+        self.assertEqual(body.count('<tr data-assessment-id='), 50)
+        self.assertIn('Older', body)
+        self.assertIn('urgency=Emergency', body)
+
+class DashboardEventsTestCase(MockOllamaTestCase):
+    """Test case for the live dashboard event feed."""
+    
+    def test_subscriber_receives_only_new_events(self):
+        """Test that a subscriber gets events published after it joined."""
+        from event_bus import EventBus
+        bus = EventBus()
+        bus.publish('assessment_created', {'id': 1})
+        subscription = bus.subscribe()
+        
+        bus.publish('assessment_created', {'id': 2})
+        
+        self.assertEqual([event.data['id'] for event in subscription.get(timeout=0)], [2])
+        self.assertEqual(subscription.get(timeout=0), [])
+    
+    def test_reconnect_resumes_from_last_event_id(self):
+        """Test that Last-Event-ID replays only the missed events."""
+        from event_bus import EventBus
+        bus = EventBus()
+        seen = bus.publish('assessment_created', {'id': 1})
+        bus.publish('assessment_created', {'id': 2})
+        bus.publish('assessment_updated', {'id': 1})
+        
+        events = bus.subscribe(seen.id).drain()
+        
+        self.assertEqual([(event.type, event.data['id']) for event in events],
+                         [('assessment_created', 2), ('assessment_updated', 1)])
+    
+    def test_unknown_or_expired_id_requests_resync(self):
+        """Test that ids from another process or beyond the history resync."""
+        from event_bus import EventBus, RESYNC
+        bus = EventBus(history=2)
+        first = bus.publish('assessment_created', {'id': 1})
+        for i in range(2, 5):
+            bus.publish('assessment_created', {'id': i})
+        
+        self.assertEqual([e.type for e in bus.subscribe(first.id).drain()], [RESYNC])
+        self.assertEqual([e.type for e in bus.subscribe('deadbeef-3').drain()], [RESYNC])
+    
+    def test_slow_subscriber_is_told_to_resync(self):
+        """Test that a subscriber's backlog is bounded."""
+        from event_bus import EventBus, RESYNC
+        bus = EventBus(max_pending=3)
+        subscription = bus.subscribe()
+        
+        for i in range(10):
+            bus.publish('assessment_created', {'id': i})
+        
+        self.assertEqual([event.type for event in subscription.drain()], [RESYNC])
+    
+    def test_new_assessment_is_published_with_row_html(self):
+        """Test that a created assessment is pushed as a rendered table row."""
+        from app import publish_assessment_created
+        subscription = self.app.extensions['event_bus'].subscribe()
+        assessment = self.create_assessment(primary_symptom='Chest pain')
+        
+        publish_assessment_created(assessment, assessment.patient)
+        
+        event, = subscription.drain()
+        self.assertEqual(event.type, 'assessment_created')
+        self.assertEqual(event.data['id'], assessment.id)
+        self.assertIn(f'<tr data-assessment-id="{assessment.id}"', event.data['html'])
+        self.assertIn('Chest pain', event.data['html'])
+    
+    def test_urgency_change_is_published_once(self):
+        """Test that a changed level is pushed and an unchanged one is not."""
+        from app import save_urgency_level
+        from urgency_classifier import UrgencyResult
+        subscription = self.app.extensions['event_bus'].subscribe()
+        assessment = self.create_assessment()
+        
+        save_urgency_level(assessment.id, UrgencyResult('Urgent', 0.95, 'header'))
+        save_urgency_level(assessment.id, UrgencyResult('Urgent', 0.95, 'header'))
+        
+        events = subscription.drain()
+        self.assertEqual([(e.type, e.data['urgency_level']) for e in events], [('assessment_updated', 'Urgent')])
+    
+    def test_stream_endpoint_replays_and_stops_on_resync(self):
+        """Test the SSE wire format of the dashboard feed."""
+        bus = self.app.extensions['event_bus']
+        seen = bus.publish('assessment_created', {'id': 1})
+        bus.publish('assessment_updated', {'id': 1, 'urgency_level': 'Urgent'})
+        
+        response = self.client.get('/api/dashboard/stream', headers={'Last-Event-ID': seen.id})
+        chunks = iter(response.response)
+        self.assertEqual(next(chunks), b'retry: 5000\n\n')
+        self.assertIn(b'event: assessment_updated\n', next(chunks))
+        response.close()
+        
+        body = self.client.get('/api/dashboard/stream?last_event_id=old-1').get_data(as_text=True)
+        self.assertIn('event: resync', body)
+        self.assertEqual(bus.stats()['subscribers'], 0)
+    
+    def test_dashboard_page_carries_resume_cursor(self):
+        """Test that an event published after the page render reaches its first connect."""
+        bus = self.app.extensions['event_bus']
+        bus.publish('assessment_created', {'id': 1})
+        
+        page = self.client.get('/staff-dashboard').get_data(as_text=True)
+        cursor = bus.latest_id()
+        self.assertIn(json.dumps(cursor), page)
+        missed = bus.publish('assessment_created', {'id': 2})
+        
+        response = self.client.get(f'/api/dashboard/stream?last_event_id={cursor}')
+        chunks = iter(response.response)
+        next(chunks)
+        self.assertIn(f'id: {missed.id}\n'.encode(), next(chunks))
+        response.close()
+    
+    def test_empty_bus_cursor_resumes_from_first_event(self):
+        """Test that the cursor of a page rendered before any event misses nothing."""
+        from event_bus import EventBus
+        bus = EventBus()
+        cursor = bus.latest_id()
+        bus.publish('assessment_created', {'id': 1})
+        
+        self.assertEqual([event.data['id'] for event in bus.subscribe(cursor).drain()], [1])
+    
+    def test_wsgi_dashboard_streams_are_capped(self):
+        """Test that streams beyond DASHBOARD_MAX_STREAMS are refused until one closes."""
+        import threading
+        self.app.extensions['dashboard_streams'] = threading.BoundedSemaphore(1)
+        
+        first = self.client.get('/api/dashboard/stream')
+        refused = self.client.get('/api/dashboard/stream')
+        self.assertEqual(refused.status_code, 503)
+        self.assertIn('Retry-After', refused.headers)
+        
+        first.close()
+        first.close()
+        second = self.client.get('/api/dashboard/stream')
+        self.assertEqual(second.status_code, 200)
+        second.close()
+    
+    def test_wsgi_dashboard_stream_is_recycled(self):
+        """Test that a WSGI feed ends after DASHBOARD_STREAM_MAX_AGE, freeing its thread."""
+        self.app.config['DASHBOARD_STREAM_MAX_AGE'] = 0.05
+        
+        body = self.client.get('/api/dashboard/stream').get_data(as_text=True)
+        
+        self.assertTrue(body.startswith('retry: 5000\n\n'))
+        self.assertEqual(self.app.extensions['event_bus'].stats()['subscribers'], 0)
+    
+    def test_async_stream_endpoint_stops_on_resync(self):
+        """Test that the ASGI dashboard feed serves the same events."""
+        response = self.asgi_get('/api/dashboard/stream?last_event_id=old-1')
+        
+        self.assertEqual(response.headers['content-type'].split(';')[0], 'text/event-stream')
+        self.assertTrue(response.text.startswith('retry: 5000\n\n'))
+        self.assertIn('event: resync', response.text)
+
+class DataExportTestCase(NHSTriageTestCase):
+    """Test case for the streaming data export."""
+    
+    def add_patients(self, count):
+        for i in range(count):
+            patient = Patient(session_id=f'export-{i}', first_name='Export', last_name=f'Patient{i}',
+                              age=30 + i, gender='female')
+            db.session.add(patient)
+            db.session.flush()
+            db.session.add(TriageAssessment(session_id=patient.session_id, patient_id=patient.id,
+                                            symptom_category='pain', primary_symptom='Headache',
+                                            severity=i % 10 + 1, duration='today', urgency_level='Standard'))
+        db.session.commit()
+        db.session.expunge_all()
+    
+    def test_json_export_matches_document_shape(self):
+        """Test that the incremental JSON writer produces the original document."""
+        import io
+        from data_export import iter_patients, iter_assessments, write_json
+        self.add_patients(5)
+        stream = io.StringIO()
+        
+        write_json(stream, iter_patients(2), iter_assessments(2), '2025-01-01T00:00:00')
+        
+        data = json.loads(stream.getvalue())
+        self.assertEqual(data['export_timestamp'], '2025-01-01T00:00:00')
+        self.assertEqual(len(data['patients']), 5)
+        self.assertEqual(data['assessments'][4]['patient']['name'], 'Export Patient4')
+    
+    def test_empty_json_export_is_valid(self):
+        """Test that an empty database still exports valid JSON."""
+        import io
+        from data_export import iter_patients, iter_assessments, write_json
+        stream = io.StringIO()
+        
+        write_json(stream, iter_patients(), iter_assessments(), 'now')
+        
+        self.assertEqual(json.loads(stream.getvalue())['patients'], [])
+    
+    def test_assessment_export_query_count_is_flat(self):
+        """Test that patients are joined rather than lazy-loaded per row."""
+        import io
+        from data_export import iter_assessments, write_csv
+        self.add_patients(12)
+        stream = io.StringIO()
+        
+        queries = self.count_queries(lambda: write_csv(stream, iter_assessments(5)))
+        
+        self.assertLessEqual(queries, 2)
+        self.assertEqual(len(stream.getvalue().splitlines()), 13)
+        self.assertIn('Export Patient11,41,female,Headache', stream.getvalue())
+    
+    def test_gzipped_jsonl_round_trip(self):
+        """Test that JSON Lines output can be compressed and read back."""
+        import gzip
+        from data_export import iter_patients, iter_assessments, open_export, write_jsonl
+        self.add_patients(3)
+        path = self.db_path + '.jsonl.gz'
+        
+        try:
+            with open_export(path, compress=True) as stream:
+                write_jsonl(stream, iter_patients(), iter_assessments())
+            with gzip.open(path, 'rt') as f:
+                records = [json.loads(line) for line in f]
+        finally:
+            os.unlink(path)
+        
+        self.assertEqual([r['type'] for r in records], ['patient'] * 3 + ['assessment'] * 3)
+    
+    def export_columnar(self, model, output_format, **kwargs):
+        from data_export import write_columnar
+        path = f'{self.db_path}.{output_format}'
+        self.addCleanup(os.unlink, path)
+        return path, write_columnar(model, path, output_format, **kwargs)
+    
+    @unittest.skipUnless(HAS_PYARROW, 'pyarrow not installed')
+    def test_parquet_export_has_typed_columns(self):
+        """Test categorical and list columns, with one row group per batch."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.add_patients(5)
+        TriageAssessment.query.first().additional_symptoms = ['Nausea', 'Fever']
+        db.session.commit()
+        
+        path, (rows, latest) = self.export_columnar(TriageAssessment, 'parquet', batch_size=2)
+        
+        table = pq.read_table(path)
+        self.assertEqual(rows, 5)
+        self.assertEqual(pq.ParquetFile(path).num_row_groups, 3)
+        self.assertTrue(pa.types.is_dictionary(table.schema.field('urgency_level').type))
+        self.assertEqual(table.column('additional_symptoms').to_pylist()[0], ['Nausea', 'Fever'])
+        self.assertEqual(table.schema.field('created_at').type, pa.timestamp('us', tz='UTC'))
+        self.assertIsNotNone(latest)
+    
+    @unittest.skipUnless(HAS_PYARROW, 'pyarrow not installed')
+    def test_arrow_export_with_new_categories_per_batch(self):
+        """Test that categories first seen in later batches are kept."""
+        import pyarrow as pa
+        self.add_patients(4)
+        for assessment, level in zip(TriageAssessment.query.order_by(TriageAssessment.id),
+                                     ['Standard', 'Urgent', None, 'Emergency']):
+            assessment.urgency_level = level
+        db.session.commit()
+        
+        path, _ = self.export_columnar(TriageAssessment, 'arrow', batch_size=1)
+        
+        table = pa.ipc.open_file(path).read_all()
+        self.assertEqual(table.column('urgency_level').to_pylist(), ['Standard', 'Urgent', None, 'Emergency'])
+    
+    @unittest.skipUnless(HAS_PYARROW, 'pyarrow not installed')
+    def test_incremental_columnar_export(self):
+        """Test that ``since`` only exports rows changed from that time."""
+        import pyarrow.parquet as pq
+        self.add_patients(3)
+        old, recent = datetime(2025, 1, 1), datetime(2025, 6, 1)
+        for patient, changed in zip(Patient.query.order_by(Patient.id), [old, recent, recent]):
+            patient.updated_at = changed
+        db.session.commit()
+        
+        path, (rows, latest) = self.export_columnar(Patient, 'parquet', since=datetime(2025, 3, 1))
+        
+        self.assertEqual(rows, 2)
+        self.assertEqual(latest, recent)
+        self.assertEqual(pq.read_table(path).column('last_name').to_pylist(), ['Patient1', 'Patient2'])
+    
+    @unittest.skipUnless(HAS_PYARROW, 'pyarrow not installed')
+    def test_chained_incremental_exports_have_no_duplicates_or_gaps(self):
+        """Test that each table's watermark picks up exactly the rows changed since."""
+        import pyarrow.parquet as pq
+        from data_export import write_columnar
+        path = f'{self.db_path}.parquet'
+        self.addCleanup(os.unlink, path)
+        watermarks, exported = {}, {Patient: [], TriageAssessment: []}
+        
+        def export_all():
+            for model in exported:
+                _, watermarks[model] = write_columnar(model, path, since=watermarks.get(model))
+                exported[model] += pq.read_table(path).column('id').to_pylist()
+        
+        self.add_patients(2)
+        for patient in Patient.query:
+            patient.updated_at = datetime(2025, 5, 1)
+        for assessment in TriageAssessment.query:
+            assessment.updated_at = datetime(2025, 2, 1)
+        db.session.commit()
+        export_all()
+        
+        # Assessments keep changing at times before the patients' watermark
+        patient = Patient(session_id='export-late', first_name='Export', last_name='Late', age=50,
+                          gender='male', updated_at=datetime(2025, 5, 2))
+        db.session.add(patient)
+        db.session.flush()
+        db.session.add(TriageAssessment(session_id=patient.session_id, patient_id=patient.id,
+                                        primary_symptom='Cough', severity=2, duration='today',
+                                        updated_at=datetime(2025, 3, 1)))
+        db.session.commit()
+        export_all()
+        export_all()
+        
+        self.assertEqual(exported[Patient], [patient.id for patient in Patient.query.order_by(Patient.id)])
+        self.assertEqual(exported[TriageAssessment],
+                         [assessment.id for assessment in TriageAssessment.query.order_by(TriageAssessment.id)])
+        self.assertEqual(watermarks, {Patient: datetime(2025, 5, 2), TriageAssessment: datetime(2025, 3, 1)})
+    
+    def test_columnar_export_needs_pyarrow(self):
+        """Test that a missing pyarrow is reported clearly."""
+        from unittest import mock
+        import data_export
+        
+        with mock.patch.object(data_export, 'pa', None):
+            with self.assertRaisesRegex(RuntimeError, 'pyarrow'):
+                data_export.write_columnar(Patient, self.db_path + '.parquet')
+    
+    def test_count_rows_honours_since(self):
+        """Test that the progress total counts the same rows an incremental export writes."""
+        from data_export import count_rows
+        self.add_patients(3)
+        for patient, changed in zip(Patient.query.order_by(Patient.id), [1, 6, 6]):
+            patient.updated_at = datetime(2025, changed, 1)
+        db.session.commit()
+        
+        self.assertEqual(count_rows(Patient), 3)
+        self.assertEqual(count_rows(Patient, datetime(2025, 3, 1)), 2)
+
+    def test_migration_indexes_the_incremental_export_column(self):
+        """Test that an existing database gets the updated_at indexes --since filters on."""
+        from sqlalchemy import inspect
+        from app import migrate_database
+        for model in (Patient, TriageAssessment):
+            index, = [index for index in model.__table__.indexes if index.name.endswith('_updated_at')]
+            index.drop(db.engine)
+        
+        migrate_database(self.app)
+        
+        inspector = inspect(db.engine)
+        for table in ('patients', 'triage_assessments'):
+            self.assertIn(['updated_at'], [index['column_names'] for index in inspector.get_indexes(table)])
+
+class TriageStatsTestCase(NHSTriageTestCase):
+    """Test case for the grouped statistics behind manage.py show_stats."""
+    
+    def add_assessment(self, urgency_level, symptom_category, created_at):
+        patient = Patient.query.first()
+        if not patient:
+            patient = Patient(session_id='stats-session', first_name='Stats', last_name='Test',
+                              age=50, gender='male')
+            db.session.add(patient)
+            db.session.flush()
+        db.session.add(TriageAssessment(session_id='stats-session', patient_id=patient.id,
+                                        symptom_category=symptom_category, primary_symptom='Cough',
+                                        severity=3, duration='today', urgency_level=urgency_level,
+                                        created_at=created_at))
+    
+    def test_breakdowns_and_windows(self):
+        """Test that totals, breakdowns and activity windows agree with the rows."""
+        from app import collect_triage_stats
+        now = datetime(2025, 6, 1, 12, 0, 0)
+        self.add_assessment('Emergency', 'pain', now - timedelta(hours=2))
+        self.add_assessment('Urgent', 'respiratory', now - timedelta(days=3))
+        self.add_assessment('Urgent', 'pain', now - timedelta(days=30))
+        self.add_assessment(None, None, now - timedelta(days=30))
+        db.session.commit()
+        
+        stats = collect_triage_stats(now)
+        
+        self.assertEqual(stats['total_assessments'], 4)
+        self.assertEqual(stats['total_patients'], 1)
+        self.assertEqual(stats['urgency_levels'], {'Emergency': 1, 'Urgent': 2, 'Standard': 0,
+                                                   'Self-care': 0, 'Unclassified': 1})
+        self.assertEqual(stats['symptom_categories'], {'pain': 2, 'respiratory': 1, 'unspecified': 1})
+        self.assertEqual((stats['recent_assessments_24h'], stats['recent_assessments_7d']), (1, 2))
+    
+    def test_fallback_answers_are_left_out_of_urgency(self):
+        """Test that canned fallback answers count as assessments but not as an urgency."""
+        from app import collect_triage_stats
+        now = datetime(2025, 6, 1, 12, 0, 0)
+        self.add_assessment('Urgent', 'pain', now - timedelta(hours=2))
+        self.add_assessment('Unassessed', 'pain', now - timedelta(hours=1))
+        db.session.commit()
+        
+        stats = collect_triage_stats(now)
+        
+        self.assertEqual(stats['total_assessments'], 2)
+        self.assertEqual(stats['urgency_levels']['Urgent'], 1)
+        self.assertNotIn('Unassessed', stats['urgency_levels'])
+        self.assertEqual(stats['urgency_levels']['Unclassified'], 0)
+        self.assertEqual(stats['unassessed_assessments'], 1)
+    
+    def test_migration_relabels_stored_fallback_answers(self):
+        """Test that fallbacks saved with the canned answer's "Urgent" header are relabelled."""
+        from app import collect_triage_stats, migrate_database
+        now = datetime(2025, 6, 1, 12, 0, 0)
+        self.add_assessment('Urgent', 'pain', now)
+        self.add_assessment('Urgent', 'pain', now)
+        db.session.commit()
+        legacy = TriageAssessment.query.order_by(TriageAssessment.id).first()
+        legacy.ai_model_used = 'fallback'
+        db.session.commit()
+        
+        migrate_database(self.app)
+        
+        db.session.expire_all()
+        self.assertEqual(db.session.get(TriageAssessment, legacy.id).urgency_level, 'Unassessed')
+        self.assertEqual(collect_triage_stats(now)['urgency_levels']['Urgent'], 1)
+    
+    def test_query_count_is_fixed(self):
+        """Test that the statistics take two queries however many rows exist."""
+        from app import collect_triage_stats
+        for i in range(20):
+            self.add_assessment(['Emergency', 'Urgent', 'Standard'][i % 3], ['pain', 'skin'][i % 2],
+                                datetime(2025, 1, 1) + timedelta(hours=i))
+        db.session.commit()
+        
+        self.assertEqual(self.count_queries(collect_triage_stats), 2)
+
+class SQLiteTuningTestCase(unittest.TestCase):
+    """Test case for the SQLite connection profile and read-only pool."""
+    
+    def setUp(self):
+        from sqlalchemy import create_engine
+        from sqlite_tuning import install_pragmas, set_journal_mode
+        self.db_fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        self.engine = create_engine(f'sqlite:///{self.db_path}')
+        install_pragmas(self.engine)
+        set_journal_mode(self.engine, 'WAL')
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('CREATE TABLE notes (id INTEGER PRIMARY KEY, body TEXT)')
+            connection.exec_driver_sql("INSERT INTO notes (body) VALUES ('first')")
+    
+    def tearDown(self):
+        self.engine.dispose()
+        os.close(self.db_fd)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.unlink(self.db_path + suffix)
+    
+    def pragma(self, connection, name):
+        return connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+    
+    def test_profile_applied_to_new_connections(self):
+        """Test WAL, synchronous=NORMAL and the busy timeout on every connection."""
+        with self.engine.connect() as connection:
+            self.assertEqual(self.pragma(connection, 'journal_mode'), 'wal')
+            self.assertEqual(self.pragma(connection, 'synchronous'), 1)
+            self.assertEqual(self.pragma(connection, 'busy_timeout'), 5000)
+            self.assertEqual(self.pragma(connection, 'temp_store'), 2)
+    
+    def test_connecting_does_not_change_the_journal_mode(self):
+        """Test that opening a database leaves its file alone until it is migrated."""
+        from sqlalchemy import create_engine
+        from sqlite_tuning import install_pragmas
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        engine = create_engine(f'sqlite:///{path}')
+        self.addCleanup(engine.dispose)
+        install_pragmas(engine)
+        
+        with engine.connect() as connection:
+            self.assertEqual(self.pragma(connection, 'journal_mode'), 'delete')
+            self.assertEqual(self.pragma(connection, 'busy_timeout'), 5000)
+    
+    def test_readers_are_not_blocked_by_a_writer(self):
+        """Test that the read pool reads while a write transaction is open."""
+        from sqlite_tuning import create_read_engine
+        read_engine = create_read_engine(self.engine)
+        self.addCleanup(read_engine.dispose)
+        
+        with self.engine.begin() as writer:
+            writer.exec_driver_sql("INSERT INTO notes (body) VALUES ('uncommitted')")
+            with read_engine.connect() as reader:
+                self.assertEqual(reader.exec_driver_sql('SELECT count(*) FROM notes').scalar(), 1)
+    
+    def test_read_pool_is_query_only(self):
+        """Test that the read pool refuses writes."""
+        from sqlalchemy.exc import OperationalError
+        from sqlite_tuning import create_read_engine
+        read_engine = create_read_engine(self.engine)
+        self.addCleanup(read_engine.dispose)
+        
+        with read_engine.connect() as reader:
+            with self.assertRaises(OperationalError):
+                reader.exec_driver_sql('DELETE FROM notes')
+    
+    def test_in_memory_database_has_no_read_pool(self):
+        """Test that in-memory databases fall back to the primary session."""
+        app = create_app('testing')
+        with app.app_context():
+            from app import read_connection
+            self.assertIsNone(app.extensions['read_engine'])
+            with read_connection() as connection:
+                self.assertIs(connection, db.session)
+
+class CircuitBreakerTestCase(MockOllamaTestCase):
+    """Test case for per-model circuit breakers and failover to BACKUP_MODEL."""
+    
+    def use_mock_ollama(self):
+        """Answer each model from ``self.model_responses`` as ``(status, body)``."""
+        import httpx
+        from ollama_client import OllamaHTTPClients
+        self.model_responses = {}
+        
+        def handler(request):
+            self.ollama_requests.append(request)
+            if request.url.path == '/api/version':
+                return httpx.Response(200, json={'version': 'test'})
+            status, body = self.model_responses[json.loads(request.content)['model']]
+            return httpx.Response(status, content=body)
+        
+        transport = httpx.MockTransport(handler)
+        clients = OllamaHTTPClients(transport=transport, async_transport=transport)
+        self.app.extensions['ollama_http'] = clients
+        pool = self.app.extensions['ollama_pool']
+        pool.client = clients.sync
+        pool.probe()
+    
+    def generated_models(self):
+        return [json.loads(request.content)['model'] for request in self.ollama_requests
+                if request.url.path == '/api/generate']
+    
+    def test_breaker_opens_half_opens_and_closes(self):
+        """Test the closed -> open -> half-open -> closed transitions."""
+        from circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+        now = [0.0]
+        breaker = CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, slow_call_seconds=5,
+                                 open_seconds=10, clock=lambda: now[0])
+        breaker.record(True, 1.0)
+        breaker.record(True, 1.0)
+        breaker.record(True, 6.0)  # slow counts as bad
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record(False, error='HTTP 500')
+        
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        now[0] = 10.0
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # one trial at a time
+        breaker.record(True, 1.0)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.stats()['times_opened'], 1)
+    
+    def test_failed_half_open_trial_reopens(self):
+        """Test that a bad trial call opens the breaker again."""
+        from circuit_breaker import CircuitBreaker, OPEN
+        now = [0.0]
+        breaker = CircuitBreaker(min_calls=1, open_seconds=10, clock=lambda: now[0])
+        breaker.record(False)
+        now[0] = 10.0
+        self.assertTrue(breaker.allow())
+        breaker.record(False)
+        
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.stats()['times_opened'], 2)
+    
+    def test_primary_error_fails_over_to_backup(self):
+        """Test that an HTTP 500 from the primary is answered by the backup model."""
+        primary, backup = self.app.config['PRIMARY_MODEL'], self.app.config['BACKUP_MODEL']
+        self.model_responses = {primary: (500, b'error'),
+                                backup: (200, b'{"response": "See your GP.", "done": true}\n')}
+        assessment = self.create_assessment()
+        
+        body = self.client.get(f'/api/triage/stream/{assessment.id}').get_data(as_text=True)
+        
+        self.assertIn('"chunk": "See your GP."', body)
+        self.assertIn('"done": true', body)
+        self.assertEqual(self.generated_models(), [primary, backup])
+        saved = db.session.get(TriageAssessment, assessment.id)
+        self.assertEqual((saved.ai_response, saved.ai_model_used), ('See your GP.', backup))
+        
+        stats = self.client.get('/api/metrics').get_json()['model_failover']
+        self.assertEqual(stats['failovers'], 1)
+        self.assertEqual(stats['served'], {backup: 1})
+        self.assertEqual(stats['models'][primary]['last_error'], 'AI service returned HTTP 500')
+    
+    def test_open_breaker_skips_primary(self):
+        """Test that a model with an open breaker is not called at all."""
+        primary, backup = self.app.config['PRIMARY_MODEL'], self.app.config['BACKUP_MODEL']
+        self.model_responses = {backup: (200, b'{"response": "Rest.", "done": true}\n')}
+        self.app.extensions['model_failover'].breakers[primary]._open()
+        
+        body = self.client.get(f'/api/triage/stream/{self.create_assessment().id}').get_data(as_text=True)
+        
+        self.assertIn('"chunk": "Rest."', body)
+        self.assertEqual(self.generated_models(), [backup])
+    
+    def test_canned_fallback_when_every_breaker_is_open(self):
+        """Test that patients get safe advice when no model is available."""
+        for breaker in self.app.extensions['model_failover'].breakers.values():
+            breaker._open()
+        assessment = self.create_assessment()
+        
+        body = self.client.get(f'/api/triage/stream/{assessment.id}').get_data(as_text=True)
+        
+        self.assertIn('111', body)
+        self.assertIn('"done": true', body)
+        self.assertEqual(self.generated_models(), [])
+        saved = db.session.get(TriageAssessment, assessment.id)
+        self.assertEqual(saved.ai_model_used, 'fallback')
+        self.assertEqual(saved.urgency_level, 'Unassessed')
+        self.assertEqual(self.client.get('/api/metrics').get_json()['model_failover']['fallbacks'], 1)
+    
+    def test_fallback_answer_is_not_counted_as_urgent_on_the_dashboard(self):
+        """Test that the staff dashboard shows a fallback answer as unassessed."""
+        for breaker in self.app.extensions['model_failover'].breakers.values():
+            breaker._open()
+        assessment = self.create_assessment()
+        self.client.get(f'/api/triage/stream/{assessment.id}').get_data()
+        
+        page = self.client.get('/staff-dashboard').get_data(as_text=True)
+        
+        self.assertIn(f'data-assessment-id="{assessment.id}"', page)
+        self.assertIn('data-urgency="Unassessed"', page)
+        self.assertIn('<div class="stat-number" id="urgent-count">0</div>', page)
+    
+    def test_fallback_can_be_disabled(self):
+        """Test that AI_FALLBACK_ENABLED=False surfaces the error instead."""
+        self.app.config['AI_FALLBACK_ENABLED'] = False
+        for breaker in self.app.extensions['model_failover'].breakers.values():
+            breaker._open()
+        
+        body = self.client.get(f'/api/triage/stream/{self.create_assessment().id}').get_data(as_text=True)
+        
+        self.assertIn('AI service unavailable', body)
+    
+    def test_client_save_keeps_the_streamed_model(self):
+        """Test that the page's save call after a backup stream does not relabel the answer."""
+        primary, backup = self.app.config['PRIMARY_MODEL'], self.app.config['BACKUP_MODEL']
+        self.model_responses = {primary: (500, b'error'),
+                                backup: (200, b'{"response": "See your GP.", "done": true}\n')}
+        assessment = self.create_assessment()
+        self.client.get(f'/api/triage/stream/{assessment.id}').get_data()
+        
+        response = self.client.post(f'/api/triage/save/{assessment.id}', json={'response': 'See your GP.'})
+        
+        self.assertTrue(response.get_json()['success'])
+        db.session.expire_all()
+        saved = db.session.get(TriageAssessment, assessment.id)
+        self.assertEqual(saved.ai_model_used, backup)
+        self.assertEqual(saved.recommendations, 'See your GP.')
+    
+    def test_client_save_keeps_the_fallback_label(self):
+        """Test that a canned fallback stays recorded as such after the page saves it."""
+        for breaker in self.app.extensions['model_failover'].breakers.values():
+            breaker._open()
+        assessment = self.create_assessment()
+        body = self.client.get(f'/api/triage/stream/{assessment.id}').get_data(as_text=True)
+        
+        self.client.post(f'/api/triage/save/{assessment.id}', json={'response': body})
+        
+        db.session.expire_all()
+        saved = db.session.get(TriageAssessment, assessment.id)
+        self.assertEqual((saved.ai_model_used, saved.confidence_score), ('fallback', 0.0))
+    
+    def test_async_path_fails_over_to_backup(self):
+        """Test that the ASGI path fails over with the same wire format."""
+        primary, backup = self.app.config['PRIMARY_MODEL'], self.app.config['BACKUP_MODEL']
+        self.model_responses = {primary: (503, b'busy'),
+                                backup: (200, b'{"response": "See your GP.", "done": true}\n')}
+        assessment = self.create_assessment()
+        
+        response = self.asgi_get(f'/api/triage/stream/{assessment.id}')
+        
+        self.assertEqual(response.text, (
+            'data: {"chunk": "See your GP."}\n\n'
+            'data: {"done": true}\n\n'
+            'data: [DONE]\n\n'
+        ))
+        self.assertEqual(self.generated_models(), [primary, backup])
+        db.session.expire_all()
+        self.assertEqual(db.session.get(TriageAssessment, assessment.id).ai_model_used, backup)
+
+    def test_both_transports_send_the_same_fallback(self):
+        """Test that the WSGI and ASGI paths share one pipeline and so one wire format."""
+        for breaker in self.app.extensions['model_failover'].breakers.values():
+            breaker._open()
+        
+        wsgi_body = self.client.get(f'/api/triage/stream/{self.create_assessment().id}').get_data(as_text=True)
+        asgi_body = self.asgi_get(f'/api/triage/stream/{self.create_assessment().id}').text
+        
+        self.assertIn('temporarily unavailable', wsgi_body)
+        self.assertEqual(asgi_body, wsgi_body)
+
+class ModelRoutingTestCase(MockOllamaTestCase):
+    """Test case for load-adaptive routing of chat to BACKUP_MODEL."""
+    
+    use_mock_ollama = CircuitBreakerTestCase.use_mock_ollama
+    generated_models = CircuitBreakerTestCase.generated_models
+    
+    def setUp(self):
+        super().setUp()
+        self.primary, self.backup = self.app.config['PRIMARY_MODEL'], self.app.config['BACKUP_MODEL']
+        done = b'{"response": "Rest.", "done": true, "eval_count": 40, "eval_duration": 2000000000}\n'
+        self.model_responses = {self.primary: (200, done), self.backup: (200, done)}
+        self.router = self.app.extensions['model_router']
+    
+    def test_chat_downgrades_under_load_but_triage_does_not(self):
+        """Test that the load threshold moves chat, never triage, to the backup."""
+        from generation_scheduler import PRIORITY_CHAT, PRIORITY_TRIAGE
+        from model_router import LoadAdaptiveRouter
+        router = LoadAdaptiveRouter('big', 'small', downgrade_load=3)
+        
+        self.assertEqual(router.choose(PRIORITY_CHAT, 2), ('big', 'normal'))
+        self.assertEqual(router.choose(PRIORITY_CHAT, 3), ('small', 'load'))
+        self.assertEqual(router.choose(PRIORITY_TRIAGE, 10), ('big', 'priority'))
+        self.assertTrue(router.stats()['downgrading_chat'])
+        self.assertEqual(router.stats()['decisions']['chat']['small'], {'load': 1})
+    
+    def test_slow_primary_throughput_breaks_the_slo(self):
+        """Test that recent tokens/sec predicting a slow answer downgrades chat."""
+        from generation_scheduler import PRIORITY_CHAT
+        from model_router import LoadAdaptiveRouter
+        router = LoadAdaptiveRouter('big', 'small', latency_slo=30, downgrade_load=10)
+        router.observe('big', 300, 20)  # 15 tok/s, 20s answers
+        self.assertEqual(router.choose(PRIORITY_CHAT, 1).model, 'big')
+        
+        router.observe('big', 300, 100)  # now 600 tokens in 120s: 60s answers
+        self.assertEqual(router.choose(PRIORITY_CHAT, 1), ('small', 'slo'))
+        self.assertEqual(router.predicted_seconds(), 60)
+    
+    def test_chat_stream_uses_backup_when_downgraded(self):
+        """Test that a downgraded chat turn is generated by BACKUP_MODEL."""
+        self.router.downgrade_load = 1
+        
+        body = self.client.get(f'/api/chat/stream/{self.create_chat_message().id}').get_data(as_text=True)
+        
+        self.assertIn('"chunk": "Rest."', body)
+        self.assertEqual(self.generated_models(), [self.backup])
+        stats = self.client.get('/api/metrics').get_json()
+        self.assertEqual(stats['model_routing']['decisions']['chat'][self.backup], {'load': 1})
+        self.assertEqual(stats['model_routing']['models'][self.backup]['tokens_per_second'], 20.0)
+        self.assertEqual(stats['model_failover']['failovers'], 0)
+    
+    def test_triage_stream_stays_on_primary_under_load(self):
+        """Test that triage keeps PRIMARY_MODEL whatever the load."""
+        self.router.downgrade_load = 1
+        
+        self.client.get(f'/api/triage/stream/{self.create_assessment().id}').get_data()
+        
+        self.assertEqual(self.generated_models(), [self.primary])
+    
+    def test_downgraded_chat_falls_back_to_primary_if_backup_is_open(self):
+        """Test that the primary still answers when the backup's breaker is open."""
+        self.router.downgrade_load = 1
+        self.app.extensions['model_failover'].breakers[self.backup]._open()
+        
+        body = self.asgi_get(f'/api/chat/stream/{self.create_chat_message().id}').text
+        
+        self.assertIn('"chunk": "Rest."', body)
+        self.assertEqual(self.generated_models(), [self.primary])
+    
+    def test_routing_can_be_disabled(self):
+        """Test that MODEL_ROUTING_ENABLED=False keeps chat on the primary."""
+        self.router.enabled = False
+        self.router.downgrade_load = 1
+        
+        self.client.get(f'/api/chat/stream/{self.create_chat_message().id}').get_data()
+        
+        self.assertEqual(self.generated_models(), [self.primary])
+
+class OllamaHostPoolTestCase(MockOllamaTestCase):
+    """Test case for balancing generations across several Ollama hosts."""
+    
+    HOSTS = ['http://ollama-a:11434', 'http://ollama-b:11434']
+    
+    def use_mock_ollama(self):
+        """Serve two fake hosts; hosts listed in ``self.refusing`` refuse connections."""
+        import httpx
+        from ollama_client import OllamaHTTPClients, OllamaHostPool
+        self.refusing = set()
+        
+        def handler(request):
+            self.ollama_requests.append(request)
+            if request.url.host in self.refusing:
+                raise httpx.ConnectError('Connection refused', request=request)
+            if request.url.path == '/api/version':
+                return httpx.Response(200, json={'version': 'test'})
+            return httpx.Response(200, content=b'{"response": "Rest.", "done": true}\n')
+        
+        transport = httpx.MockTransport(handler)
+        clients = OllamaHTTPClients(transport=transport, async_transport=transport)
+        self.app.extensions['ollama_http'] = clients
+        self.pool = OllamaHostPool(self.HOSTS, client=clients.sync)
+        self.app.extensions['ollama_pool'] = self.pool
+        self.pool.probe()
+    
+    def generate_hosts(self):
+        return [request.url.host for request in self.ollama_requests if request.url.path == '/api/generate']
+    
+    def test_least_outstanding_host_is_picked(self):
+        """Test that each new generation goes to the least busy host."""
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.assertNotEqual(first, second)
+        
+        self.pool.release(first)
+        self.assertIs(self.pool.acquire(), first)
+        self.assertEqual([host.outstanding for host in self.pool.hosts], [1, 1])
+    
+    def test_unhealthy_host_is_skipped(self):
+        """Test that a host whose probe failed gets no traffic."""
+        self.pool.hosts[0].monitor.mark_down('down')
+        
+        self.assertTrue(self.pool.available)
+        self.assertIs(self.pool.acquire(), self.pool.hosts[1])
+        self.assertIs(self.pool.acquire(), self.pool.hosts[1])
+        self.assertIsNone(self.pool.acquire(exclude=self.pool.hosts))
+    
+    def test_session_affinity_survives_load_until_host_goes_down(self):
+        """Test that a session sticks to its host, and moves when that host fails."""
+        home = self.pool.acquire('session-1')
+        self.pool.acquire('session-1')
+        self.assertIs(self.pool.acquire('session-1'), home)  # despite two outstanding
+        
+        home.monitor.mark_down('down')
+        moved = self.pool.acquire('session-1')
+        self.assertIsNot(moved, home)
+        self.assertIs(self.pool.acquire('session-1'), moved)
+        snapshot = self.pool.snapshot()
+        self.assertEqual((snapshot['affinity_hits'], snapshot['affinity_moves']), (3, 1))
+    
+    def test_refused_host_is_marked_down_and_request_retried(self):
+        """Test that a connection error moves the generation to another host."""
+        self.refusing.add('ollama-a')
+        self.pool.hosts[0].outstanding = -1  # make host a the first pick
+        
+        body = self.client.get(f'/api/triage/stream/{self.create_assessment().id}').get_data(as_text=True)
+        
+        self.assertIn('"chunk": "Rest."', body)
+        self.assertEqual(self.generate_hosts(), ['ollama-a', 'ollama-b'])
+        self.assertFalse(self.pool.hosts[0].available)
+        self.assertEqual(self.pool.hosts[0].marked_down, 1)
+        breaker = self.app.extensions['model_failover'].breakers[self.app.config['PRIMARY_MODEL']]
+        self.assertEqual(breaker.stats()['recent_bad_calls'], 0)
+    
+    def test_chat_turns_follow_their_session(self):
+        """Test that follow-up turns of a conversation reach the same host."""
+        for _ in range(2):
+            self.client.get(f'/api/chat/stream/{self.create_chat_message().id}').get_data()
+            self.asgi_get(f'/api/chat/stream/{self.create_chat_message().id}')
+        self.client.get(f'/api/chat/stream/{self.create_chat_message("other-session").id}').get_data()
+        
+        hosts = self.generate_hosts()
+        self.assertEqual(len(set(hosts[:4])), 1)
+        self.assertNotEqual(hosts[4], hosts[0])
+        self.assertEqual([host.outstanding for host in self.pool.hosts], [0, 0])
+    
+    def test_metrics_list_every_host(self):
+        """Test that /api/metrics reports each host's health and load."""
+        self.pool.hosts[1].monitor.mark_down('refused')
+        
+        ollama = self.client.get('/api/metrics').get_json()['ollama']
+        
+        self.assertTrue(ollama['available'])
+        self.assertEqual(set(ollama['hosts']), set(self.HOSTS))
+        self.assertEqual(ollama['hosts'][self.HOSTS[1]]['last_error'], 'refused')
+    
+    def test_config_defaults_to_single_base_url(self):
+        """Test that OLLAMA_BASE_URL alone still configures one host."""
+        from ollama_client import OllamaHostPool
+        pool = OllamaHostPool.from_config({'OLLAMA_BASE_URL': 'http://localhost:11434/'})
+        self.assertEqual([host.base_url for host in pool.hosts], ['http://localhost:11434'])
+
+class HedgedTriageTestCase(MockOllamaTestCase):
+    """Test case for hedging late triage generations onto a second host."""
+    
+    HOSTS = ['http://ollama-a:11434', 'http://ollama-b:11434']
+    BODY = b'{"response": "See your GP.", "done": true}\n'
+    
+    def use_mock_ollama(self):
+        """Two fake hosts; hosts in ``self.stalled`` never send headers for a generation."""
+        import asyncio
+        import threading
+        import httpx
+        from ollama_client import OllamaHTTPClients, OllamaHostPool
+        self.stalled = set()
+        self.cancelled = []
+        self.unstall = threading.Event()
+        self.addCleanup(self.unstall.set)
+        
+        def respond(request):
+            self.ollama_requests.append(request)
+            if request.url.path == '/api/version':
+                return httpx.Response(200, json={'version': 'test'})
+            return httpx.Response(200, content=self.BODY)
+        
+        def handler(request):
+            if request.url.path == '/api/generate' and request.url.host in self.stalled:
+                self.unstall.wait(5)
+            return respond(request)
+        
+        async def async_handler(request):
+            if request.url.path == '/api/generate' and request.url.host in self.stalled:
+                try:
+                    await asyncio.Event().wait()  # only cancelling the attempt ends this
+                except asyncio.CancelledError:
+                    self.cancelled.append(request.url.host)
+                    raise
+            return respond(request)
+        
+        clients = OllamaHTTPClients(transport=httpx.MockTransport(handler),
+                                    async_transport=httpx.MockTransport(async_handler))
+        self.addCleanup(clients.close)
+        self.app.extensions['ollama_http'] = clients
+        self.pool = OllamaHostPool(self.HOSTS, client=clients.sync)
+        self.app.extensions['ollama_pool'] = self.pool
+        self.pool.probe()
+        
+        from hedging import HedgePolicy
+        self.policy = HedgePolicy(default_delay=0.05)
+        self.app.extensions['hedge_policy'] = self.policy
+        self.app.config['HEDGE_ENABLED'] = True
+    
+    def generate_hosts(self):
+        return [request.url.host for request in self.ollama_requests if request.url.path == '/api/generate']
+    
+    def test_delay_is_clamped_percentile_of_first_token_latencies(self):
+        """Test the hedge delay before and after enough samples arrive."""
+        from hedging import HedgePolicy
+        policy = HedgePolicy(percentile=90, min_delay=1, max_delay=15, default_delay=5, min_samples=10)
+        self.assertEqual(policy.delay(), 5)
+        for latency in range(1, 11):
+            policy.observe(latency * 0.5)
+        self.assertEqual(policy.delay(), 5.0)
+        for _ in range(10):
+            policy.observe(60)
+        self.assertEqual(policy.delay(), 15)
+    
+    def test_budget_bounds_the_hedge_rate(self):
+        """Test that hedges are limited to max_ratio of requests after the initial burst."""
+        from hedging import HedgePolicy
+        policy = HedgePolicy(max_ratio=0.25, burst=1.0)
+        hedged = 0
+        for _ in range(20):
+            policy.request()
+            hedged += policy.try_hedge()
+        
+        self.assertEqual(hedged, 5)
+        self.assertEqual(policy.stats()['budget_denied'], 15)
+    
+    def test_late_first_token_is_hedged_and_the_hedge_wins(self):
+        """Test that a stalled host is raced and the fast host's answer is used."""
+        self.stalled.add('ollama-a')
+        assessment = self.create_assessment()
+        
+        body = self.client.get(f'/api/triage/stream/{assessment.id}').get_data(as_text=True)
+        
+        self.assertIn('"chunk": "See your GP."', body)
+        self.assertIn('"done": true', body)
+        self.assertEqual(db.session.get(TriageAssessment, assessment.id).ai_response, 'See your GP.')
+        stats = self.client.get('/api/metrics').get_json()['hedging']
+        self.assertEqual((stats['requests'], stats['hedges'], stats['hedge_wins']), (1, 1, 1))
+        self.assertEqual([host.outstanding for host in self.pool.hosts], [0, 0])
+    
+    def test_loser_stuck_before_headers_is_cancelled(self):
+        """Test that the WSGI path aborts an attempt whose host never sends headers."""
+        self.stalled.add('ollama-a')
+        assessment = self.create_assessment()
+        
+        started = time.monotonic()
+        body = self.client.get(f'/api/triage/stream/{assessment.id}').get_data(as_text=True)
+        
+        self.assertIn('"chunk": "See your GP."', body)
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertEqual(self.cancelled, ['ollama-a'])
+        self.assertEqual([host.outstanding for host in self.pool.hosts], [0, 0])
+    
+    def test_loser_host_is_released_only_when_its_attempt_exits(self):
+        """Test that a cancelled attempt still counts against its host until it stops."""
+        from hedging import HedgeRace, STATUS, TEXT
+        
+        class Attempt:
+            def __init__(self):
+                self.on_exit = []
+            def cancel(self):
+                pass
+            def when_exited(self, callback):
+                self.on_exit.append(callback)
+        
+        race = HedgeRace(self.pool, self.policy, lambda host: Attempt())
+        race.start()
+        race.on_timeout()
+        loser, winner = race.attempts
+        race.report(winner, STATUS, 200)
+        race.report(winner, TEXT, 'See')
+        
+        self.assertEqual(loser.host.outstanding, 1)
+        for callback in loser.on_exit:
+            callback()
+        self.assertEqual(loser.host.outstanding, 0)
+        race.close()
+        for callback in winner.on_exit:
+            callback()
+        self.assertEqual([host.outstanding for host in self.pool.hosts], [0, 0])
+    
+    def test_prompt_first_token_is_not_hedged(self):
+        """Test that no hedge is sent when the first host answers in time."""
+        self.policy.default_delay = 5
+        
+        body = self.client.get(f'/api/triage/stream/{self.create_assessment().id}').get_data(as_text=True)
+        
+        self.assertIn('"chunk": "See your GP."', body)
+        self.assertEqual(len(self.generate_hosts()), 1)
+        self.assertEqual(self.policy.stats()['hedges'], 0)
+        self.assertEqual(self.policy.stats()['latency_samples'], 1)
+    
+    def test_chat_is_never_hedged(self):
+        """Test that hedging only applies to triage."""
+        self.stalled.add('ollama-a')
+        self.unstall.set()
+        message = ChatMessage(session_id='stream-session', message='Is this normal?', role='user')
+        db.session.add(message)
+        db.session.commit()
+        
+        self.client.get(f'/api/chat/stream/{message.id}').get_data()
+        
+        self.assertEqual(self.policy.stats()['requests'], 0)
+        self.assertEqual(self.generate_hosts(), ['ollama-a'])
+    
+    def test_async_path_hedges_and_cancels_the_loser(self):
+        """Test that the ASGI path streams the hedge and cancels the stalled attempt."""
+        self.stalled.add('ollama-a')
+        assessment = self.create_assessment()
+        
+        started = time.monotonic()
+        response = self.asgi_get(f'/api/triage/stream/{assessment.id}')
+        
+        self.assertEqual(response.text, (
+            'data: {"chunk": "See your GP."}\n\n'
+            'data: {"done": true}\n\n'
+            'data: [DONE]\n\n'
+        ))
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertEqual(self.policy.stats()['hedge_wins'], 1)
+        self.assertEqual([host.outstanding for host in self.pool.hosts], [0, 0])
+
+class ModelWarmupTestCase(MockOllamaTestCase):
+    """Test case for model warm-up, keep-alive and readiness."""
+    
+    def use_mock_ollama(self):
+        """A fake host listing ``self.pulled`` in /api/tags and ``self.resident`` in /api/ps."""
+        import httpx
+        from ollama_client import OllamaHTTPClients
+        self.primary, self.backup = self.app.config['PRIMARY_MODEL'], self.app.config['BACKUP_MODEL']
+        self.host_up = True
+        self.pulled = {self.primary, self.backup}
+        self.resident = set()
+        
+        def handler(request):
+            self.ollama_requests.append(request)
+            if not self.host_up:
+                raise httpx.ConnectError('Connection refused', request=request)
+            if request.url.path == '/api/version':
+                return httpx.Response(200, json={'version': 'test'})
+            if request.url.path in ('/api/tags', '/api/ps'):
+                names = self.pulled if request.url.path == '/api/tags' else self.resident
+                return httpx.Response(200, json={'models': [{'name': name} for name in sorted(names)]})
+            body = json.loads(request.content)
+            if body['prompt'] == '':
+                if body['model'] not in self.pulled:
+                    return httpx.Response(404, json={'error': f"model '{body['model']}' not found"})
+                self.resident.add(body['model'])
+                return httpx.Response(200, json={'model': body['model'], 'response': '', 'done': True})
+            return httpx.Response(200, content=b'{"response": "Rest.", "done": true}\n')
+        
+        transport = httpx.MockTransport(handler)
+        clients = OllamaHTTPClients(transport=transport, async_transport=transport)
+        self.app.extensions['ollama_http'] = clients
+        pool = self.app.extensions['ollama_pool']
+        pool.client = clients.sync
+        pool.probe()
+        self.pool = pool
+        self.warmer = self.app.extensions['model_warmer']
+        self.warmer._started = True  # as if start() had run, without the background thread
+        self.host = pool.hosts[0]
+        self.host.warming = True
+    
+    def load_requests(self):
+        return [json.loads(request.content) for request in self.ollama_requests
+                if request.url.path == '/api/generate' and json.loads(request.content)['prompt'] == '']
+    
+    def test_ready_only_after_models_are_loaded(self):
+        """Test that readiness reports warming until every model is loaded."""
+        response = self.client.get('/api/ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.get_json()['status'], 'warming')
+        
+        self.assertTrue(self.warmer.warm_host(self.host))
+        
+        response = self.client.get('/api/ready')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'ready')
+        self.assertEqual(self.resident, {self.primary, self.backup})
+        self.assertEqual({body['keep_alive'] for body in self.load_requests()}, {'30m'})
+        self.assertFalse(self.host.warming)
+    
+    def test_waits_for_host_and_primary_model(self):
+        """Test that warm-up reports why it cannot finish yet."""
+        from model_warmup import WAITING, MISSING
+        self.host_up = False
+        self.assertFalse(self.warmer.warm_host(self.host))
+        self.assertEqual(self.warmer.snapshot()['hosts'][self.host.base_url]['state'], WAITING)
+        
+        self.host_up = True
+        self.pulled = {self.backup}
+        self.assertFalse(self.warmer.warm_host(self.host))
+        host_state = self.warmer.snapshot()['hosts'][self.host.base_url]
+        self.assertEqual((host_state['state'], host_state['missing']), (MISSING, [self.primary]))
+        self.assertEqual(self.load_requests(), [])
+        self.assertTrue(self.host.warming)
+        self.assertEqual(self.client.get('/api/ready').status_code, 503)
+    
+    def test_missing_backup_does_not_block_readiness(self):
+        """Test that a backup model that is not pulled is reported but not waited for."""
+        from model_warmup import WARM
+        self.pulled = {self.primary}
+        
+        self.assertTrue(self.warmer.warm_host(self.host))
+        
+        host_state = self.warmer.snapshot()['hosts'][self.host.base_url]
+        self.assertEqual((host_state['state'], host_state['missing']), (WARM, [self.backup]))
+        self.assertEqual(self.resident, {self.primary})
+        self.assertFalse(self.host.warming)
+        self.assertEqual(self.client.get('/api/ready').status_code, 200)
+        
+        # Pulled later: the next keep-warm ping loads it
+        self.pulled.add(self.backup)
+        self.warmer.keep_warm()
+        self.assertEqual(self.resident, {self.primary, self.backup})
+        self.assertEqual(self.warmer.snapshot()['hosts'][self.host.base_url]['missing'], [])
+    
+    def test_keep_warm_reloads_evicted_models(self):
+        """Test that a model Ollama evicted is loaded again by the keep-warm ping."""
+        self.warmer.warm_host(self.host)
+        self.resident.discard(self.primary)
+        
+        self.warmer.keep_warm()
+        
+        self.assertIn(self.primary, self.resident)
+        self.assertEqual((self.warmer.reloads, self.warmer.pings), (1, 1))
+    
+    def test_keep_warm_stops_when_idle(self):
+        """Test that pings stop once no traffic has been seen for KEEP_WARM_IDLE."""
+        self.warmer.warm_host(self.host)
+        self.warmer.idle_after = 0.01
+        self.warmer.traffic_expected()
+        time.sleep(0.02)
+        loads = len(self.load_requests())
+        
+        self.warmer.keep_warm()
+        
+        self.assertEqual(len(self.load_requests()), loads)
+        self.assertEqual(self.warmer.pings, 0)
+    
+    def test_generations_send_keep_alive(self):
+        """Test that patient generations ask Ollama to keep the model loaded."""
+        self.client.get(f'/api/triage/stream/{self.create_assessment().id}').get_data()
+        
+        generate = [json.loads(request.content) for request in self.ollama_requests
+                    if request.url.path == '/api/generate']
+        self.assertEqual(generate[-1]['keep_alive'], '30m')
+    
+    def test_pool_prefers_warm_hosts(self):
+        """Test that a host still loading models only gets traffic as a last resort."""
+        from ollama_client import OllamaHostPool
+        pool = OllamaHostPool(['http://ollama-a:11434', 'http://ollama-b:11434'], client=self.pool.client)
+        pool.probe()
+        cold, warm = pool.hosts
+        cold.warming = True
+        
+        self.assertIs(pool.acquire(), warm)
+        self.assertIs(pool.acquire(), warm)
+        self.assertIs(pool.acquire(exclude=[warm]), cold)
+    
+    def test_disabled_warmup_is_ready(self):
+        """Test that readiness does not block when warm-up is switched off."""
+        self.warmer._started = False
+        response = self.client.get('/api/ready')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'disabled')
+
+class BackgroundServicesTestCase(MockOllamaTestCase):
+    """Test case for starting background services under any server."""
+    
+    def enable_services(self):
+        from unittest import mock
+        for key in ('OLLAMA_MONITOR_ENABLED', 'RETENTION_ENABLED', 'WARMUP_ENABLED'):
+            self.app.config[key] = True
+        services = [self.app.extensions[name] for name in ('ollama_pool', 'retention_job', 'model_warmer')]
+        for service in services:
+            service.start = mock.Mock()
+        return services
+    
+    def test_first_request_starts_services_once(self):
+        """Test that a server without a startup hook (gunicorn, flask run) still starts them."""
+        services = self.enable_services()
+        
+        self.client.get('/api/health')
+        self.client.get('/api/health')
+        
+        for service in services:
+            service.start.assert_called_once_with()
+    
+    def test_system_log_writer_runs_only_with_background_services(self):
+        """Test that the app logs synchronously until its services start, and again after they stop."""
+        from app import start_background_services, stop_background_services
+        self.enable_services()
+        self.app.config['SYSTEM_LOG_ASYNC'] = True
+        writer = self.app.extensions['system_log_writer']
+        
+        self.assertTrue(writer.synchronous)
+        self.assertFalse(writer.stats()['running'])
+        start_background_services(self.app)
+        self.assertFalse(writer.synchronous)
+        self.assertTrue(writer.stats()['running'])
+        stop_background_services(self.app)
+        self.assertTrue(writer.synchronous)
+        self.assertFalse(writer.stats()['running'])
+    
+    def test_never_probed_monitor_is_probed_on_demand(self):
+        """Test that the AI is not reported down just because the monitor has not probed yet."""
+        from app import check_ollama
+        self.enable_services()
+        self.app.extensions['ollama_pool'].hosts[0].monitor._checked_at = None
+        
+        with self.app.app_context():
+            self.assertTrue(check_ollama())
+        self.assertEqual(self.ollama_requests[-1].url.path, '/api/version')
+    
+    def test_asgi_stream_probes_never_probed_monitor(self):
+        """Test that ASGI streams sent before the monitor's first probe are not rejected."""
+        self.enable_services()
+        self.app.extensions['ollama_pool'].hosts[0].monitor._checked_at = None
+        self.ollama_body = b'{"response": "See your GP.", "done": true}\n'
+        assessment = self.create_assessment()
+        probes = len(self.ollama_requests)
+        
+        body = self.asgi_get(f'/api/triage/stream/{assessment.id}').text
+        
+        self.assertNotIn('AI service unavailable', body)
+        self.assertIn('"chunk": "See your GP."', body)
+        self.assertIn('/api/version', [request.url.path for request in self.ollama_requests[probes:]])
+    
+    def test_asgi_stream_starts_services_without_lifespan(self):
+        """Test that a server running the ASGI app with lifespan off still starts them."""
+        services = self.enable_services()
+        self.ollama_body = b'{"response": "ok", "done": true}\n'
+        
+        self.asgi_get(f'/api/chat/stream/{self.create_chat_message().id}')
+        
+        for service in services:
+            service.start.assert_called_once_with()
+    
+    def test_disabled_monitor_probes_on_demand_within_ttl(self):
+        """Test that without a monitor an expired result is re-probed by the caller."""
+        from app import check_ollama
+        monitor = self.app.extensions['ollama_pool'].hosts[0].monitor
+        monitor._checked_at = None
+        probes = len(self.ollama_requests)
+        
+        with self.app.app_context():
+            self.assertTrue(check_ollama())
+            self.assertTrue(check_ollama())
+        self.assertEqual(len(self.ollama_requests), probes + 1)
+        
+        monitor._checked_at -= monitor.ttl + 1
+        with self.app.app_context():
+            self.assertTrue(check_ollama())
+        self.assertEqual(len(self.ollama_requests), probes + 2)
+    
+    def test_disabled_monitor_recovers_from_a_down_result(self):
+        """Test that a host seen down is tried again once that result expires."""
+        monitor = self.app.extensions['ollama_pool'].hosts[0].monitor
+        monitor.mark_down('connection refused')
+        monitor._checked_at -= monitor.ttl + 1
+        self.ollama_body = b'{"response": "ok", "done": true}\n'
+        
+        body = self.asgi_get(f'/api/chat/stream/{self.create_chat_message().id}').text
+        
+        self.assertNotIn('AI service unavailable', body)
+
 def run_tests():
     """Run all tests with detailed output."""
     loader = unittest.TestLoader()
@@ -379,10 +2855,33 @@ def run_tests():
         APITestCase,
         ModelTestCase,
         UtilityFunctionTestCase,
+        KeywordMatcherTestCase,
+        UrgencyClassifierTestCase,
         SecurityTestCase,
+        RateLimiterTestCase,
+        SystemLogWriterTestCase,
         DataRetentionTestCase,
         IntegrationTestCase,
-        PerformanceTestCase
+        PerformanceTestCase,
+        OllamaMonitorTestCase,
+        OllamaStreamingTestCase,
+        AsyncStreamingTestCase,
+        NDJSONDecoderTestCase,
+        GenerationSchedulerTestCase,
+        GenerationAdmissionTestCase,
+        ResponseCacheTestCase,
+        EarlyUrgencyTestCase,
+        StaffDashboardQueryTestCase,
+        DashboardEventsTestCase,
+        DataExportTestCase,
+        TriageStatsTestCase,
+        SQLiteTuningTestCase,
+        CircuitBreakerTestCase,
+        ModelRoutingTestCase,
+        OllamaHostPoolTestCase,
+        HedgedTriageTestCase,
+        ModelWarmupTestCase,
+        BackgroundServicesTestCase
     ]
     
     for test_case in test_cases:
@@ -0,0 +1,147 @@
+"""
+urgency_classifier.py - Urgency level extraction from AI triage responses
+
+The triage prompt asks the model to open with ``**URGENCY LEVEL:** <level>``.
+When that header is present it is authoritative.  Otherwise the response is
+tokenised once and scored on red-flag words, skipping negated mentions such
+as "this is not an emergency".
+
+``UrgencyClassifier`` consumes text incrementally, so the same logic can run
+on a stream of tokens and report the header as soon as it has arrived.
+"""
+
+import re
+from collections import namedtuple
+
+EMERGENCY, URGENT, STANDARD, SELF_CARE = 'Emergency', 'Urgent', 'Standard', 'Self-care'
+
+# Most severe first: the highest level with any supporting signal wins
+LEVELS = (EMERGENCY, URGENT, STANDARD, SELF_CARE)
+
+# Stored for canned answers sent while no model was available; not one of LEVELS
+UNASSESSED = 'Unassessed'
+
+UrgencyResult = namedtuple('UrgencyResult', ['level', 'confidence', 'source'])
+
+HEADER_CONFIDENCE = 0.95
+DEFAULT_CONFIDENCE = 0.3
+
+_HEADER = re.compile(
+    r'urgency[\s_]+level[\s*:\-]*\[?\s*\**\s*'
+    r'(emergency|urgent|standard|self[\s-]?care)\b'
+    r'(?![\s*]*/)',  # the prompt's own "[Emergency/Urgent/...]" template is not an answer
+    re.IGNORECASE
+)
+_HEADER_LEVELS = {'emergency': EMERGENCY, 'urgent': URGENT, 'standard': STANDARD}
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:['’&-][a-z0-9]+)*|[.!?;:,\n]", re.IGNORECASE)
+_PARTIAL_TOKEN = re.compile(r"[a-z0-9'’&-]*$", re.IGNORECASE)
+
+SIGNALS = {
+    'emergency': EMERGENCY, 'emergencies': EMERGENCY, '999': EMERGENCY,
+    'life-threatening': EMERGENCY, 'a&e': EMERGENCY,
+    'urgent': URGENT, 'urgently': URGENT, '111': URGENT,
+    'immediate': URGENT, 'immediately': URGENT,
+    'gp': STANDARD, 'gps': STANDARD, 'doctor': STANDARD, 'doctors': STANDARD,
+    'appointment': STANDARD,
+    'self-care': SELF_CARE, 'self-manage': SELF_CARE, 'self-management': SELF_CARE,
+}
+NEGATORS = {
+    'not', 'no', 'never', 'nor', 'without', 'unlikely', "isn't", 'isnt',
+    "aren't", "doesn't", "don't", 'dont', "won't", "wouldn't",
+}
+# Words that may sit between a negator and the signal it negates ("not a medical emergency")
+NEGATION_FILLERS = {
+    'a', 'an', 'the', 'be', 'is', 'or', 'medical', 'likely', 'currently',
+    'necessarily', 'really', 'considered', 'yet', 'need', 'needed', 'to', 'for',
+}
+_CLAUSE_BREAKS = set('.!?;:,\n')
+
+
+class UrgencyClassifier:
+    """Incremental urgency classifier over a streamed AI response."""
+
+    def __init__(self, header_window=600):
+        self.header_window = header_window
+        self.header = None  # UrgencyResult once the header has been read
+        self.counts = dict.fromkeys(LEVELS, 0)
+        self.negated = 0
+
+        self._head = ''
+        self._tail = ''
+        self._negating = False
+        self._previous = None
+        self._in_header_line = False
+
+    def feed(self, text):
+        """Consume more response text.
+
+        Returns the header ``UrgencyResult`` on the call that resolves it and
+        ``None`` otherwise.
+        """
+        resolved = self._read_header(text, final=False)
+        self._scan(text, final=False)
+        return resolved
+
+    def finish(self):
+        """Flush buffered text and return the final ``UrgencyResult``."""
+        self._read_header('', final=True)
+        self._scan('', final=True)
+        return self.result()
+
+    def result(self):
+        if self.header:
+            return self.header
+        for level in LEVELS:
+            if self.counts[level]:
+                return UrgencyResult(level, min(0.8, 0.5 + 0.1 * self.counts[level]), 'keywords')
+        return UrgencyResult(SELF_CARE, DEFAULT_CONFIDENCE, 'default')
+
+    def _read_header(self, text, final):
+        if self.header or len(self._head) >= self.header_window:
+            return None
+        self._head += text[:self.header_window - len(self._head)]
+        match = _HEADER.search(self._head)
+        # Wait for a character after the level so "Urgent" cannot still become "Urgent/..."
+        if not match or (match.end() == len(self._head) and not final):
+            return None
+        word = match.group(1).lower()
+        self.header = UrgencyResult(_HEADER_LEVELS.get(word, SELF_CARE), HEADER_CONFIDENCE, 'header')
+        return self.header
+
+    def _scan(self, text, final):
+        data = self._tail + text
+        if final:
+            self._tail = ''
+        else:
+            cut = _PARTIAL_TOKEN.search(data).start()
+            data, self._tail = data[:cut], data[cut:]
+
+        for match in _TOKEN.finditer(data):
+            token = match.group(0).lower().replace('’', "'")
+            previous, self._previous = self._previous, token
+            if token == '\n':
+                self._in_header_line = False
+            if token == 'level' and previous == 'urgency':
+                # The header line is read by _read_header; its level words are not body evidence
+                self._in_header_line = True
+            elif self._in_header_line:
+                continue
+            if token in _CLAUSE_BREAKS:
+                self._negating = False
+            elif token in NEGATORS:
+                self._negating = True
+            elif token in SIGNALS:
+                if self._negating:
+                    self.negated += 1
+                else:
+                    self.counts[SIGNALS[token]] += 1
+            elif token not in NEGATION_FILLERS:
+                self._negating = False
+
+
+def classify_urgency(text):
+    """Classify a complete response in one pass."""
+    classifier = UrgencyClassifier()
+    classifier.feed(text or '')
+    return classifier.finish()
@@ -0,0 +1,131 @@
+"""
+wsgi_adapter.py - Serve the Flask WSGI app from the ASGI entry point
+
+asgiref's ``WsgiToAsgi`` runs every WSGI request on one shared thread, which
+would serialize all non-streaming Flask requests behind each other.  Flask
+is thread-safe, so ``WSGIAdapter`` runs each request on anyio's worker
+thread pool instead, as a threaded WSGI server would.  It is written against
+PEP 3333, the ASGI HTTP spec and anyio's public thread API only, so no
+library upgrade can change its behaviour underneath us.
+"""
+
+import sys
+from tempfile import SpooledTemporaryFile
+
+import anyio.from_thread
+import anyio.to_thread
+
+
+def build_environ(scope, body):
+    """The WSGI environ for an ASGI HTTP ``scope`` whose request body is in ``body``."""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin1').upper().replace('-', '_'), value.decode('latin1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        # Repeated headers are folded into one comma-separated value
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class WSGIResponse:
+    """``start_response`` and body relay for one request, used from its worker thread."""
+
+    def __init__(self, send):
+        self.send = send
+        self.start = None
+        self.started = False
+        self.content_length = None
+        self.sent = 0
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info and self.started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        self.content_length = None
+        for name, value in headers:
+            if name.lower() == 'content-length':
+                self.content_length = int(value)
+        self.start = {
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers],
+        }
+        return self.write
+
+    def write(self, data):
+        if not self.started:
+            self.started = True
+            self.send(self.start)
+        if self.content_length is not None:
+            # Never send more than the declared Content-Length
+            data = data[:self.content_length - self.sent]
+        if data:
+            self.send({'type': 'http.response.body', 'body': data, 'more_body': True})
+            self.sent += len(data)
+
+    @property
+    def complete(self):
+        return self.content_length is not None and self.sent >= self.content_length
+
+    def finish(self):
+        if not self.started:
+            self.started = True
+            self.send(self.start)
+        self.send({'type': 'http.response.body'})
+
+
+class WSGIAdapter:
+    """ASGI application serving ``wsgi_application`` on worker threads."""
+
+    def __init__(self, wsgi_application, max_body_in_memory=65536):
+        self.wsgi_application = wsgi_application
+        self.max_body_in_memory = max_body_in_memory
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise ValueError("WSGI adapter received a non-HTTP scope")
+        with SpooledTemporaryFile(max_size=self.max_body_in_memory) as body:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            await anyio.to_thread.run_sync(self.serve, scope, body, send)
+
+    def serve(self, scope, body, send):
+        """Run the WSGI app on this worker thread, relaying its response to the event loop."""
+        response = WSGIResponse(lambda message: anyio.from_thread.run(send, message))
+        result = self.wsgi_application(build_environ(scope, body), response.start_response)
+        try:
+            for output in result:
+                response.write(output)
+                if response.complete:
+                    break
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        response.finish()